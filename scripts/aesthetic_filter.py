@@ -1,11 +1,16 @@
 import os
-import time
-import requests
-from io import BytesIO
-from PIL import Image
+import argparse
+import numpy as np
+from typing import Any, Dict, List, Set
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from sentence_transformers import SentenceTransformer
+
+import http_client
+import stage_metrics
+import vector_store
+from anchor_sets import load_anchor_set
+from embedding_cache import open_default_cache
+from image_pipeline import ImagePipeline
 
 # Load environment variables
 ENV_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env.local")
@@ -18,89 +23,152 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     raise Exception("Missing Supabase credentials")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+stage_metrics.instrument_supabase(supabase)
 
-# Initialize CLIP model for aesthetic verification
-print("Loading CLIP model...")
-model = SentenceTransformer('clip-ViT-B-32')
-
-# Aesthetic parameters (target concepts)
-TARGET_AESTHETICS = [
-    "avant-garde fashion", 
-    "archive fashion", 
-    "gorpcore outdoor wear", 
-    "y2k streetwear", 
-    "high fashion runway",
-    "minimalist luxury",
-    "vintage designer clothing"
-]
-target_embeddings = model.encode(TARGET_AESTHETICS)
-
-# Threshold for acceptance
-AESTHETIC_THRESHOLD = 0.22
-
-def process_unverified_assets():
-    print("Fetching unverified assets...")
-    response = supabase.table('unverified_assets').select('*').eq('status', 'pending').limit(50).execute()
-    assets = response.data
-    
-    if not assets:
-        print("No pending assets found.")
-        return
+# Target concepts with per-concept thresholds; anchors are encoded once per prompt set and model
+ANCHOR_SET = os.getenv("AESTHETIC_ANCHOR_SET", "aesthetic")
+anchors = load_anchor_set(ANCHOR_SET)
 
-    for asset in assets:
+# Queue draining: pages of pending assets are scored until none are left
+PAGE_SIZE = int(os.getenv("AESTHETIC_PAGE_SIZE", "50"))
+DOWNLOAD_WORKERS = int(os.getenv("AESTHETIC_DOWNLOAD_WORKERS", "8"))
+# Largest forward pass; a default-sized page is encoded in one go
+MAX_ENCODE_BATCH = 64
+STATUS_CHUNK_SIZE = 200
+
+def fetch_image_bytes(image_url: str) -> bytes:
+    return http_client.get_bytes(image_url, timeout=10)
+
+def build_inventory_row(asset: Dict[str, Any], embedding: np.ndarray) -> Dict[str, Any]:
+    insert_data = {
+        'vinted_id': asset['vinted_id'],
+        'brand': asset['brand'],
+        'title': asset['title'],
+        'source_url': asset['source_url'],
+        'source_price': asset['source_price'],
+        'listing_price': asset['listing_price'],
+        'images': asset['images'],
+        'category': asset['category'],
+        'locale': asset['locale'],
+        'shipping_zone': asset['shipping_zone'],
+        'status': 'available',
+        'style_embedding': vector_store.json_vector(embedding) # Pre-calculate vector!
+    }
+    if 'submitted_by_user_id' in asset and asset['submitted_by_user_id']:
+        insert_data['submitted_by_user_id'] = asset['submitted_by_user_id']
+    return insert_data
+
+def insert_approved(approved: List[Dict[str, Any]], embeddings: Dict[Any, np.ndarray]) -> Set[Any]:
+    """Bulk-inserts approved assets into pulse_inventory; returns ids that could not be inserted."""
+    if not approved:
+        return set()
+    try:
+        supabase.table('pulse_inventory').insert([build_inventory_row(a, embeddings[a['id']]) for a in approved]).execute()
+        return set()
+    except Exception as e:
+        # One bad row fails the whole statement; retry individually to isolate it
+        print(f"Bulk insert of {len(approved)} approvals failed ({e}), retrying one by one...")
+
+    failed = set()
+    for asset in approved:
         try:
-            image_url = asset['images'][0]
-            print(f"Processing {asset['id']} - {asset['title']}")
-            
-            # Download image
-            img_response = requests.get(image_url, timeout=10)
-            img = Image.open(BytesIO(img_response.content)).convert("RGB")
-            
-            # Encode image
-            img_embedding = model.encode(img)
-            
-            # Calculate similarities against targets
-            # Since we use SentenceTransformer, cosine similarity is just dot product if normalized
-            from sentence_transformers.util import cos_sim
-            similarities = cos_sim(img_embedding, target_embeddings)[0]
-            max_sim = float(max(similarities))
-            
-            print(f"Max Aesthetic Score: {max_sim:.4f}")
-            
-            if max_sim >= AESTHETIC_THRESHOLD:
-                print("✅ Approved!")
-                
-                # Insert into pulse_inventory
-                insert_data = {
-                    'vinted_id': asset['vinted_id'],
-                    'brand': asset['brand'],
-                    'title': asset['title'],
-                    'source_url': asset['source_url'],
-                    'source_price': asset['source_price'],
-                    'listing_price': asset['listing_price'],
-                    'images': asset['images'],
-                    'category': asset['category'],
-                    'locale': asset['locale'],
-                    'shipping_zone': asset['shipping_zone'],
-                    'status': 'available',
-                    'style_embedding': img_embedding.tolist() # Pre-calculate vector!
-                }
-                
-                if 'submitted_by_user_id' in asset and asset['submitted_by_user_id']:
-                    insert_data['submitted_by_user_id'] = asset['submitted_by_user_id']
-
-                supabase.table('pulse_inventory').insert(insert_data).execute()
-                
-                # Mark as approved
-                supabase.table('unverified_assets').update({'status': 'approved'}).eq('id', asset['id']).execute()
-            else:
-                print("❌ Rejected.")
-                # Mark as rejected
-                supabase.table('unverified_assets').update({'status': 'rejected'}).eq('id', asset['id']).execute()
-                
+            supabase.table('pulse_inventory').insert(build_inventory_row(asset, embeddings[asset['id']])).execute()
+        except Exception as e:
+            print(f"Error inserting asset {asset['id']}: {e}")
+            failed.add(asset['id'])
+    return failed
+
+def set_status(ids: List[Any], status: str) -> None:
+    for i in range(0, len(ids), STATUS_CHUNK_SIZE):
+        chunk = ids[i:i + STATUS_CHUNK_SIZE]
+        try:
+            supabase.table('unverified_assets').update({'status': status}).in_('id', chunk).execute()
         except Exception as e:
-            print(f"Error processing asset {asset['id']}: {e}")
-            supabase.table('unverified_assets').update({'status': 'error'}).eq('id', asset['id']).execute()
+            print(f"Error marking {len(chunk)} assets as {status}: {e}")
+
+def process_page(assets: List[Dict[str, Any]], pipeline: ImagePipeline) -> Dict[str, int]:
+    """Downloads, encodes and scores one page of assets, then writes the outcome in bulk."""
+    errored: List[Any] = []
+    jobs = []
+    for asset in assets:
+        images = asset.get('images') or []
+        if images:
+            jobs.append((asset, images[0]))
+        else:
+            print(f"Error processing asset {asset['id']}: no images")
+            errored.append(asset['id'])
+
+    encoded = []
+    for results in pipeline.run(jobs):
+        for asset, _, embedding, error in results:
+            if embedding is None:
+                print(f"Error processing asset {asset['id']}: {error}")
+                errored.append(asset['id'])
+            else:
+                encoded.append((asset, embedding))
+
+    approved, rejected = [], []
+    embeddings = {asset['id']: embedding for asset, embedding in encoded}
+    if encoded:
+        concepts, scores, verdicts = anchors.match(np.stack([e for _, e in encoded]))
+    else:
+        concepts, scores, verdicts = [], [], []
+    for (asset, _), concept, score, passed in zip(encoded, concepts, scores, verdicts):
+        print(f"{'✅' if passed else '❌'} {asset['id']} - {asset['title']}: {score:.4f} ({anchors.concepts[concept]})")
+        (approved if passed else rejected).append(asset)
+
+    failed = insert_approved(approved, embeddings)
+    set_status([a['id'] for a in approved if a['id'] not in failed], 'approved')
+    set_status([a['id'] for a in rejected], 'rejected')
+    set_status(errored + list(failed), 'error')
+    return {"approved": len(approved) - len(failed), "rejected": len(rejected), "error": len(errored) + len(failed)}
+
+def process_unverified_assets(drain: bool = True):
+    # Re-submitted and cross-posted images are scored without a new encode
+    cache = open_default_cache()
+    pipeline = ImagePipeline(
+        fetch=fetch_image_bytes,
+        batch_size=min(PAGE_SIZE, MAX_ENCODE_BATCH),
+        download_workers=DOWNLOAD_WORKERS,
+        cache=cache
+    )
+    totals = {"approved": 0, "rejected": 0, "error": 0}
+    processed = 0
+    last_id = None
+
+    while True:
+        print("Fetching unverified assets...")
+        # Keyset-paged by id: rows whose status update failed stay pending, and the
+        # cursor moves past them instead of fetching them again (once per run)
+        query = supabase.table('unverified_assets').select('*').eq('status', 'pending').order('id').limit(PAGE_SIZE)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        assets = query.execute().data or []
+        if not assets:
+            break
+        last_id = assets[-1]['id']
+        processed += len(assets)
+
+        stage_metrics.incr("items", len(assets))
+        for outcome, count in process_page(assets, pipeline).items():
+            totals[outcome] += count
+            stage_metrics.incr(outcome, count)
+        if not drain or len(assets) < PAGE_SIZE:
+            break
+
+    if not processed:
+        print("No pending assets found.")
+    else:
+        print(f"Processed {processed} assets: {totals['approved']} approved, "
+              f"{totals['rejected']} rejected, {totals['error']} errors")
+
+    if cache is not None:
+        print(f"Embedding cache: {cache.stats()}")
+        cache.close()
+    print(f"HTTP: {http_client.default_client().stats_dict()}")
 
 if __name__ == "__main__":
-    process_unverified_assets()
+    parser = argparse.ArgumentParser(description="Score pending unverified assets against the target aesthetics.")
+    parser.add_argument("--once", action="store_true", help="Process a single page instead of draining the queue")
+    args = parser.parse_args()
+    process_unverified_assets(drain=not args.once)
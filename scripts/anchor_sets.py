@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import fcntl
+import hashlib
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import clip_encoder
+
+# --- CONFIGURATION ---
+CACHE_DIR = os.getenv("ANCHOR_CACHE_DIR", "cache/anchors")
+DEFAULT_THRESHOLD = 0.22
+
+# The aesthetic filter's target concepts (originally its TARGET_AESTHETICS)
+AESTHETIC_CONCEPTS = [
+    "avant-garde fashion",
+    "archive fashion",
+    "gorpcore outdoor wear",
+    "y2k streetwear",
+    "high fashion runway",
+    "minimalist luxury",
+    "vintage designer clothing",
+]
+
+# Named anchor sets: concept → phrasings averaged into one anchor, and the
+# cosine similarity an image needs against that anchor to match it.
+# Editing prompts (or switching model) re-encodes the set on next load;
+# thresholds are read from here and can be tuned without a re-encode.
+ANCHOR_SETS: Dict[str, Dict[str, Dict]] = {
+    # One prompt per concept, exactly the anchors DEFAULT_THRESHOLD was tuned against
+    "aesthetic": {concept: {"prompts": [concept]} for concept in AESTHETIC_CONCEPTS},
+    # Opt-in (AESTHETIC_ANCHOR_SET=aesthetic-ensemble). A mean of several phrasings
+    # usually scores higher than any single prompt, so these thresholds still need
+    # calibrating against the single-prompt set's decisions before production use.
+    "aesthetic-ensemble": {
+        "avant-garde fashion": {
+            "prompts": ["avant-garde fashion", "a photo of avant-garde designer clothing",
+                        "deconstructed experimental garment"],
+        },
+        "archive fashion": {
+            "prompts": ["archive fashion", "a photo of an archive designer piece",
+                        "rare runway archive clothing"],
+        },
+        "gorpcore outdoor wear": {
+            "prompts": ["gorpcore outdoor wear", "a photo of technical outdoor clothing",
+                        "hiking shell jacket streetwear"],
+        },
+        "y2k streetwear": {
+            "prompts": ["y2k streetwear", "a photo of early 2000s streetwear",
+                        "y2k fashion clothing"],
+        },
+        "high fashion runway": {
+            "prompts": ["high fashion runway", "a photo of a runway look",
+                        "luxury designer runway garment"],
+        },
+        "minimalist luxury": {
+            "prompts": ["minimalist luxury", "a photo of minimalist luxury clothing",
+                        "clean understated designer garment"],
+        },
+        "vintage designer clothing": {
+            "prompts": ["vintage designer clothing", "a photo of a vintage designer garment",
+                        "90s designer vintage piece"],
+        },
+    },
+}
+
+def set_digest(concepts: Dict[str, Dict], model: str) -> str:
+    """Hash of everything the anchor vectors depend on: concept names, prompts and model."""
+    spec = {"model": model, "concepts": {name: list(c["prompts"]) for name, c in concepts.items()}}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class AnchorSet:
+    """
+    Unit-norm anchor vectors for one named set, with per-concept thresholds.
+
+    Each anchor is the normalized mean of its prompts' text embeddings, so an
+    image is scored against all concepts with a single matmul.
+    """
+
+    def __init__(self, name: str, concepts: List[str], embeddings: np.ndarray, thresholds: np.ndarray):
+        self.name = name
+        self.concepts = concepts
+        self.embeddings = embeddings
+        self.thresholds = thresholds
+
+    def similarities(self, vectors: np.ndarray) -> np.ndarray:
+        """(N, K) cosine similarity of each vector (rows) against every anchor."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return unit @ self.embeddings.T
+
+    def match(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (concept_index, similarity, passed) arrays per vector.
+
+        A vector passes when it clears any anchor's own threshold; the concept
+        reported is the one it clears by the widest margin (or misses by the least).
+        """
+        sims = self.similarities(vectors)
+        margins = sims - self.thresholds
+        best = margins.argmax(axis=1)
+        rows = np.arange(len(sims))
+        return best, sims[rows, best], margins[rows, best] >= 0
+
+def encode_anchors(concepts: Dict[str, Dict]) -> np.ndarray:
+    """Encodes every prompt in one pass and averages them per concept."""
+    prompts = [p for c in concepts.values() for p in c["prompts"]]
+    encoded = clip_encoder.encode_texts(prompts)
+    encoded /= np.linalg.norm(encoded, axis=1, keepdims=True)
+    anchors, start = [], 0
+    for c in concepts.values():
+        end = start + len(c["prompts"])
+        anchors.append(encoded[start:end].mean(axis=0))
+        start = end
+    anchors = np.stack(anchors)
+    return (anchors / np.linalg.norm(anchors, axis=1, keepdims=True)).astype(np.float32)
+
+def cache_path(name: str, digest: str, cache_dir: str = CACHE_DIR) -> str:
+    return os.path.join(cache_dir, f"{name}-{digest}.npy")
+
+def load_anchor_set(name: str, cache_dir: str = CACHE_DIR, model: Optional[str] = None) -> AnchorSet:
+    """
+    Loads a named anchor set, encoding and caching it only when no file
+    matches the current prompts and model.
+    """
+    concepts = ANCHOR_SETS[name]
+    digest = set_digest(concepts, model or clip_encoder.model_key())
+    path = cache_path(name, digest, cache_dir)
+    thresholds = np.array([c.get("threshold", DEFAULT_THRESHOLD) for c in concepts.values()], dtype=np.float32)
+
+    if not os.path.exists(path) and model is None:
+        # Encoding needs the model anyway; load it first so the key names the backend that loaded
+        clip_encoder.load_model()
+        digest = set_digest(concepts, clip_encoder.model_key())
+        path = cache_path(name, digest, cache_dir)
+
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Several scripts start together under the sentinel; only one should load CLIP for this
+        with open(f"{path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                logging.info(f"🎯 Encoding anchor set '{name}' ({len(concepts)} concepts, key {digest})...")
+                tmp_path = f"{path}.tmp.npy"
+                np.save(tmp_path, encode_anchors(concepts))
+                os.replace(tmp_path, path)
+
+    return AnchorSet(name, list(concepts), np.load(path), thresholds)
+
+def prune(cache_dir: str = CACHE_DIR) -> int:
+    """Deletes cached sets whose prompts or model no longer match; returns the count."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    model = clip_encoder.model_key()
+    current = {os.path.basename(cache_path(name, set_digest(c, model), cache_dir)) for name, c in ANCHOR_SETS.items()}
+    removed = 0
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(".npy") and filename not in current:
+            os.remove(os.path.join(cache_dir, filename))
+            removed += 1
+        elif filename.endswith(".lock") and filename[:-len(".lock")] not in current:
+            os.remove(os.path.join(cache_dir, filename))
+    return removed
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Precomputed CLIP anchor embeddings for named prompt sets.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Encode any anchor set missing for the current model")
+    build_cmd.add_argument("--prune", action="store_true", help="Also delete caches for outdated prompts or models")
+    sub.add_parser("list", help="Show anchor sets, their cache keys and whether they are built")
+    args = parser.parse_args()
+
+    model = clip_encoder.model_key()
+    if args.command == "build":
+        for name in ANCHOR_SETS:
+            load_anchor_set(name)
+        if args.prune:
+            logging.info(f"🧹 Removed {prune()} outdated anchor caches")
+    elif args.command == "list":
+        for name, concepts in ANCHOR_SETS.items():
+            digest = set_digest(concepts, model)
+            built = os.path.exists(cache_path(name, digest))
+            print(f"{name}: {len(concepts)} concepts, key {digest} ({model}), {'built' if built else 'not built'}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,437 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from vector_store import VectorStore, pull, vector_key
+
+# --- CONFIGURATION ---
+INDEX_PATH = os.getenv(
+    "ANN_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "ann_index.npz")
+)
+EMBEDDING_DIM = 512
+# Lists probed per query; higher trades latency for recall
+NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+# Below this many vectors a flat scan is as fast as IVF and needs no training
+MIN_TRAIN_SIZE = 2000
+TRAIN_SAMPLE = 50000
+KMEANS_ITERATIONS = 10
+# Re-cluster once the index has grown this much past the size it was trained on
+RETRAIN_GROWTH = 2.0
+METADATA_FIELDS = ("product_id", "image_url", "source", "category", "status")
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _list_count(n: int) -> int:
+    return int(np.clip(2 * np.sqrt(n), 16, 4096))
+
+def spherical_kmeans(data: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Clusters unit vectors by cosine similarity; returns (k, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign_lists(data, centroids)
+        order = np.argsort(labels, kind="stable")
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids[present] = sums
+        # Re-seed empty clusters from random points so no list stays unused
+        empty = np.setdiff1d(np.arange(k), present)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+        centroids = _normalize(centroids)
+    return centroids
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for i in range(0, len(vectors), chunk):
+        labels[i:i + chunk] = np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1)
+    return labels
+
+class IVFIndex:
+    """
+    Inverted-file cosine index over unit-normalized CLIP vectors.
+
+    Vectors are clustered into ~2·sqrt(N) lists; a query scores the centroids,
+    scans the `nprobe` closest lists and ranks those candidates exactly.
+    Rows carry string metadata (see METADATA_FIELDS) that queries can filter
+    on. Ids are upserted in place, so re-syncing an item never duplicates it.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.size = 0
+        self.ids: List[str] = []
+        self.metadata: Dict[str, List[Optional[str]]] = {f: [] for f in METADATA_FIELDS}
+        self.alive = np.empty(0, dtype=bool)
+        self.labels = np.empty(0, dtype=np.int32)
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_on = 0
+        self._rows: Dict[str, int] = {}
+        self._lists: Optional[List[np.ndarray]] = None
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return int(self.alive[:self.size].sum())
+
+    def _reserve(self, extra: int) -> None:
+        needed = self.size + extra
+        if needed <= len(self.vectors):
+            return
+        capacity = max(needed, int(len(self.vectors) * 1.5), 1024)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        labels = np.zeros(capacity, dtype=np.int32)
+        labels[:self.size] = self.labels[:self.size]
+        self.vectors, self.alive, self.labels = vectors, alive, labels
+
+    def _invalidate(self) -> None:
+        self._lists = None
+        self._columns = {}
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray, metadata: Optional[Sequence[Dict[str, Any]]] = None,
+            train: bool = True) -> None:
+        """Inserts or replaces rows by id; `train=False` defers (re-)clustering to an explicit train()."""
+        vectors = _normalize(np.atleast_2d(vectors))
+        self._reserve(len(ids))
+        for i, item_id in enumerate(ids):
+            item_id = str(item_id)
+            row = self._rows.get(item_id)
+            if row is None:
+                row = self.size
+                self.size += 1
+                self._rows[item_id] = row
+                self.ids.append(item_id)
+                for field in METADATA_FIELDS:
+                    self.metadata[field].append(None)
+            self.vectors[row] = vectors[i]
+            self.alive[row] = True
+            for field, value in (metadata[i] if metadata else {}).items():
+                if field in self.metadata:
+                    self.metadata[field][row] = None if value is None else str(value)
+            if self.centroids is not None:
+                self.labels[row] = int(np.argmax(self.centroids @ vectors[i]))
+        self._invalidate()
+
+        if not train:
+            return
+        if self.centroids is None and len(self) >= MIN_TRAIN_SIZE:
+            self.train()
+        elif self.centroids is not None and len(self) > self.trained_on * RETRAIN_GROWTH:
+            self.train()
+
+    def remove(self, ids: Sequence[str]) -> None:
+        for item_id in ids:
+            row = self._rows.get(str(item_id))
+            if row is not None:
+                self.alive[row] = False
+        self._invalidate()
+
+    def update_metadata(self, field: str, values: Dict[str, Optional[str]]) -> int:
+        """Sets one metadata field for existing ids; returns how many rows changed."""
+        changed = 0
+        column = self.metadata[field]
+        for item_id, value in values.items():
+            row = self._rows.get(str(item_id))
+            value = None if value is None else str(value)
+            if row is not None and column[row] != value:
+                column[row] = value
+                changed += 1
+        if changed:
+            self._columns.pop(field, None)
+        return changed
+
+    def train(self) -> None:
+        live = np.flatnonzero(self.alive[:self.size])
+        nlist = _list_count(len(live))
+        sample = live if len(live) <= TRAIN_SAMPLE else np.random.default_rng(0).choice(live, TRAIN_SAMPLE, replace=False)
+        started = time.monotonic()
+        self.centroids = spherical_kmeans(self.vectors[sample], nlist)
+        self.labels[:self.size] = assign_lists(self.vectors[:self.size], self.centroids)
+        self.trained_on = len(live)
+        self._invalidate()
+        logging.info(f"🧭 ANN index trained: {nlist} lists over {len(live)} vectors in {time.monotonic() - started:.1f}s")
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        if self._lists is None:
+            live = np.flatnonzero(self.alive[:self.size])
+            order = live[np.argsort(self.labels[live], kind="stable")]
+            bounds = np.searchsorted(self.labels[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        return self._lists
+
+    def _column(self, field: str) -> np.ndarray:
+        if field not in self._columns:
+            self._columns[field] = np.asarray(self.metadata[field][:self.size], dtype=object)
+        return self._columns[field]
+
+    def _filter_mask(self, rows: np.ndarray, filters: Optional[Dict[str, Any]]) -> np.ndarray:
+        mask = np.ones(len(rows), dtype=bool)
+        for field, wanted in (filters or {}).items():
+            if wanted is None:
+                continue
+            wanted = [str(w) for w in wanted] if isinstance(wanted, (list, tuple, set)) else [str(wanted)]
+            mask &= np.isin(self._column(field)[rows], wanted)
+        return mask
+
+    def search(self, query: np.ndarray, k: int = 10, filters: Optional[Dict[str, Any]] = None,
+               nprobe: int = NPROBE) -> List[Dict[str, Any]]:
+        """Returns up to k rows most similar to `query`, best first, with their metadata."""
+        if self.size == 0:
+            return []
+        query = _normalize(query).reshape(-1)
+
+        if self.centroids is None:
+            rows = np.flatnonzero(self.alive[:self.size])
+        else:
+            lists = self._inverted_lists()
+            nprobe = min(max(1, nprobe), len(lists))
+            probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            rows = np.concatenate([lists[p] for p in probes])
+        rows = rows[self._filter_mask(rows, filters)]
+
+        if len(rows) < k and filters and self.centroids is not None:
+            # Selective filters can empty the probed lists; fall back to scanning every match
+            live = np.flatnonzero(self.alive[:self.size])
+            rows = live[self._filter_mask(live, filters)]
+        if len(rows) == 0:
+            return []
+
+        scores = self.vectors[rows] @ query
+        top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._result(int(rows[i]), float(scores[i])) for i in top]
+
+    def _result(self, row: int, score: float) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"id": self.ids[row], "similarity": round(score, 6)}
+        for field in METADATA_FIELDS:
+            result[field] = self.metadata[field][row]
+        return result
+
+    def save(self, path: str = INDEX_PATH) -> None:
+        """Writes the index as one .npz, atomically replacing the previous file."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = json.dumps({"ids": self.ids, "metadata": self.metadata, "trained_on": self.trained_on})
+        arrays = {
+            "vectors": self.vectors[:self.size],
+            "alive": self.alive[:self.size],
+            "labels": self.labels[:self.size],
+            "meta": np.frombuffer(meta.encode("utf-8"), dtype=np.uint8),
+        }
+        if self.centroids is not None:
+            arrays["centroids"] = self.centroids
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = INDEX_PATH) -> "IVFIndex":
+        with np.load(path) as data:
+            index = cls(dim=data["vectors"].shape[1])
+            index.vectors = data["vectors"].astype(np.float32, copy=False)
+            index.alive = data["alive"]
+            index.labels = data["labels"]
+            index.centroids = data["centroids"] if "centroids" in data else None
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+        index.size = len(index.vectors)
+        index.ids = meta["ids"]
+        index.metadata = {f: meta["metadata"].get(f, [None] * index.size) for f in METADATA_FIELDS}
+        index.trained_on = meta["trained_on"]
+        index._rows = {item_id: row for row, item_id in enumerate(index.ids)}
+        return index
+
+@contextmanager
+def locked_index(path: str = INDEX_PATH) -> Iterator[IVFIndex]:
+    """Loads (or creates) the index under an exclusive file lock and saves it on exit."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = IVFIndex.load(path) if os.path.exists(path) else IVFIndex()
+        yield index
+        index.save(path)
+
+def update_index(entries: List[Dict[str, Any]], statuses: Optional[Dict[str, str]] = None,
+                 path: str = INDEX_PATH) -> None:
+    """
+    Upserts {"product_id", "image_url", "embedding", "source", "category", "status"}
+    entries and refreshes the status of known products. Never raises: the
+    index is derived data and a failed update is repaired by `build`. Does
+    nothing until the index has been built once, so it is never partial.
+    """
+    if not entries and not statuses:
+        return
+    if not os.path.exists(path):
+        logging.info("🧭 ANN index not built yet; skipping update (run `python3 scripts/ann_index.py build`)")
+        return
+    try:
+        with locked_index(path) as index:
+            if entries:
+                index.add(
+                    [vector_key(e.get("product_id"), e["image_url"]) for e in entries],
+                    np.asarray([e["embedding"] for e in entries], dtype=np.float32),
+                    [{f: e.get(f) for f in METADATA_FIELDS} for e in entries]
+                )
+            changed = index.update_metadata("status", {f"product:{pid}": s for pid, s in (statuses or {}).items()})
+        logging.info(f"🧭 ANN index: {len(entries)} vectors upserted, {changed} statuses refreshed ({len(index)} total)")
+    except Exception as e:
+        logging.warning(f"⚠️ ANN index update failed ({e}); run `python3 scripts/ann_index.py build` to rebuild")
+
+class IndexReader:
+    """Read side for long-running servers: reloads the index when another process replaces it."""
+
+    def __init__(self, path: str = INDEX_PATH):
+        self.path = path
+        self._index: Optional[IVFIndex] = None
+        self._mtime = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[IVFIndex]:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._index = IVFIndex.load(self.path)
+                    self._mtime = mtime
+                    logging.info(f"🧭 Loaded ANN index ({len(self._index)} vectors)")
+        return self._index
+
+# --- CLI ---
+
+def build(path: str = INDEX_PATH, sync: bool = True, chunk: int = 20000) -> None:
+    """Rebuilds the index from the local vector store, refreshing it and product statuses from Supabase first."""
+    store = VectorStore()
+    statuses: Dict[str, str] = {}
+    if sync:
+        from dotenv import load_dotenv
+        from supabase import create_client
+
+        load_dotenv(".env.local") if os.path.exists(".env.local") else load_dotenv()
+        supabase = create_client(
+            os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL"),
+            os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        )
+        logging.info(f"🗄️ Refreshed vector store: {pull(supabase, store)} vectors pulled")
+        offset = 0
+        while True:
+            page = supabase.table("pulse_inventory").select("id, status").order("id") \
+                .range(offset, offset + 999).execute().data or []
+            statuses.update((str(row["id"]), row["status"]) for row in page)
+            if len(page) < 1000:
+                break
+            offset += 1000
+
+    # Read straight off the memmap in chunks; the index keeps its own normalized float32 copy
+    vectors = store.vectors()
+    metadata = list(store.metadata())
+    index = IVFIndex(dim=store.dim)
+    for i in range(0, len(metadata), chunk):
+        rows = metadata[i:i + chunk]
+        index.add(
+            [m["key"] for m in rows],
+            vectors[[m["row"] for m in rows]],
+            [{**m, "status": statuses.get(m["product_id"]) if m["product_id"] else None} for m in rows],
+            train=False
+        )
+    if len(index) >= MIN_TRAIN_SIZE:
+        index.train()
+    store.close()
+
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index.save(path)
+    logging.info(f"✅ ANN index built with {len(index)} vectors → {path}")
+
+def benchmark(n: int, queries: int, k: int, nprobe: int) -> Dict[str, float]:
+    """Measures build time, single-query latency and recall@k against exact search on synthetic clusters."""
+    rng = np.random.default_rng(42)
+    centers = _normalize(rng.normal(size=(max(50, n // 100), EMBEDDING_DIM)))
+    data = _normalize(centers[rng.integers(len(centers), size=n)] + rng.normal(scale=0.06, size=(n, EMBEDDING_DIM)))
+    statuses = rng.choice(["available", "sold"], size=n, p=[0.3, 0.7])
+
+    started = time.monotonic()
+    index = IVFIndex()
+    index.add([str(i) for i in range(n)], data, [{"status": s} for s in statuses])
+    build_seconds = time.monotonic() - started
+
+    probes = _normalize(data[rng.integers(n, size=queries)] + rng.normal(scale=0.06, size=(queries, EMBEDDING_DIM)))
+    latencies, exact_latencies, recalls = [], [], []
+    for q in probes:
+        for filters in (None, {"status": "available"}):
+            start = time.perf_counter()
+            hits = index.search(q, k, filters, nprobe)
+            latencies.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            scores = data @ q
+            np.argpartition(-scores, k)[:k]
+            exact_latencies.append((time.perf_counter() - start) * 1000)
+            if filters:
+                scores = np.where(statuses == "available", scores, -np.inf)
+            exact = set(np.argsort(-scores)[:k].astype(str))
+            recalls.append(len(exact & {h["id"] for h in hits}) / k)
+
+    return {
+        "vectors": n,
+        "lists": len(index.centroids) if index.centroids is not None else 0,
+        "nprobe": nprobe,
+        "build_s": round(build_seconds, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "exact_p50_ms": round(float(np.percentile(exact_latencies, 50)), 2),
+        f"recall@{k}": round(float(np.mean(recalls)), 3),
+    }
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Local ANN index over style_latent_space.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Rebuild the index from the local vector store")
+    build_cmd.add_argument("--offline", action="store_true", help="Skip refreshing the store and statuses from Supabase")
+    bench = sub.add_parser("bench", help="Report p50/p99 latency and recall on synthetic data")
+    bench.add_argument("--n", type=int, default=100000)
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--nprobe", type=int, default=NPROBE)
+    query = sub.add_parser("query", help="Search the index by text or image file")
+    query.add_argument("--text")
+    query.add_argument("--image")
+    query.add_argument("--k", type=int, default=10)
+    query.add_argument("--status")
+    query.add_argument("--category")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build(sync=not args.offline)
+    elif args.command == "bench":
+        print(json.dumps(benchmark(args.n, args.queries, args.k, args.nprobe), indent=2))
+    elif args.command == "query":
+        import clip_encoder
+        if args.text:
+            vector = clip_encoder.encode_texts([args.text])[0]
+        elif args.image:
+            with open(args.image, "rb") as f:
+                vector = clip_encoder.encode_images([clip_encoder.open_image(f.read())])[0]
+        else:
+            parser.error("query needs --text or --image")
+        hits = IVFIndex.load().search(vector, args.k, {"status": args.status, "category": args.category})
+        print(json.dumps(hits, indent=2))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import io
+import os
+from pathlib import PurePosixPath
+from typing import Dict, List, Tuple
+
+from PIL import Image, features
+
+# --- CONFIGURATION ---
+CDN_BASE_URL = os.getenv("CDN_BASE_URL", "https://cdn.mbn-code.dk/")
+UPLOAD_AVIF = os.getenv("UPLOAD_AVIF", "0") == "1"
+# Effort 4 is Pillow's default; 6 is several times slower for a few percent smaller files
+WEBP_METHOD = int(os.getenv("UPLOAD_WEBP_METHOD", "4"))
+
+# name → (size, fit, WebP quality). "width" scales to a max width, "short" scales
+# the shortest edge (what CLIP does before its center crop). The display variant
+# keeps the historical unsuffixed name, so existing URLs stay valid.
+DISPLAY = "display"
+VARIANTS: Dict[str, Tuple[int, str, int]] = {
+    DISPLAY: (800, "width", 80),
+    "thumb": (320, "width", 75),
+    "clip": (224, "short", 90),
+}
+# AVIF at equal quality settings looks better than WebP; these are the usual equivalents
+AVIF_QUALITY_OFFSET = -20
+
+def variant_name(filename: str, variant: str = DISPLAY, fmt: str = "webp") -> str:
+    """<stem>.webp for the display variant, <stem>-<variant>.<fmt> for the others."""
+    stem = PurePosixPath(filename).stem
+    return f"{stem}.{fmt}" if variant == DISPLAY else f"{stem}-{variant}.{fmt}"
+
+def variant_url(url: str, variant: str) -> str:
+    """Rewrites a CDN display URL to another variant; URLs hosted elsewhere are returned unchanged."""
+    if not url.startswith(CDN_BASE_URL) or not url.endswith(".webp"):
+        return url
+    name = url[len(CDN_BASE_URL):]
+    if "/" in name or any(name.endswith(f"-{v}.webp") for v in VARIANTS if v != DISPLAY):
+        return url
+    return f"{CDN_BASE_URL}{variant_name(name, variant)}"
+
+def avif_supported() -> bool:
+    try:
+        return features.check("avif")
+    except ValueError:
+        # Pillow < 11.3 has no built-in AVIF; the plugin registers it on import
+        try:
+            import pillow_avif  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+def variant_params(avif: bool = UPLOAD_AVIF) -> str:
+    """Stable description of the variant set, stored per upload to detect re-encodes."""
+    spec = "+".join(f"{name}:{size}{fit[0]}q{quality}" for name, (size, fit, quality) in VARIANTS.items())
+    return f"{spec}{'+avif' if avif else ''}"
+
+def _fit(img: Image.Image, size: int, fit: str) -> Image.Image:
+    scale = size / (img.width if fit == "width" else min(img.width, img.height))
+    if scale >= 1:
+        return img
+    return img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.Resampling.LANCZOS)
+
+def render_variants(source: bytes, filename: str, avif: bool = UPLOAD_AVIF) -> List[Tuple[str, bytes]]:
+    """Decodes once and encodes every variant; returns [(remote filename, bytes)]."""
+    with Image.open(io.BytesIO(source)) as img:
+        # The display variant is the largest, so JPEG can decode straight to about that size
+        img.draft("RGB", (VARIANTS[DISPLAY][0], VARIANTS[DISPLAY][0]))
+        img = img.convert("RGB")
+
+    size, fit, _ = VARIANTS[DISPLAY]
+    display = _fit(img, size, fit)
+    outputs = []
+    for name, (size, fit, quality) in VARIANTS.items():
+        # Smaller variants are scaled from the display image rather than the full source
+        resized = display if name == DISPLAY else _fit(display, size, fit)
+        buffer = io.BytesIO()
+        resized.save(buffer, format="WEBP", quality=quality, method=WEBP_METHOD)
+        outputs.append((variant_name(filename, name), buffer.getvalue()))
+        if avif:
+            buffer = io.BytesIO()
+            resized.save(buffer, format="AVIF", quality=max(1, quality + AVIF_QUALITY_OFFSET))
+            outputs.append((variant_name(filename, name, "avif"), buffer.getvalue()))
+    return outputs
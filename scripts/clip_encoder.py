@@ -0,0 +1,212 @@
+import io
+import os
+import json
+import logging
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+# --- CONFIGURATION ---
+if os.path.exists(".env.local"):
+    load_dotenv(".env.local")
+else:
+    load_dotenv()
+
+MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "clip-ViT-B-32")
+EMBEDDING_DIM = 512
+
+# "auto" prefers an exported ONNX model when one is present, otherwise PyTorch
+CLIP_BACKEND = os.getenv("CLIP_BACKEND", "auto").lower()
+ONNX_MODEL_DIR = os.getenv(
+    "CLIP_ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", f"{MODEL_NAME}-onnx")
+)
+ONNX_QUANTIZED = os.getenv("CLIP_ONNX_QUANTIZED", "0") == "1"
+
+# CLIPImageProcessor defaults for ViT-B/32; overridden by preprocess.json when exported
+IMAGE_SIZE = 224
+IMAGE_MEAN = [0.48145466, 0.4578275, 0.40821073]
+IMAGE_STD = [0.26862954, 0.26130258, 0.27577711]
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def onnx_model_path(tower: str, quantized: bool = ONNX_QUANTIZED, model_dir: str = ONNX_MODEL_DIR) -> str:
+    suffix = ".int8.onnx" if quantized else ".onnx"
+    return os.path.join(model_dir, f"{tower}{suffix}")
+
+def onnx_model_available(model_dir: str = ONNX_MODEL_DIR, quantized: bool = ONNX_QUANTIZED) -> bool:
+    """True when an exported vision tower and its preprocessing config exist."""
+    return os.path.exists(onnx_model_path("vision", quantized, model_dir)) and \
+        os.path.exists(os.path.join(model_dir, "preprocess.json"))
+
+def resolve_backend_name() -> str:
+    """Returns the backend load_model() will use, without importing it."""
+    if CLIP_BACKEND in ("torch", "onnx"):
+        return CLIP_BACKEND
+    return "onnx" if onnx_model_available() else "torch"
+
+def model_key() -> str:
+    """
+    Identifies the vectors this setup produces; int8 output is kept apart from fp32.
+    Follows the loaded backend once there is one, else the one load_model() would pick.
+    """
+    backend = _backend
+    if backend is not None:
+        quantized = getattr(backend, "quantized", False)
+    else:
+        quantized = resolve_backend_name() == "onnx" and ONNX_QUANTIZED
+    return f"{MODEL_NAME}+int8" if quantized else MODEL_NAME
+
+def resize_crop(img: Image.Image, size: int = IMAGE_SIZE) -> np.ndarray:
+    """Shortest-edge bicubic resize and center crop to a (size, size, 3) uint8 array."""
+    img = img.convert("RGB")
+    width, height = img.size
+    short, long = (width, height) if width <= height else (height, width)
+    new_short, new_long = size, int(size * long / short)
+    new_size = (new_short, new_long) if width <= height else (new_long, new_short)
+    img = img.resize(new_size, Image.Resampling.BICUBIC)
+
+    left = (img.width - size) // 2
+    top = (img.height - size) // 2
+    img = img.crop((left, top, left + size, top + size))
+    return np.asarray(img, dtype=np.uint8)
+
+def normalize_pixels(pixels: np.ndarray, mean: Sequence[float] = IMAGE_MEAN,
+                     std: Sequence[float] = IMAGE_STD) -> np.ndarray:
+    """Scales and normalizes (..., H, W, 3) uint8 pixels to channels-first float32."""
+    pixels = pixels.astype(np.float32) / 255.0
+    pixels = (pixels - np.asarray(mean, dtype=np.float32)) / np.asarray(std, dtype=np.float32)
+    return np.moveaxis(pixels, -1, -3)
+
+def preprocess_image(img: Image.Image, size: int = IMAGE_SIZE,
+                     mean: Sequence[float] = IMAGE_MEAN, std: Sequence[float] = IMAGE_STD) -> np.ndarray:
+    """Shortest-edge bicubic resize, center crop and normalize to a (3, size, size) float32 array."""
+    return normalize_pixels(resize_crop(img, size), mean, std)
+
+def preprocess_params() -> Tuple[int, List[float], List[float]]:
+    """(size, mean, std) the configured backend expects, read without loading the model."""
+    if resolve_backend_name() == "onnx":
+        with open(os.path.join(ONNX_MODEL_DIR, "preprocess.json")) as f:
+            config = json.load(f)
+        return config["image_size"], config["mean"], config["std"]
+    return IMAGE_SIZE, IMAGE_MEAN, IMAGE_STD
+
+class TorchClipBackend:
+    name = "torch"
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        # Imported lazily so thin clients never pay the torch import cost
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self._lock = threading.Lock()
+
+    def encode_images(self, images: Sequence[Image.Image]) -> np.ndarray:
+        with self._lock:
+            embeddings = self.model.encode(list(images), show_progress_bar=False, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def encode_pixels(self, pixels: np.ndarray) -> np.ndarray:
+        """Runs the vision tower on preprocessed (N, 3, H, W) pixel values."""
+        import torch
+        clip = self.model[0].model
+        tensor = torch.from_numpy(np.ascontiguousarray(pixels, dtype=np.float32)).to(self.model.device)
+        with self._lock, torch.no_grad():
+            embeddings = clip.get_image_features(pixel_values=tensor)
+        return embeddings.cpu().numpy()
+
+    def encode_texts(self, texts: Sequence[str]) -> np.ndarray:
+        with self._lock:
+            embeddings = self.model.encode(list(texts), show_progress_bar=False, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+class OnnxClipBackend:
+    """Torch-free CLIP inference on onnxruntime's CPU provider."""
+    name = "onnx"
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, quantized: bool = ONNX_QUANTIZED):
+        import onnxruntime as ort
+
+        self.model_dir = model_dir
+        self.quantized = quantized
+        with open(os.path.join(model_dir, "preprocess.json")) as f:
+            self.config = json.load(f)
+
+        self._options = ort.SessionOptions()
+        self._options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._ort = ort
+        self.vision = self._session("vision")
+        self._text = None
+        self._tokenizer = None
+
+    def _session(self, tower: str):
+        return self._ort.InferenceSession(
+            onnx_model_path(tower, self.quantized, self.model_dir),
+            self._options,
+            providers=["CPUExecutionProvider"]
+        )
+
+    def _load_text_tower(self) -> None:
+        # The text tower is only loaded on first use to keep image-only jobs lean
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer", "tokenizer.json"))
+        tokenizer.enable_truncation(self.config["max_length"])
+        tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+        self._tokenizer = tokenizer
+        self._text = self._session("text")
+
+    def encode_pixels(self, pixels: np.ndarray) -> np.ndarray:
+        """Runs the vision tower on preprocessed (N, 3, H, W) pixel values."""
+        return self.vision.run(None, {"pixel_values": np.ascontiguousarray(pixels, dtype=np.float32)})[0]
+
+    def encode_images(self, images: Sequence[Image.Image]) -> np.ndarray:
+        size = self.config["image_size"]
+        pixels = np.stack([preprocess_image(img, size, self.config["mean"], self.config["std"]) for img in images])
+        return self.encode_pixels(pixels)
+
+    def encode_texts(self, texts: Sequence[str]) -> np.ndarray:
+        if self._text is None:
+            self._load_text_tower()
+        encodings = self._tokenizer.encode_batch(list(texts))
+        input_ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+        return self._text.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+
+def load_model(backend: Optional[str] = None):
+    """Loads the configured CLIP backend once per process."""
+    global _backend
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is None:
+            name = backend or resolve_backend_name()
+            logging.info(f"🚀 Loading {MODEL_NAME} ({name} backend)...")
+            _backend = OnnxClipBackend() if name == "onnx" else TorchClipBackend()
+    return _backend
+
+def open_image(data: bytes) -> Image.Image:
+    """Decodes raw image bytes into an RGB PIL image."""
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+def encode_images(images: Sequence[Image.Image]) -> np.ndarray:
+    """Encodes PIL images into an (N, 512) float32 matrix."""
+    return np.asarray(load_model().encode_images(images), dtype=np.float32)
+
+def encode_pixels(pixels: np.ndarray) -> np.ndarray:
+    """Encodes preprocessed (N, 3, H, W) pixel values into an (N, 512) float32 matrix."""
+    return np.asarray(load_model().encode_pixels(pixels), dtype=np.float32)
+
+def encode_texts(texts: Sequence[str]) -> np.ndarray:
+    """Encodes text prompts into an (N, 512) float32 matrix."""
+    return np.asarray(load_model().encode_texts(texts), dtype=np.float32)
+
+def encode_image(image: Image.Image) -> List[float]:
+    """Encodes a single PIL image into a 512-dim vector."""
+    return encode_images([image])[0].tolist()
+
+def encode_text(text: str) -> List[float]:
+    """Encodes a single text prompt into a 512-dim vector."""
+    return encode_texts([text])[0].tolist()
@@ -0,0 +1,230 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from stage_scheduler import Stage, StageScheduler
+
+# --- CONFIGURATION ---
+# Manual commands that may run at the same time (on top of the hourly cycle)
+MAX_WORKERS = int(os.getenv("COMMAND_WORKERS", "3"))
+# How often running rows get heartbeat_at/progress written and are checked for cancellation
+HEARTBEAT_INTERVAL = int(os.getenv("COMMAND_HEARTBEAT_SECONDS", "15"))
+FETCH_LIMIT = 20
+PROGRESS_MAX_CHARS = 500
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class CommandSpec:
+    """
+    What a system_commands entry runs. Commands sharing a group are limited
+    together (sync and sync-force never overlap); `stage` ties a command to
+    the cycle stage doing the same work, so the two never run at once either.
+    `job`/`job_args` are the in-process equivalent of `command` (see Stage).
+    """
+
+    def __init__(self, name: str, command: str, group: str, stage: Optional[Stage] = None,
+                 job: Optional[str] = None, job_args: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.command = command
+        self.group = group
+        self.stage = stage
+        self.job = job
+        self.job_args = job_args or {}
+
+class RunningCommand:
+    """A claimed row while it executes; the runner feeds `progress` and honours `cancel`."""
+
+    def __init__(self, row_id: str, spec: CommandSpec):
+        self.id = row_id
+        self.spec = spec
+        self.started = time.time()
+        self.progress = ""
+        self.cancel = threading.Event()
+
+    def report(self, line: str) -> None:
+        self.progress = line[:PROGRESS_MAX_CHARS]
+
+class CommandExecutor:
+    """
+    Runs admin-dashboard commands from the system_commands table on a worker pool.
+
+    poll() never blocks: it claims as many pending rows as the per-group
+    limits and free workers allow and returns. A row is claimed with a
+    conditional pending → running update, so it can never start twice. While
+    a command runs, a heartbeat thread writes heartbeat_at and the latest
+    output line back to its row and stops it when cancel_requested is set.
+    """
+
+    def __init__(self, client: Any, specs: Dict[str, CommandSpec], group_limits: Dict[str, int],
+                 runner: Callable[[RunningCommand], bool], scheduler: Optional[StageScheduler] = None,
+                 workers: int = MAX_WORKERS):
+        self.client = client
+        self.specs = specs
+        self.group_limits = group_limits
+        self.runner = runner
+        self.scheduler = scheduler
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="command")
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._running: Dict[str, RunningCommand] = {}
+        self._stopping = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def _table(self):
+        return self.client.table("system_commands")
+
+    def start(self) -> None:
+        """Fails rows left running by a previous sentinel process, then starts the heartbeat."""
+        try:
+            self._table().update({"status": FAILED, "error": "Interrupted: sentinel restarted", "finished_at": _now()}) \
+                .eq("status", RUNNING).execute()
+        except Exception as e:
+            logging.error(f"Failed to reset stale system commands: {e}")
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="command-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def running(self) -> List[RunningCommand]:
+        with self._lock:
+            return list(self._running.values())
+
+    def _group_count(self, group: str) -> int:
+        return sum(1 for r in self._running.values() if r.spec.group == group)
+
+    def _claim(self, row_id: str) -> bool:
+        response = self._table().update({
+            "status": RUNNING,
+            "started_at": _now(),
+            "heartbeat_at": _now(),
+            "updated_at": _now(),
+        }).eq("id", row_id).eq("status", PENDING).execute()
+        # Empty when the row was cancelled or claimed in the meantime
+        return bool(response.data)
+
+    def poll(self) -> int:
+        """Claims and starts every pending command that may run now; returns how many started."""
+        if self._stopping.is_set():
+            return 0
+        with self._poll_lock:
+            with self._lock:
+                if len(self._running) >= self.workers:
+                    return 0
+            rows = self._table().select("id, command").eq("status", PENDING) \
+                .order("created_at").limit(FETCH_LIMIT).execute().data or []
+
+            started = 0
+            for row in rows:
+                row_id, name = row.get("id"), row.get("command")
+                if not row_id or not name:
+                    continue
+                spec = self.specs.get(name)
+                if spec is None:
+                    logging.error(f"Unknown command: {name}")
+                    self._table().update({"status": FAILED, "error": f"Unknown command: {name}", "finished_at": _now()}) \
+                        .eq("id", row_id).eq("status", PENDING).execute()
+                    continue
+
+                with self._lock:
+                    if len(self._running) >= self.workers:
+                        break
+                    # Left pending (not claimed) so it starts on a later poll once its group frees up
+                    if self._group_count(spec.group) >= self.group_limits.get(spec.group, 1):
+                        continue
+                if spec.stage is not None and self.scheduler is not None and not self.scheduler.try_reserve(spec.stage):
+                    continue
+                if not self._claim(row_id):
+                    if spec.stage is not None and self.scheduler is not None:
+                        self.scheduler.release(spec.stage)
+                    continue
+
+                logging.info(f"🔄 Claimed system command: {name} ({row_id})")
+                running = RunningCommand(row_id, spec)
+                with self._lock:
+                    self._running[row_id] = running
+                self._pool.submit(self._execute, running)
+                started += 1
+            return started
+
+    def _execute(self, running: RunningCommand) -> None:
+        status, error = FAILED, None
+        try:
+            if self.runner(running):
+                status = COMPLETED
+            elif running.cancel.is_set():
+                status, error = CANCELLED, "Cancelled from the dashboard"
+            else:
+                error = running.progress or "Command failed"
+        except Exception as e:
+            logging.error(f"❌ System command {running.spec.name} crashed: {e}")
+            error = str(e)
+        finally:
+            if running.spec.stage is not None and self.scheduler is not None:
+                self.scheduler.release(running.spec.stage)
+            with self._lock:
+                self._running.pop(running.id, None)
+
+        try:
+            self._table().update({
+                "status": status,
+                "error": error,
+                "progress": running.progress,
+                "finished_at": _now(),
+                "updated_at": _now(),
+            }).eq("id", running.id).execute()
+        except Exception as e:
+            logging.error(f"Failed to record result of system command {running.id}: {e}")
+        logging.info(f"🏁 System command {running.spec.name} {status} after {time.time() - running.started:.1f}s")
+
+        # A command queued behind this one (same group) can start now rather than on the next poll
+        try:
+            self.poll()
+        except Exception as e:
+            logging.error(f"Error checking system commands: {e}")
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stopping.wait(HEARTBEAT_INTERVAL):
+            active = self.running()
+            if not active:
+                continue
+            try:
+                for running in active:
+                    self._table().update({"heartbeat_at": _now(), "progress": running.progress}) \
+                        .eq("id", running.id).eq("status", RUNNING).execute()
+                requested = self._table().select("id").in_("id", [r.id for r in active]) \
+                    .eq("cancel_requested", True).execute().data or []
+                for row in requested:
+                    self.cancel(row["id"])
+            except Exception as e:
+                logging.error(f"System command heartbeat failed: {e}")
+
+    def cancel(self, row_id: str) -> bool:
+        """Asks a running command to stop; the runner terminates its process."""
+        with self._lock:
+            running = self._running.get(row_id)
+        if running is None or running.cancel.is_set():
+            return False
+        logging.warning(f"🚫 Cancelling system command {running.spec.name} ({row_id})")
+        running.cancel.set()
+        return True
+
+    def shutdown(self) -> None:
+        """Stops claiming, cancels everything running and marks those rows failed."""
+        self._stopping.set()
+        for running in self.running():
+            running.cancel.set()
+        try:
+            self._table().update({"status": FAILED, "error": "Interrupted: sentinel shut down", "finished_at": _now()}) \
+                .eq("status", RUNNING).execute()
+        except Exception as e:
+            logging.error(f"Failed to reset system commands on shutdown: {e}")
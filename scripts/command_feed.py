@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+# --- CONFIGURATION ---
+# "realtime" subscribes to system_commands inserts over Supabase Realtime; "poll" only polls
+COMMAND_FEED = os.getenv("COMMAND_FEED", "realtime").lower()
+# Polling while the subscription is down: fast after activity, backing off when the queue stays empty
+MIN_POLL_INTERVAL = int(os.getenv("COMMAND_MIN_POLL_SECONDS", "5"))
+MAX_POLL_INTERVAL = int(os.getenv("COMMAND_MAX_POLL_SECONDS", "60"))
+# While subscribed, a slow safety poll still catches anything an event was missed for
+SUBSCRIBED_POLL_INTERVAL = 300
+HEALTH_CHECK_SECONDS = 5
+# A subscription that is not joined for this long is torn down and reopened
+UNHEALTHY_GRACE_SECONDS = 30
+RECONNECT_MIN_BACKOFF = 2
+RECONNECT_MAX_BACKOFF = 300
+
+class CommandFeed:
+    """
+    Wakes the sentinel when a system command is queued.
+
+    The base class is the local stand-in: nothing pushes to it except
+    notify(), which tests (or the same process) call directly, and it never
+    reports itself connected, so the sentinel keeps polling.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._stopping = threading.Event()
+
+    @property
+    def connected(self) -> bool:
+        return False
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._event.set()
+
+    def notify(self, record: Optional[Dict[str, Any]] = None) -> None:
+        self._event.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Sleeps up to `timeout` seconds; True if woken by a notification."""
+        woken = self._event.wait(max(0.0, timeout))
+        self._event.clear()
+        return woken and not self._stopping.is_set()
+
+class RealtimeCommandFeed(CommandFeed):
+    """
+    Supabase Realtime subscription to system_commands inserts.
+
+    Runs its own asyncio loop on a background thread. The client library
+    reconnects short drops itself; when the channel stays unjoined for
+    UNHEALTHY_GRACE_SECONDS the socket is closed and reopened with
+    exponential backoff, and `connected` is False meanwhile so the sentinel
+    falls back to polling.
+    """
+
+    def __init__(self, url: str, key: str):
+        super().__init__()
+        self.url = f"{url.rstrip('/')}/realtime/v1"
+        self.key = key
+        self._connected = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), name="command-feed", daemon=True)
+        self._thread.start()
+
+    def _on_insert(self, payload: Dict[str, Any]) -> None:
+        record = (payload.get("data") or {}).get("record") if isinstance(payload, dict) else None
+        logging.info(f"📨 System command queued: {(record or {}).get('command', 'unknown')}")
+        self.notify(record)
+
+    async def _session(self) -> bool:
+        """One connection; returns once it is unhealthy or stopping. True if it ever subscribed."""
+        from realtime import AsyncRealtimeClient
+
+        socket = AsyncRealtimeClient(self.url, self.key)
+        subscribed = False
+        try:
+            await socket.connect()
+            channel = socket.channel("sentinel-system-commands")
+            channel.on_postgres_changes("INSERT", schema="public", table="system_commands", callback=self._on_insert)
+            await channel.subscribe()
+
+            unhealthy_since = time.monotonic()
+            while not self._stopping.is_set():
+                if socket.is_connected and channel.state == "joined":
+                    if not self._connected.is_set():
+                        logging.info("📡 Subscribed to system command inserts")
+                        # Catch anything queued while the subscription was down
+                        self.notify()
+                    self._connected.set()
+                    subscribed = True
+                    unhealthy_since = time.monotonic()
+                else:
+                    self._connected.clear()
+                    if time.monotonic() - unhealthy_since > UNHEALTHY_GRACE_SECONDS:
+                        break
+                await asyncio.sleep(HEALTH_CHECK_SECONDS)
+        finally:
+            self._connected.clear()
+            try:
+                await socket.close()
+            except Exception:
+                pass
+        return subscribed
+
+    async def _run(self) -> None:
+        backoff = RECONNECT_MIN_BACKOFF
+        while not self._stopping.is_set():
+            try:
+                if await self._session():
+                    backoff = RECONNECT_MIN_BACKOFF
+            except Exception as e:
+                logging.error(f"Command subscription failed: {e}")
+            if self._stopping.is_set():
+                return
+            logging.warning(f"📡 Command subscription down; polling until it reconnects (retry in {backoff}s)")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX_BACKOFF)
+
+class AdaptivePoller:
+    """
+    Interval until the next system_commands poll. While subscribed it is only a
+    safety net; otherwise it drops to MIN_POLL_INTERVAL after any activity and
+    doubles up to MAX_POLL_INTERVAL while polls come back empty.
+    """
+
+    def __init__(self, min_interval: float = MIN_POLL_INTERVAL, max_interval: float = MAX_POLL_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min_interval
+
+    def next_interval(self, activity: bool, subscribed: bool) -> float:
+        if activity:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return SUBSCRIBED_POLL_INTERVAL if subscribed else self.interval
+
+def create_feed(url: Optional[str], key: Optional[str], mode: str = COMMAND_FEED) -> CommandFeed:
+    """The Realtime feed when configured and available, else the polling-only stand-in."""
+    if mode != "realtime" or not url or not key:
+        return CommandFeed()
+    try:
+        import realtime  # noqa: F401
+    except ImportError:
+        logging.warning("realtime is not installed; system commands will be polled")
+        return CommandFeed()
+    return RealtimeCommandFeed(url, key)
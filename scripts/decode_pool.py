@@ -0,0 +1,89 @@
+import io
+import os
+import hashlib
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+import clip_encoder
+
+# --- CONFIGURATION ---
+# Leave one core to the encoder by default
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Batches decoded ahead of the encoder; bounds peak memory to roughly this many batches of uint8 pixels
+PREFETCH_BATCHES = int(os.getenv("DECODE_PREFETCH_BATCHES", "2"))
+
+_size = clip_encoder.IMAGE_SIZE
+
+def _init_worker(size: int) -> None:
+    global _size
+    _size = size
+
+def _decode_chunk(paths: Sequence[str]) -> Tuple[List[str], List[str], Optional[np.ndarray], List[Tuple[str, str]]]:
+    """Decodes and crops a slice of a batch in a worker; returns (ok paths, content hashes, uint8 pixels, failures)."""
+    ok, hashes, pixels, failed = [], [], [], []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            with Image.open(io.BytesIO(data)) as img:
+                # JPEG decodes at 1/2, 1/4 or 1/8 scale when that still covers the crop
+                img.draft("RGB", (_size, _size))
+                pixels.append(clip_encoder.resize_crop(img, _size))
+            ok.append(path)
+            hashes.append(hashlib.sha256(data).hexdigest())
+        except Exception as e:
+            failed.append((path, str(e)))
+    return ok, hashes, (np.stack(pixels) if pixels else None), failed
+
+class DecodePool:
+    """
+    Process pool that turns image paths into normalized CLIP input tensors.
+
+    Each batch is split across the workers, and at most `prefetch` batches
+    are in flight ahead of the consumer, so decoding overlaps encoding
+    without the whole directory piling up in memory.
+    """
+
+    def __init__(self, workers: int = DECODE_WORKERS, prefetch: int = PREFETCH_BATCHES):
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+        self.size, self.mean, self.std = clip_encoder.preprocess_params()
+
+    def _submit(self, pool: ProcessPoolExecutor, batch: List[str]) -> List[Future]:
+        step = -(-len(batch) // self.workers)
+        return [pool.submit(_decode_chunk, batch[i:i + step]) for i in range(0, len(batch), step)]
+
+    def _collect(self, futures: List[Future]) -> Tuple[List[str], List[str], Optional[np.ndarray], List[Tuple[str, str]]]:
+        """Joins a batch's chunks; pixels are normalized here in one vectorized pass."""
+        paths, hashes, pixels, failed = [], [], [], []
+        for future in futures:
+            ok, chunk_hashes, chunk, chunk_failed = future.result()
+            paths.extend(ok)
+            hashes.extend(chunk_hashes)
+            failed.extend(chunk_failed)
+            if chunk is not None:
+                pixels.append(chunk)
+        stacked = clip_encoder.normalize_pixels(np.concatenate(pixels), self.mean, self.std) if pixels else None
+        return paths, hashes, stacked, failed
+
+    def run(self, batches: Iterator[List[str]]) -> Iterator[Tuple[List[str], List[str], Optional[np.ndarray], List[Tuple[str, str]]]]:
+        """Yields (ok paths, sha256 of each, (N, 3, H, W) pixels or None, [(path, error)]) per input batch, in order."""
+        logging.info(f"🧵 Decoding with {self.workers} worker processes ({self.size}px, {self.prefetch} batches ahead)")
+        # Spawned, not forked: the caller has usually loaded CLIP and started threads by now,
+        # and a forked worker would inherit their locks and the model's memory for nothing
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(self.size,)) as pool:
+            in_flight: deque = deque()
+            for batch in batches:
+                in_flight.append(self._submit(pool, batch))
+                if len(in_flight) > self.prefetch:
+                    yield self._collect(in_flight.popleft())
+            while in_flight:
+                yield self._collect(in_flight.popleft())
@@ -0,0 +1,149 @@
+import time
+import queue
+import logging
+import threading
+from bisect import bisect_left
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds of the histogram buckets; the last bucket catches everything above
+HISTOGRAM_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+# How long encode()/encode_many() wait for their rows before giving up
+DEFAULT_TIMEOUT = 60.0
+
+class Histogram:
+    def __init__(self, buckets: Sequence[int] = HISTOGRAM_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "mean": round(self.total / self.count, 2) if self.count else 0.0
+        }
+
+class MicroBatcher:
+    """
+    Collects concurrent encode requests into one batched call.
+
+    A batch is dispatched once it holds `max_batch` items or the oldest item
+    has waited `max_latency_ms`, whichever comes first. Each caller gets its
+    own row of the batched result back through a Future.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[Any]], Sequence[Any]],
+                 max_batch: int = 32, max_latency_ms: float = 15.0, name: str = "embed"):
+        self.encode_fn = encode_fn
+        self.max_batch = max(1, max_batch)
+        self.max_latency = max(0.0, max_latency_ms) / 1000.0
+        self.name = name
+
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        self.batch_sizes = Histogram()
+        self.queue_depths = Histogram()
+        self.peak_queue_depth = 0
+        self.items_processed = 0
+        self.batch_failures = 0
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name=f"batcher-{self.name}")
+                self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queues one input and returns a Future for its encoded row."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def encode(self, item: Any, timeout: Optional[float] = DEFAULT_TIMEOUT) -> Any:
+        future = self.submit(item)
+        try:
+            return future.result(timeout)
+        finally:
+            # Not yet dispatched: the batcher drops it instead of encoding for nobody
+            future.cancel()
+
+    def encode_many(self, items: Sequence[Any], timeout: Optional[float] = DEFAULT_TIMEOUT) -> List[Any]:
+        """Encodes several inputs; `timeout` covers the whole call, not each item."""
+        futures = [self.submit(item) for item in items]
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            return [f.result(max(0.0, deadline - time.monotonic()) if deadline is not None else None) for f in futures]
+        finally:
+            for f in futures:
+                f.cancel()
+
+    def _collect(self) -> List[Tuple[Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch: List[Tuple[Any, Future]] = []
+            try:
+                batch = self._collect()
+                depth = self._queue.qsize()
+                # Drop requests whose callers already gave up
+                batch = [(item, f) for item, f in batch if f.set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+
+                with self._stats_lock:
+                    self.batch_sizes.observe(len(batch))
+                    self.queue_depths.observe(depth)
+                    self.peak_queue_depth = max(self.peak_queue_depth, depth + len(batch))
+
+                results = self.encode_fn([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"encode returned {len(results)} rows for {len(batch)} inputs")
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+                with self._stats_lock:
+                    self.items_processed += len(batch)
+            except Exception as e:
+                # Whatever went wrong, no caller may be left waiting and the thread must survive
+                logging.error(f"[{self.name}] Batch of {len(batch)} failed: {e}")
+                with self._stats_lock:
+                    self.batch_failures += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Point-in-time view of queue depth and batch size distributions."""
+        with self._stats_lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_latency_ms": self.max_latency * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "peak_queue_depth": self.peak_queue_depth,
+                "items_processed": self.items_processed,
+                "batch_failures": self.batch_failures,
+                "batch_size": self.batch_sizes.snapshot(),
+                "queue_depth_at_dispatch": self.queue_depths.snapshot()
+            }
@@ -0,0 +1,210 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+import clip_encoder
+
+# --- CONFIGURATION ---
+# Shared by every script on the host; set EMBEDDING_CACHE_PATH="" to disable
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embedding_cache.db")
+MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+# URL → content mappings older than this are re-verified by downloading and hashing
+URL_TTL_SECONDS = 30 * 24 * 3600
+EVICTION_CHECK_EVERY = 500
+
+class EmbeddingCache:
+    """
+    On-disk vector cache keyed by image content hash and model version.
+
+    Two lookups are supported: by URL (skips the download entirely) and by
+    SHA-256 of the downloaded bytes (skips the encode when the same image is
+    served from a different URL). Entries are evicted least-recently-used
+    once the cache grows past `max_entries`.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, model: Optional[str] = None, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self._model = model
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (content_hash, model)
+            );
+            CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access);
+            CREATE TABLE IF NOT EXISTS url_index (
+                url TEXT NOT NULL,
+                model TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                verified_at REAL NOT NULL,
+                PRIMARY KEY (url, model)
+            );
+        """)
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._puts_since_check = 0
+
+        self.url_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def model(self) -> str:
+        # Resolved per call, so entries follow the backend that actually loaded
+        return self._model or clip_encoder.model_key()
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _touch(self, content_hash: str) -> Optional[np.ndarray]:
+        row = self._conn.execute(
+            "SELECT vector FROM embeddings WHERE content_hash = ? AND model = ?",
+            (content_hash, self.model)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute(
+            "UPDATE embeddings SET last_access = ? WHERE content_hash = ? AND model = ?",
+            (time.time(), content_hash, self.model)
+        )
+        self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def get_by_url(self, url: str) -> Optional[np.ndarray]:
+        """Returns the cached vector for a URL seen recently, without downloading it."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, verified_at FROM url_index WHERE url = ? AND model = ?",
+                (url, self.model)
+            ).fetchone()
+            if row is None or time.time() - row[1] > URL_TTL_SECONDS:
+                return None
+            vector = self._touch(row[0])
+            if vector is not None:
+                self.url_hits += 1
+            return vector
+
+    def get_by_hash(self, content_hash: str, url: Optional[str] = None) -> Optional[np.ndarray]:
+        """Returns the cached vector for downloaded bytes, recording the URL mapping on a hit."""
+        with self._lock:
+            vector = self._touch(content_hash)
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hash_hits += 1
+            if url:
+                self._link(url, content_hash)
+                self._conn.commit()
+            return vector
+
+    def _link(self, url: str, content_hash: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO url_index (url, model, content_hash, verified_at) VALUES (?, ?, ?, ?)",
+            (url, self.model, content_hash, time.time())
+        )
+
+    def put(self, vector: Any, content_hash: str, url: Optional[str] = None) -> None:
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (content_hash, model, vector, last_access) VALUES (?, ?, ?, ?)",
+                (content_hash, self.model, blob, time.time())
+            )
+            if url:
+                self._link(url, content_hash)
+            self._conn.commit()
+            self._entries += cursor.rowcount
+            self._puts_since_check += 1
+            if self._entries > self.max_entries or self._puts_since_check >= EVICTION_CHECK_EVERY:
+                self._evict()
+
+    def _evict(self) -> None:
+        self._puts_since_check = 0
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._entries <= self.max_entries:
+            return
+        # Trim to 90% so eviction doesn't run again on the very next put
+        excess = self._entries - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,)
+        )
+        self._conn.execute(
+            "DELETE FROM url_index WHERE NOT EXISTS ("
+            "SELECT 1 FROM embeddings e WHERE e.content_hash = url_index.content_hash AND e.model = url_index.model)"
+        )
+        self._conn.commit()
+        self._entries -= excess
+        self.evictions += excess
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.url_hits + self.hash_hits + self.misses
+        with self._lock:
+            # _entries is an upper bound (replaced rows count twice), so report the real size
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": self._entries,
+            "url_hits": self.url_hits,
+            "hash_hits": self.hash_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.url_hits + self.hash_hits) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+    def log_stats(self) -> None:
+        s = self.stats()
+        logging.info(
+            f"🗃️ Embedding cache: {s['url_hits']} url hits, {s['hash_hits']} content hits, "
+            f"{s['misses']} misses ({s['hit_rate']:.0%} hit rate), {s['entries']} entries"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+def open_default_cache() -> Optional[EmbeddingCache]:
+    """Opens the shared cache, or returns None when disabled or unusable."""
+    if not CACHE_PATH:
+        return None
+    try:
+        return EmbeddingCache()
+    except Exception as e:
+        logging.warning(f"⚠️ Embedding cache unavailable ({e}); continuing without it")
+        return None
+
+def cached_embed(url: str, fetch: Callable[[str], bytes], encode: Callable[[Any], Any],
+                 cache: Optional[EmbeddingCache]) -> np.ndarray:
+    """URL lookup → download → content lookup → encode, storing whatever was computed."""
+    if cache is not None:
+        vector = cache.get_by_url(url)
+        if vector is not None:
+            return vector
+
+    data = fetch(url)
+    content_hash = EmbeddingCache.hash_bytes(data)
+    if cache is not None:
+        vector = cache.get_by_hash(content_hash, url)
+        if vector is not None:
+            return vector
+
+    vector = np.asarray(encode(clip_encoder.open_image(data)), dtype=np.float32)
+    if cache is not None:
+        cache.put(vector, content_hash, url)
+    return vector
@@ -0,0 +1,65 @@
+import os
+import json
+import socket
+import http.client
+from typing import Any, Dict, List, Optional
+
+# --- CONFIGURATION ---
+# Mirrors embedding_server.py; only the stdlib is imported so callers stay torch-free
+SERVER_HOST = os.getenv("EMBEDDING_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("EMBEDDING_SERVER_PORT", "8765"))
+SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET")
+SERVER_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "30"))
+
+class EmbeddingServerUnavailable(Exception):
+    """Raised when the local embedding server cannot be reached."""
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+def _connection(timeout: float) -> http.client.HTTPConnection:
+    if SERVER_SOCKET:
+        return UnixHTTPConnection(SERVER_SOCKET, timeout)
+    return http.client.HTTPConnection(SERVER_HOST, SERVER_PORT, timeout=timeout)
+
+def _request(method: str, path: str, body: Optional[bytes] = None,
+             content_type: str = "application/json", timeout: float = SERVER_TIMEOUT) -> Dict[str, Any]:
+    conn = _connection(timeout)
+    try:
+        headers = {"Content-Type": content_type} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        data = json.loads(response.read() or b"{}")
+    except (ConnectionError, FileNotFoundError, socket.timeout, OSError) as e:
+        raise EmbeddingServerUnavailable(str(e)) from e
+    finally:
+        conn.close()
+
+    if response.status != 200 or "error" in data:
+        raise RuntimeError(data.get("error") or f"Embedding server returned HTTP {response.status}")
+    return data
+
+def is_server_available(timeout: float = 1.0) -> bool:
+    """Returns True when the embedding server answers its health check."""
+    try:
+        _request("GET", "/health", timeout=timeout)
+        return True
+    except Exception:
+        return False
+
+def embed_image_url(url: str) -> List[float]:
+    return _request("POST", "/embed", json.dumps({"image_url": url}).encode("utf-8"))["embedding"]
+
+def embed_image_bytes(data: bytes, content_type: str = "application/octet-stream") -> List[float]:
+    return _request("POST", "/embed", data, content_type=content_type)["embedding"]
+
+def embed_text(text: str) -> List[float]:
+    return _request("POST", "/embed", json.dumps({"text": text}).encode("utf-8"))["embedding"]
@@ -0,0 +1,258 @@
+import os
+import sys
+import hmac
+import json
+import time
+import base64
+import logging
+import signal
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+import clip_encoder
+import http_client
+from ann_index import IndexReader
+from embed_batcher import MicroBatcher
+from embedding_cache import EmbeddingCache, cached_embed, open_default_cache
+
+# --- CONFIGURATION ---
+if os.path.exists(".env.local"):
+    load_dotenv(".env.local")
+else:
+    load_dotenv()
+
+SERVER_HOST = os.getenv("EMBEDDING_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("EMBEDDING_SERVER_PORT", "8765"))
+# When set, the server listens on this Unix socket instead of localhost TCP
+SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET")
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_BATCH_INPUTS = 64
+FETCH_TIMEOUT = 10
+# Micro-batching: a batch is encoded once it is full or its oldest request has waited this long
+BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+BATCH_MAX_LATENCY_MS = float(os.getenv("EMBEDDING_MAX_LATENCY_MS", "15"))
+# Required as a Bearer token on /search; /search is refused while it is unset
+SEARCH_TOKEN = os.getenv("NEURAL_SEARCH_TOKEN")
+# /search queries come from the web, so image_url is limited to these hosts (no LAN fetches)
+SEARCH_IMAGE_HOSTS = {
+    h.strip().lower() for h in os.getenv(
+        "NEURAL_SEARCH_IMAGE_HOSTS", "cdn.mbn-code.dk,res.cloudinary.com,images1.vinted.net,media-assets.grailed.com"
+    ).split(",") if h.strip()
+}
+MAX_SEARCH_RESULTS = 100
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [EMBED] %(levelname)s: %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+
+image_batcher = MicroBatcher(clip_encoder.encode_images, BATCH_MAX_SIZE, BATCH_MAX_LATENCY_MS, name="image")
+text_batcher = MicroBatcher(clip_encoder.encode_texts, BATCH_MAX_SIZE, BATCH_MAX_LATENCY_MS, name="text")
+# Opened in serve(); URL requests are answered from it before downloading
+cache = None
+search_index = IndexReader()
+
+def fetch_image_bytes(url: str) -> bytes:
+    """Downloads an image URL."""
+    if urlparse(url).scheme not in ("http", "https"):
+        raise ValueError("Only http(s) image URLs are supported")
+    return http_client.get_bytes(url, timeout=FETCH_TIMEOUT)
+
+def fetch_search_image(url: str) -> bytes:
+    """Downloads a /search image_url without following redirects."""
+    return http_client.get_bytes(url, timeout=FETCH_TIMEOUT, follow_redirects=False)
+
+def embed_image_url(url: str):
+    return cached_embed(url, fetch_image_bytes, image_batcher.encode, cache)
+
+def embed_image_urls(urls: List[str]) -> List[Any]:
+    """Answers cached URLs directly and encodes the rest as one batch."""
+    vectors: List[Any] = [cache.get_by_url(u) if cache is not None else None for u in urls]
+    misses = []
+    for i, url in enumerate(urls):
+        if vectors[i] is not None:
+            continue
+        data = fetch_image_bytes(url)
+        content_hash = EmbeddingCache.hash_bytes(data)
+        vectors[i] = cache.get_by_hash(content_hash, url) if cache is not None else None
+        if vectors[i] is None:
+            misses.append((i, url, content_hash, clip_encoder.open_image(data)))
+    if misses:
+        encoded = image_batcher.encode_many([img for _, _, _, img in misses])
+        for (i, url, content_hash, _), vector in zip(misses, encoded):
+            vectors[i] = vector
+            if cache is not None:
+                cache.put(vector, content_hash, url)
+    return vectors
+
+def embed_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolves a JSON embed request into one or many vectors."""
+    if "text" in payload:
+        return {"embedding": text_batcher.encode(str(payload["text"])).tolist()}
+    if "image_url" in payload:
+        return {"embedding": embed_image_url(str(payload["image_url"])).tolist()}
+    if "image_b64" in payload:
+        img = clip_encoder.open_image(base64.b64decode(payload["image_b64"]))
+        return {"embedding": image_batcher.encode(img).tolist()}
+
+    if "texts" in payload:
+        texts = [str(t) for t in payload["texts"]][:MAX_BATCH_INPUTS]
+        return {"embeddings": [e.tolist() for e in text_batcher.encode_many(texts)]}
+    if "image_urls" in payload:
+        urls = [str(u) for u in payload["image_urls"][:MAX_BATCH_INPUTS]]
+        return {"embeddings": [e.tolist() for e in embed_image_urls(urls)]}
+
+    raise ValueError("Expected one of: text, texts, image_url, image_urls, image_b64")
+
+class IndexUnavailable(Exception):
+    pass
+
+def search_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """k-NN over the local ANN index by text, image or a precomputed embedding."""
+    index = search_index.get()
+    if index is None:
+        raise IndexUnavailable("ANN index has not been built yet")
+
+    if "embedding" in payload:
+        query = payload["embedding"]
+    elif "text" in payload:
+        query = text_batcher.encode(str(payload["text"]))
+    elif "image_url" in payload:
+        url = str(payload["image_url"])
+        parsed = urlparse(url)
+        if parsed.scheme != "https" or (parsed.hostname or "").lower() not in SEARCH_IMAGE_HOSTS:
+            raise ValueError("image_url must be an https URL on an allowed image host")
+        query = cached_embed(url, fetch_search_image, image_batcher.encode, cache)
+    elif "image_b64" in payload:
+        query = image_batcher.encode(clip_encoder.open_image(base64.b64decode(payload["image_b64"])))
+    else:
+        raise ValueError("Expected one of: text, image_url, image_b64, embedding")
+
+    k = max(1, min(int(payload.get("k", 10)), MAX_SEARCH_RESULTS))
+    filters = payload.get("filters") or {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    started = time.perf_counter()
+    results = index.search(query, k, filters)
+    return {"results": results, "took_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self) -> str:
+        # Unix socket peers have no (host, port) tuple
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(200, {
+                "status": "ok",
+                "model": clip_encoder.MODEL_NAME,
+                "dim": clip_encoder.EMBEDDING_DIM
+            })
+        elif self.path == "/stats":
+            self._send_json(200, {
+                "image": image_batcher.snapshot(),
+                "text": text_batcher.snapshot(),
+                "cache": cache.stats() if cache is not None else None,
+                "http": http_client.default_client().stats_dict()
+            })
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self) -> None:
+        if self.path not in ("/embed", "/search"):
+            self._send_json(404, {"error": "Not found"})
+            return
+        if self.path == "/search":
+            if not SEARCH_TOKEN:
+                self._send_json(503, {"error": "Search is disabled: NEURAL_SEARCH_TOKEN is not set"})
+                return
+            if not hmac.compare_digest(self.headers.get("Authorization") or "", f"Bearer {SEARCH_TOKEN}"):
+                self._send_json(401, {"error": "Unauthorized"})
+                return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._send_json(413 if length > 0 else 400, {"error": "Invalid request body size"})
+            return
+        body = self.rfile.read(length)
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+
+        try:
+            if self.path == "/search":
+                result = search_payload(json.loads(body))
+            elif content_type.startswith("image/") or content_type == "application/octet-stream":
+                result = {"embedding": image_batcher.encode(clip_encoder.open_image(body)).tolist()}
+            else:
+                result = embed_payload(json.loads(body))
+            self._send_json(200, result)
+        except IndexUnavailable as e:
+            self._send_json(503, {"error": str(e)})
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+        except http_client.HTTPClientError as e:
+            self._send_json(502, {"error": f"Image fetch failed: {e}"})
+        except Exception as e:
+            logging.error(f"Embedding failed: {e}")
+            self._send_json(500, {"error": str(e)})
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def create_server():
+    """Builds the HTTP server on the configured Unix socket or localhost port."""
+    if SERVER_SOCKET:
+        if os.path.exists(SERVER_SOCKET):
+            os.unlink(SERVER_SOCKET)
+        server = ThreadingUnixHTTPServer(SERVER_SOCKET, EmbeddingRequestHandler)
+        os.chmod(SERVER_SOCKET, 0o660)
+        logging.info(f"🔌 Listening on unix://{SERVER_SOCKET}")
+    else:
+        server = ThreadingHTTPServer((SERVER_HOST, SERVER_PORT), EmbeddingRequestHandler)
+        server.daemon_threads = True
+        logging.info(f"🔌 Listening on http://{SERVER_HOST}:{SERVER_PORT}")
+    return server
+
+def serve():
+    global cache
+    # Load eagerly so the first request doesn't pay the cold start
+    clip_encoder.load_model()
+    logging.info(f"✅ {clip_encoder.MODEL_NAME} warm and ready")
+    cache = open_default_cache()
+
+    server = create_server()
+
+    def shutdown(signum, frame):
+        logging.warning("🛑 Shutting down embedding server...")
+        server.server_close()
+        if cache is not None:
+            cache.log_stats()
+        if SERVER_SOCKET and os.path.exists(SERVER_SOCKET):
+            os.unlink(SERVER_SOCKET)
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,141 @@
+import os
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# --- CONFIGURATION ---
+FLUSH_SIZE = int(os.getenv("EMBEDDING_WRITE_BATCH", "200"))
+FLUSH_INTERVAL = float(os.getenv("EMBEDDING_WRITE_INTERVAL", "5"))
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.5
+
+class WriteBehindBuffer:
+    """
+    Groups row writes into bulk requests.
+
+    Rows are flushed when `flush_size` rows are buffered or the oldest buffered
+    row is older than `flush_interval` seconds. A failed flush is retried with
+    exponential backoff; rows of a batch that fails every attempt are counted
+    as failed and dropped.
+    """
+
+    def __init__(self, name: str, write_fn: Callable[[List[Dict[str, Any]]], Any],
+                 flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE):
+        self.name = name
+        self.write_fn = write_fn
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+
+        self._rows: List[Dict[str, Any]] = []
+        self._oldest: Optional[float] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._timer = threading.Thread(target=self._flush_on_interval, daemon=True, name=f"writer-{name}")
+
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.requests = 0
+        self.write_seconds = 0.0
+        self._started_at = time.monotonic()
+        self._timer.start()
+
+    def __enter__(self) -> "WriteBehindBuffer":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def add(self, row: Dict[str, Any]) -> None:
+        with self._lock:
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.append(row)
+            full = len(self._rows) >= self.flush_size
+        if full:
+            self.flush()
+
+    def _flush_on_interval(self) -> None:
+        while not self._closed.wait(min(1.0, self.flush_interval)):
+            with self._lock:
+                stale = self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+            if stale:
+                self.flush()
+
+    def flush(self) -> None:
+        # One flush at a time keeps batches in submission order
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows, self._oldest = self._rows, [], None
+            for i in range(0, len(rows), self.flush_size):
+                self._write_batch(rows[i:i + self.flush_size])
+
+    def _write_batch(self, rows: List[Dict[str, Any]]) -> None:
+        for attempt in range(self.max_attempts):
+            start = time.monotonic()
+            try:
+                self.requests += 1
+                self.write_fn(rows)
+                self.write_seconds += time.monotonic() - start
+                self.rows_written += len(rows)
+                return
+            except Exception as e:
+                self.write_seconds += time.monotonic() - start
+                if attempt == self.max_attempts - 1:
+                    logging.error(f"💥 {self.name}: bulk write of {len(rows)} rows failed permanently: {e}")
+                    self.rows_failed += len(rows)
+                    return
+                delay = self.backoff_base ** attempt + random.uniform(0, 0.5)
+                logging.warning(f"🔥 {self.name}: bulk write failed ({e}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    def close(self) -> Dict[str, Any]:
+        """Flushes what's left, stops the interval timer and logs throughput."""
+        self._closed.set()
+        self.flush()
+        stats = self.stats()
+        if stats["rows_written"] or stats["rows_failed"]:
+            logging.info(
+                f"📝 {self.name}: {stats['rows_written']} rows in {stats['requests']} requests "
+                f"({stats['rows_per_second']} rows/s), {stats['rows_failed']} failed"
+            )
+        return stats
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._started_at
+        return {
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "requests": self.requests,
+            "write_seconds": round(self.write_seconds, 2),
+            "rows_per_second": round(self.rows_written / elapsed, 1) if elapsed > 0 else 0.0
+        }
+
+def inventory_embedding_writer(supabase, **kwargs: Any) -> WriteBehindBuffer:
+    """Buffers {"id", "embedding"} rows into bulk_update_style_embeddings calls."""
+    return WriteBehindBuffer(
+        "pulse_inventory.style_embedding",
+        lambda rows: supabase.rpc("bulk_update_style_embeddings", {"updates": rows}).execute(),
+        **kwargs
+    )
+
+def latent_update_writer(supabase, **kwargs: Any) -> WriteBehindBuffer:
+    """Buffers {"product_id", "embedding", "image_url", "archetype"} rows into bulk_update_latent_embeddings calls."""
+    return WriteBehindBuffer(
+        "style_latent_space.update",
+        lambda rows: supabase.rpc("bulk_update_latent_embeddings", {"updates": rows}).execute(),
+        **kwargs
+    )
+
+def latent_insert_writer(supabase, **kwargs: Any) -> WriteBehindBuffer:
+    """Buffers new style_latent_space rows into bulk inserts."""
+    return WriteBehindBuffer(
+        "style_latent_space.insert",
+        lambda rows: supabase.table("style_latent_space").insert(rows).execute(),
+        **kwargs
+    )
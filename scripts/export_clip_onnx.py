@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import logging
+import argparse
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+import clip_encoder
+
+# Export and parity checks need torch; run this on a workstation, then copy
+# the output directory to the Pi, which only needs onnxruntime + tokenizers.
+PARITY_THRESHOLD = 0.99
+PARITY_TEXTS = [
+    "avant-garde fashion",
+    "archive fashion",
+    "gorpcore outdoor wear",
+    "y2k streetwear",
+    "a black leather jacket on a white background"
+]
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+
+def export(output_dir: str, opset: int = 17) -> None:
+    """Exports the vision and text towers of the SentenceTransformer CLIP model."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(clip_encoder.MODEL_NAME, device="cpu")
+    clip_module = st_model[0]
+    clip = clip_module.model.eval()
+    processor = clip_module.processor
+
+    class VisionTower(torch.nn.Module):
+        def forward(self, pixel_values):
+            return clip.get_image_features(pixel_values=pixel_values)
+
+    class TextTower(torch.nn.Module):
+        def forward(self, input_ids, attention_mask):
+            return clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    image_size = processor.image_processor.crop_size["height"]
+    dummy_pixels = torch.randn(1, 3, image_size, image_size)
+    dummy_text = processor.tokenizer(PARITY_TEXTS[:2], padding=True, return_tensors="pt")
+
+    logging.info("📦 Exporting vision tower...")
+    with torch.no_grad():
+        torch.onnx.export(
+            VisionTower(), (dummy_pixels,), os.path.join(output_dir, "vision.onnx"),
+            input_names=["pixel_values"], output_names=["embeddings"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "embeddings": {0: "batch"}},
+            opset_version=opset
+        )
+
+    logging.info("📦 Exporting text tower...")
+    with torch.no_grad():
+        torch.onnx.export(
+            TextTower(), (dummy_text["input_ids"], dummy_text["attention_mask"]),
+            os.path.join(output_dir, "text.onnx"),
+            input_names=["input_ids", "attention_mask"], output_names=["embeddings"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "embeddings": {0: "batch"}
+            },
+            opset_version=opset
+        )
+
+    tokenizer = processor.tokenizer
+    tokenizer_dir = os.path.join(output_dir, "tokenizer")
+    tokenizer.save_pretrained(tokenizer_dir)
+    if not getattr(tokenizer, "is_fast", False):
+        # OnnxClipBackend reads tokenizer.json, which only fast tokenizers write
+        from transformers import CLIPTokenizerFast
+        tokenizer = CLIPTokenizerFast.from_pretrained(tokenizer_dir)
+        tokenizer.save_pretrained(tokenizer_dir)
+    with open(os.path.join(output_dir, "preprocess.json"), "w") as f:
+        json.dump({
+            "model": clip_encoder.MODEL_NAME,
+            "image_size": image_size,
+            "mean": list(processor.image_processor.image_mean),
+            "std": list(processor.image_processor.image_std),
+            "max_length": tokenizer.model_max_length,
+            "pad_id": tokenizer.pad_token_id,
+            "pad_token": tokenizer.pad_token
+        }, f, indent=2)
+    logging.info(f"✅ Exported to {output_dir}")
+
+def quantize(output_dir: str) -> None:
+    """Writes int8 dynamically quantized copies of both towers."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    for tower in ("vision", "text"):
+        logging.info(f"🗜️ Quantizing {tower} tower to int8...")
+        quantize_dynamic(
+            clip_encoder.onnx_model_path(tower, False, output_dir),
+            clip_encoder.onnx_model_path(tower, True, output_dir),
+            weight_type=QuantType.QInt8
+        )
+
+def _sample_images(paths: List[str]) -> List[Image.Image]:
+    if paths:
+        return [Image.open(p).convert("RGB") for p in paths]
+    # Synthetic gradients keep the check runnable without a dataset on hand
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(4):
+        base = np.linspace(0, 255, 256, dtype=np.float32)
+        canvas = np.stack(np.meshgrid(base, base[::-1]), axis=-1)
+        rgb = np.concatenate([canvas, np.full((256, 256, 1), 60 * i, dtype=np.float32)], axis=-1)
+        rgb += rng.normal(0, 20, rgb.shape)
+        images.append(Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8)).resize((256 + 64 * i, 256)))
+    return images
+
+def _row_cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
+
+def verify_parity(output_dir: str, quantized: bool, image_paths: List[str]) -> bool:
+    """Compares ONNX vectors against the PyTorch reference (cosine > PARITY_THRESHOLD)."""
+    torch_backend = clip_encoder.TorchClipBackend()
+    onnx_backend = clip_encoder.OnnxClipBackend(output_dir, quantized)
+    images = _sample_images(image_paths)
+
+    ok = True
+    for kind, reference, candidate in (
+        ("image", torch_backend.encode_images(images), onnx_backend.encode_images(images)),
+        ("text", torch_backend.encode_texts(PARITY_TEXTS), onnx_backend.encode_texts(PARITY_TEXTS)),
+    ):
+        cosines = _row_cosine(reference, candidate)
+        passed = bool(cosines.min() > PARITY_THRESHOLD)
+        ok = ok and passed
+        label = "int8" if quantized else "fp32"
+        logging.info(f"{'✅' if passed else '❌'} {kind} parity ({label}): min cosine {cosines.min():.4f}, mean {cosines.mean():.4f}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Export clip-ViT-B-32 to ONNX for torch-free inference.")
+    parser.add_argument("--output", default=clip_encoder.ONNX_MODEL_DIR)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--quantize", action="store_true", help="Also write int8 dynamically quantized towers")
+    parser.add_argument("--verify-only", action="store_true", help="Skip export and only run the parity check")
+    parser.add_argument("--images", nargs="*", default=[], help="Image files to use for the parity check")
+    args = parser.parse_args()
+
+    if not args.verify_only:
+        export(args.output, args.opset)
+        if args.quantize:
+            quantize(args.output)
+
+    ok = verify_parity(args.output, False, args.images)
+    if args.quantize or clip_encoder.onnx_model_available(args.output, quantized=True):
+        ok = verify_parity(args.output, True, args.images) and ok
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,28 @@
-import os
 import sys
-import io
 import json
-import requests
-from PIL import Image
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
+# Loaded before the client import so EMBEDDING_SERVER_* overrides apply
 load_dotenv(".env.local")
 
-MODEL_NAME = 'clip-ViT-B-32'
+import embedding_client
+
+def embed_in_process(image_url: str):
+    """Cold path: loads CLIP in this process when the embedding server is down."""
+    import clip_encoder
+    import http_client
+    from embedding_cache import cached_embed, open_default_cache
+
+    def fetch(url: str) -> bytes:
+        return http_client.get_bytes(url, timeout=10)
+
+    # A cache hit answers without loading the model at all
+    cache = open_default_cache()
+    try:
+        return cached_embed(image_url, fetch, clip_encoder.encode_image, cache).tolist()
+    finally:
+        if cache is not None:
+            cache.close()
 
 def main():
     if len(sys.argv) < 2:
@@ -17,15 +30,13 @@ def main():
         return
 
     image_url = sys.argv[1]
-    
+
     try:
-        model = SentenceTransformer(MODEL_NAME)
-        response = requests.get(image_url, timeout=10)
-        response.raise_for_status()
-        
-        img = Image.open(io.BytesIO(response.content)).convert("RGB")
-        embedding = model.encode(img, show_progress_bar=False).tolist()
-        
+        try:
+            embedding = embedding_client.embed_image_url(image_url)
+        except embedding_client.EmbeddingServerUnavailable:
+            embedding = embed_in_process(image_url)
+
         print(json.dumps({"embedding": embedding}))
     except Exception as e:
         print(json.dumps({"error": str(e)}))
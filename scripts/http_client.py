@@ -0,0 +1,239 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+import stage_metrics
+from rate_limiter import parse_retry_after
+
+# --- CONFIGURATION ---
+# "auto" uses httpx with HTTP/2 when httpx and h2 are installed (supabase-py pulls both in), else requests
+HTTP_BACKEND = os.getenv("HTTP_CLIENT_BACKEND", "auto").lower()
+# Keep-alive connections kept per host; size this to the widest download fan-out
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+MAX_HOSTS = 32
+MAX_RESPONSE_BYTES = int(float(os.getenv("HTTP_MAX_RESPONSE_MB", "20")) * 1024 * 1024)
+DEFAULT_TIMEOUT = 10
+# GETs are retried on these statuses and on connection errors, honouring Retry-After
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 1.5
+MAX_RETRY_AFTER_SECONDS = 30
+CHUNK_BYTES = 64 * 1024
+USER_AGENT = "AuvraSentinel/1.0"
+
+class HTTPClientError(Exception):
+    """Base for every failure get_bytes/post_json raise."""
+
+class HTTPStatusError(HTTPClientError):
+    def __init__(self, url: str, status: int):
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+
+class ResponseTooLarge(HTTPClientError):
+    pass
+
+class TransportError(HTTPClientError):
+    """Connection, TLS or timeout failure after all retries."""
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "avg_ms": round(1000 * self.seconds / self.requests, 1) if self.requests else 0.0,
+            "max_ms": round(1000 * self.max_seconds, 1),
+        }
+
+def http2_available() -> bool:
+    try:
+        import httpx  # noqa: F401
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+class HttpClient:
+    """
+    Thread-safe pooled HTTP client shared by a whole process.
+
+    Connections are kept alive per host, so repeated downloads from one CDN
+    reuse a TLS session instead of handshaking per image. GETs are retried
+    with exponential backoff, bodies are capped at `max_bytes`, and latency
+    and bytes are tracked per host.
+    """
+
+    def __init__(self, backend: str = HTTP_BACKEND, pool_size: int = POOL_SIZE,
+                 max_bytes: int = MAX_RESPONSE_BYTES):
+        self.max_bytes = max_bytes
+        self.stats: Dict[str, HostStats] = defaultdict(HostStats)
+        self._stats_lock = threading.Lock()
+        use_httpx = backend == "httpx" or (backend == "auto" and http2_available())
+
+        if use_httpx:
+            import httpx
+            self.backend = "httpx"
+            self._client = httpx.Client(
+                http2=http2_available(),
+                limits=httpx.Limits(max_connections=pool_size * MAX_HOSTS, max_keepalive_connections=pool_size * 4),
+                headers={"User-Agent": USER_AGENT},
+                follow_redirects=True
+            )
+            self._transport_errors: Tuple[type, ...] = (httpx.TransportError,)
+        else:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self.backend = "requests"
+            self._client = requests.Session()
+            self._client.headers["User-Agent"] = USER_AGENT
+            # Retries are handled below so both backends behave the same
+            adapter = HTTPAdapter(pool_connections=MAX_HOSTS, pool_maxsize=pool_size, max_retries=0)
+            self._client.mount("http://", adapter)
+            self._client.mount("https://", adapter)
+            self._transport_errors = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+    def _read_capped(self, length: Optional[str], chunks, url: str, max_bytes: int) -> bytes:
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise ResponseTooLarge(f"{url} is {int(length)} bytes (limit {max_bytes})")
+        body, total = [], 0
+        for chunk in chunks:
+            total += len(chunk)
+            if total > max_bytes:
+                raise ResponseTooLarge(f"{url} exceeded {max_bytes} bytes")
+            body.append(chunk)
+        return b"".join(body)
+
+    def _request(self, method: str, url: str, timeout: float, max_bytes: int,
+                 headers: Optional[Dict[str, str]], json: Any,
+                 follow_redirects: bool = True) -> Tuple[int, Any, bytes]:
+        """One attempt: (status, case-insensitive headers, body); error and redirect bodies are not read."""
+        if self.backend == "httpx":
+            with self._client.stream(method, url, timeout=timeout, headers=headers, json=json,
+                                     follow_redirects=follow_redirects) as response:
+                if response.status_code >= 300:
+                    return response.status_code, response.headers, b""
+                body = self._read_capped(response.headers.get("Content-Length"), response.iter_bytes(CHUNK_BYTES), url, max_bytes)
+                return response.status_code, response.headers, body
+        with self._client.request(method, url, timeout=timeout, headers=headers, json=json, stream=True,
+                                  allow_redirects=follow_redirects) as response:
+            if response.status_code >= 300:
+                return response.status_code, response.headers, b""
+            body = self._read_capped(response.headers.get("Content-Length"), response.iter_content(CHUNK_BYTES), url, max_bytes)
+            return response.status_code, response.headers, body
+
+    def _record(self, host: str, elapsed: float, size: int, error: bool = False, retry: bool = False) -> None:
+        stage_metrics.incr("http_requests")
+        stage_metrics.incr("bytes_downloaded", size)
+        with self._stats_lock:
+            stats = self.stats[host]
+            stats.requests += 1
+            stats.bytes += size
+            stats.seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            stats.errors += error
+            stats.retries += retry
+
+    def request(self, method: str, url: str, timeout: float = DEFAULT_TIMEOUT, max_bytes: Optional[int] = None,
+                headers: Optional[Dict[str, str]] = None, json: Any = None, expected: Sequence[int] = (),
+                follow_redirects: bool = True) -> bytes:
+        """
+        Returns the response body; raises HTTPStatusError, ResponseTooLarge or TransportError.
+        Statuses in `expected` (e.g. a 404 the caller falls back from) still raise but aren't counted as errors.
+        With follow_redirects=False a redirect raises HTTPStatusError instead of being followed.
+        """
+        host = urlparse(url).hostname or ""
+        max_bytes = max_bytes or self.max_bytes
+        # Only idempotent requests are retried
+        attempts = MAX_ATTEMPTS if method == "GET" else 1
+        for attempt in range(1, attempts + 1):
+            last = attempt == attempts
+            started = time.monotonic()
+            try:
+                status, response_headers, body = self._request(method, url, timeout, max_bytes, headers, json,
+                                                               follow_redirects)
+            except ResponseTooLarge:
+                stage_metrics.record_error("ResponseTooLarge")
+                raise
+            except self._transport_errors as e:
+                self._record(host, time.monotonic() - started, 0, error=True, retry=not last)
+                stage_metrics.record_error(type(e).__name__)
+                if last:
+                    raise TransportError(f"{type(e).__name__} for {url}: {e}") from e
+                time.sleep(BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(1, 1.5))
+                continue
+
+            if status in RETRY_STATUSES and not last:
+                self._record(host, time.monotonic() - started, 0, error=True, retry=True)
+                stage_metrics.record_error(f"HTTP {status}")
+                retry_after = parse_retry_after(response_headers.get("Retry-After"))
+                delay = retry_after if retry_after is not None else BACKOFF_SECONDS * 2 ** (attempt - 1)
+                time.sleep(min(MAX_RETRY_AFTER_SECONDS, delay) * random.uniform(1, 1.5))
+                continue
+            # Only reachable with follow_redirects=False, or a 3xx without a Location to follow
+            failed = status >= 300 and status not in expected
+            self._record(host, time.monotonic() - started, len(body), error=failed)
+            if status >= 300:
+                if failed:
+                    stage_metrics.record_error(f"HTTP {status}")
+                raise HTTPStatusError(url, status)
+            return body
+
+    def get_bytes(self, url: str, timeout: float = DEFAULT_TIMEOUT, max_bytes: Optional[int] = None,
+                  headers: Optional[Dict[str, str]] = None, expected: Sequence[int] = (),
+                  follow_redirects: bool = True) -> bytes:
+        return self.request("GET", url, timeout, max_bytes, headers, expected=expected,
+                            follow_redirects=follow_redirects)
+
+    def post_json(self, url: str, payload: Any, timeout: float = DEFAULT_TIMEOUT) -> bytes:
+        return self.request("POST", url, timeout, json=payload)
+
+    def stats_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self._stats_lock:
+            return {host: stats.as_dict() for host, stats in self.stats.items()}
+
+    def log_stats(self) -> None:
+        for host, stats in self.stats_dict().items():
+            logging.info(
+                f"🌐 {host}: {stats['requests']} requests ({stats['retries']} retried, {stats['errors']} errors), "
+                f"{stats['bytes'] / 1024 / 1024:.1f} MB, avg {stats['avg_ms']} ms, max {stats['max_ms']} ms"
+            )
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+def default_client() -> HttpClient:
+    """The process-wide client; created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
+
+def get_bytes(url: str, timeout: float = DEFAULT_TIMEOUT, max_bytes: Optional[int] = None,
+              headers: Optional[Dict[str, str]] = None, expected: Sequence[int] = (),
+              follow_redirects: bool = True) -> bytes:
+    """Downloads a URL through the shared client."""
+    return default_client().get_bytes(url, timeout, max_bytes, headers, expected, follow_redirects)
+
+def post_json(url: str, payload: Any, timeout: float = DEFAULT_TIMEOUT) -> bytes:
+    return default_client().post_json(url, payload, timeout)
+
+def log_stats() -> None:
+    if _client is not None:
+        _client.log_stats()
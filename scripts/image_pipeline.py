@@ -0,0 +1,178 @@
+import queue
+import logging
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import clip_encoder
+import stage_metrics
+from embedding_cache import EmbeddingCache
+
+_DONE = object()
+
+class PipelineResult(NamedTuple):
+    key: Any
+    url: str
+    embedding: Optional[np.ndarray]
+    error: Optional[str]
+
+class ImagePipeline:
+    """
+    Staged fetch → decode → batched encode pipeline.
+
+    A bounded pool of downloader threads feeds raw bytes to decoder threads,
+    which feed decoded images to the caller's thread where they are encoded
+    `batch_size` at a time. Every hand-off is a bounded queue, so a slow
+    encoder stalls the decoders and downloaders instead of buffering the
+    whole job list in memory.
+
+    With a `cache`, downloaders first look the URL up (skipping the fetch),
+    then the content hash of the downloaded bytes (skipping decode and
+    encode); cached vectors are passed straight through to the output.
+    """
+
+    def __init__(self, fetch: Callable[[str], bytes],
+                 encode: Callable[[List[Any]], np.ndarray] = clip_encoder.encode_images,
+                 decode: Callable[[bytes], Any] = clip_encoder.open_image,
+                 batch_size: int = 16, download_workers: int = 8,
+                 decode_workers: int = 2, queue_size: int = 32,
+                 cache: Optional[EmbeddingCache] = None):
+        self.fetch = fetch
+        self.encode = encode
+        self.decode = decode
+        self.batch_size = max(1, batch_size)
+        self.download_workers = max(1, download_workers)
+        self.decode_workers = max(1, decode_workers)
+        self.queue_size = max(self.batch_size, queue_size)
+        self.cache = cache
+
+    def run(self, jobs: Iterable[Tuple[Any, str]]) -> Iterator[List[PipelineResult]]:
+        """Yields one list of results per encoded batch; failed jobs ride along with an error."""
+        stop = threading.Event()
+        job_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        raw_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        ready_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        def put(q: queue.Queue, value: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(value, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def feed():
+            for key, url in jobs:
+                if not put(job_q, (key, url)):
+                    return
+            for _ in range(self.download_workers):
+                put(job_q, _DONE)
+
+        def download():
+            while not stop.is_set():
+                job = job_q.get()
+                if job is _DONE:
+                    return
+                key, url = job
+                try:
+                    cached = self.cache.get_by_url(url) if self.cache else None
+                    if cached is not None:
+                        stage_metrics.incr("cache_hits")
+                        put(ready_q, (key, url, None, None, None, cached))
+                        continue
+                    data = self.fetch(url)
+                    stage_metrics.incr("images_fetched")
+                    content_hash = EmbeddingCache.hash_bytes(data) if self.cache else None
+                    cached = self.cache.get_by_hash(content_hash, url) if self.cache else None
+                    if cached is not None:
+                        stage_metrics.incr("cache_hits")
+                        put(ready_q, (key, url, None, None, None, cached))
+                    else:
+                        put(raw_q, (key, url, data, None, content_hash))
+                except Exception as e:
+                    put(raw_q, (key, url, None, f"fetch failed: {e}", None))
+
+        def decode():
+            while not stop.is_set():
+                entry = raw_q.get()
+                if entry is _DONE:
+                    return
+                key, url, data, error, content_hash = entry
+                if error is None:
+                    try:
+                        put(ready_q, (key, url, self.decode(data), None, content_hash, None))
+                        continue
+                    except Exception as e:
+                        stage_metrics.record_error(type(e).__name__)
+                        error = f"decode failed: {e}"
+                put(ready_q, (key, url, None, error, None, None))
+
+        downloaders = [threading.Thread(target=download, daemon=True) for _ in range(self.download_workers)]
+        decoders = [threading.Thread(target=decode, daemon=True) for _ in range(self.decode_workers)]
+
+        def coordinate():
+            # Each stage is closed only after every worker of the stage before it has exited
+            for t in downloaders:
+                t.join()
+            for _ in decoders:
+                put(raw_q, _DONE)
+            for t in decoders:
+                t.join()
+            put(ready_q, _DONE)
+
+        threads = [threading.Thread(target=feed, daemon=True), *downloaders, *decoders,
+                   threading.Thread(target=coordinate, daemon=True)]
+        for t in threads:
+            t.start()
+
+        try:
+            pending: List[Tuple[Any, str, Any, Optional[str]]] = []
+            done: List[PipelineResult] = []
+            while True:
+                entry = ready_q.get()
+                if entry is _DONE:
+                    break
+                key, url, image, error, content_hash, cached = entry
+                if cached is not None:
+                    done.append(PipelineResult(key, url, cached, None))
+                elif error is not None:
+                    done.append(PipelineResult(key, url, None, error))
+                else:
+                    pending.append((key, url, image, content_hash))
+                if len(pending) >= self.batch_size or len(done) >= self.batch_size:
+                    yield self._encode_batch(pending) + done
+                    pending, done = [], []
+            if pending or done:
+                yield self._encode_batch(pending) + done
+        finally:
+            stop.set()
+            # Unblock any worker still waiting on an upstream queue
+            for q, count in ((job_q, self.download_workers), (raw_q, self.decode_workers)):
+                for _ in range(count):
+                    try:
+                        q.put_nowait(_DONE)
+                    except queue.Full:
+                        break
+
+    def _encode_batch(self, pending: List[Tuple[Any, str, Any, Optional[str]]]) -> List[PipelineResult]:
+        if not pending:
+            return []
+        try:
+            embeddings = self.encode([image for _, _, image, _ in pending])
+        except Exception as e:
+            logging.warning(f"Batch encode of {len(pending)} images failed: {e}")
+            stage_metrics.record_error(type(e).__name__)
+            return [PipelineResult(key, url, None, f"encode failed: {e}") for key, url, _, _ in pending]
+
+        stage_metrics.incr("embeddings", len(pending))
+        results = []
+        for (key, url, _, content_hash), emb in zip(pending, embeddings):
+            if self.cache is not None and content_hash:
+                try:
+                    self.cache.put(emb, content_hash, url)
+                except Exception as e:
+                    logging.warning(f"Embedding cache write failed: {e}")
+            results.append(PipelineResult(key, url, emb, None))
+        return results
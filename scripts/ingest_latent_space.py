@@ -2,18 +2,30 @@ import os
 import glob
 import time
 import logging
+import argparse
 from pathlib import Path
-from PIL import Image
-from sentence_transformers import SentenceTransformer
+from typing import Any, Dict, List, Optional
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+import ann_index
+import cdn_variants
+import clip_encoder
+import vector_store
+from decode_pool import DecodePool
+from ingest_manifest import IngestManifest, MAX_ATTEMPTS
+
 # --- CONFIGURATION ---
 IMAGE_DIR = "/home/mbn/Downloads/archive/fashion-dataset/images"
 BATCH_SIZE = 64
-CDN_BASE_URL = "https://cdn.mbn-code.dk/"
-MODEL_NAME = 'clip-ViT-B-32'
+# New vectors are pushed into the local vector store and ANN index every this many batches
+INDEX_FLUSH_BATCHES = 50
+# Upserts are retried in place before a batch is recorded as failed in the manifest
+UPSERT_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 2
+CDN_BASE_URL = cdn_variants.CDN_BASE_URL
+MODEL_NAME = clip_encoder.MODEL_NAME
 
 # Configure Logging
 logging.basicConfig(
@@ -34,18 +46,25 @@ else:
 SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    logging.error("Missing Supabase credentials in environment.")
-    exit(1)
+supabase: Optional[Client] = None
 
-# Initialize CLIP and Supabase
-logging.info(f"🚀 Loading {MODEL_NAME}...")
-try:
-    model = SentenceTransformer(MODEL_NAME)
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-except Exception as e:
-    logging.error(f"Initialization Failed: {e}")
-    exit(1)
+def initialize():
+    """
+    Loads CLIP and connects to Supabase. Called from __main__ only: the decode
+    workers are spawned and re-import this module, and must not load the model.
+    """
+    global supabase
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        logging.error("Missing Supabase credentials in environment.")
+        exit(1)
+
+    logging.info(f"🚀 Loading {MODEL_NAME}...")
+    try:
+        clip_encoder.load_model()
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    except Exception as e:
+        logging.error(f"Initialization Failed: {e}")
+        exit(1)
 
 def get_existing_urls():
     """Fetches all existing image URLs from Supabase to prevent duplicates."""
@@ -72,74 +91,115 @@ def get_existing_urls():
     
     return existing
 
-def ingest():
-    existing_urls = get_existing_urls()
-    
+def cdn_url_for(path: str) -> str:
+    # The display variant uploaded by mass_ftp_uploader.py; embeddings are computed from the local original
+    return f"{CDN_BASE_URL}{cdn_variants.variant_name(Path(path).name)}"
+
+def scan_directory(manifest: IngestManifest, rescan: bool) -> None:
+    """Registers new files in the manifest; skipped when the directory hasn't changed since the last scan."""
+    dir_mtime = str(os.stat(IMAGE_DIR).st_mtime)
+    if not rescan and manifest.get_meta("dir_mtime") == dir_mtime:
+        logging.info("📂 Image directory unchanged since last scan, resuming from manifest")
+        return
+
     # Find all images
     image_paths = glob.glob(os.path.join(IMAGE_DIR, "*.jpg")) + \
                   glob.glob(os.path.join(IMAGE_DIR, "*.jpeg")) + \
                   glob.glob(os.path.join(IMAGE_DIR, "*.png"))
-    
-    total_images = len(image_paths)
-    logging.info(f"📂 Found {total_images} local images. Filtering for ingestion...")
+    added = manifest.add_files(image_paths)
+    logging.info(f"📂 Found {len(image_paths)} local images, {added} new to the manifest")
+
+    # The remote table is only consulted to seed a fresh manifest (or on --rescan)
+    if rescan or manifest.get_meta("seeded") is None:
+        existing_urls = get_existing_urls()
+        manifest.mark_ingested(p for p in image_paths if cdn_url_for(p) in existing_urls)
+        manifest.set_meta("seeded", str(time.time()))
+    manifest.set_meta("dir_mtime", dir_mtime)
+
+def store_batch(valid_data: List[Dict[str, Any]]) -> None:
+    """Upserts one batch, retrying transient failures with exponential backoff."""
+    for attempt in range(1, UPSERT_ATTEMPTS + 1):
+        try:
+            supabase.table("style_latent_space").upsert(valid_data).execute()
+            return
+        except Exception as e:
+            if attempt == UPSERT_ATTEMPTS:
+                raise
+            logging.warning(f"⚠️ Upsert attempt {attempt} failed ({e}), retrying...")
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
 
-    # Filter out already ingested images
-    pending_paths = []
-    for p in image_paths:
-        cdn_url = f"{CDN_BASE_URL}{Path(p).with_suffix('.webp').name}"
-        if cdn_url not in existing_urls:
-            pending_paths.append(p)
+def ingest(rescan: bool = False):
+    manifest = IngestManifest()
+    scan_directory(manifest, rescan)
 
+    pending_paths = manifest.pending()
     total_pending = len(pending_paths)
-    logging.info(f"✨ {total_pending} images are new. Starting high-performance ingestion...")
+    logging.info(f"✨ {total_pending} images to ingest ({manifest.counts()}). Starting high-performance ingestion...")
 
     if total_pending == 0:
         logging.info("🏁 No new images to ingest.")
+        manifest.close()
         return
 
-    # Process in optimized batches
-    for i in tqdm(range(0, total_pending, BATCH_SIZE), desc="Neural Latent Ingestion"):
-        batch_paths = pending_paths[i:i + BATCH_SIZE]
-        batch_images = []
-        valid_data = []
-
-        for path in batch_paths:
-            try:
-                # Open and convert to RGB
-                img = Image.open(path).convert("RGB")
-                batch_images.append(img)
-                
-                # Metadata
-                cdn_url = f"{CDN_BASE_URL}{Path(path).with_suffix('.webp').name}"
-                valid_data.append({
-                    "image_url": cdn_url,
-                    "source": "fashion-dataset",
-                    "archetype": "general" # Can be refined later based on attributes.csv
-                })
-            except Exception as e:
-                logging.error(f"❌ Failed to load {path}: {e}")
-                continue
-
-        if not batch_images:
+    index_entries = []
+    batches = (pending_paths[i:i + BATCH_SIZE] for i in range(0, total_pending, BATCH_SIZE))
+    total_batches = -(-total_pending // BATCH_SIZE)
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+
+    # Decoding runs in worker processes a few batches ahead of the encoder
+    decoded = DecodePool().run(batches)
+    for batch_no, (paths, hashes, pixels, failed) in enumerate(tqdm(decoded, total=total_batches, desc="Neural Latent Ingestion")):
+        batch_id = f"{run_id}/{batch_no}"
+        for path, error in failed:
+            logging.error(f"❌ Failed to load {path}: {error}")
+
+        if pixels is None:
+            manifest.record_batch(batch_id, [], failed)
             continue
 
+        valid_data = [{
+            "image_url": cdn_url_for(path),
+            "source": "fashion-dataset",
+            "archetype": "general" # Can be refined later based on attributes.csv
+        } for path in paths]
+
         try:
             # Generate Embeddings (CLIP 512-dim)
-            embeddings = model.encode(batch_images, show_progress_bar=False)
+            embeddings = clip_encoder.encode_pixels(pixels)
 
             # Map embeddings to data
             for j, emb in enumerate(embeddings):
-                valid_data[j]["embedding"] = emb.tolist()
+                valid_data[j]["embedding"] = vector_store.json_vector(emb)
 
             # Batch Upsert to Supabase
-            supabase.table("style_latent_space").upsert(valid_data).execute()
-            
+            store_batch(valid_data)
         except Exception as e:
-            logging.error(f"🔥 Batch Failed at offset {i}: {e}")
-            time.sleep(2) 
+            # Recorded rather than dropped: the next run retries these files
+            logging.error(f"🔥 Batch {batch_id} failed: {e}")
+            manifest.record_failure(batch_id, paths, str(e))
+            manifest.record_batch(batch_id, [], failed)
             continue
 
-    logging.info("🏁 Ingestion Process Complete.")
+        manifest.record_batch(batch_id, list(zip(paths, hashes)), failed)
+        for row, emb in zip(valid_data, embeddings):
+            index_entries.append({**row, "embedding": emb, "category": row["archetype"]})
+        if (batch_no + 1) % INDEX_FLUSH_BATCHES == 0:
+            vector_store.append_entries(index_entries)
+            ann_index.update_index(index_entries)
+            index_entries = []
+
+    vector_store.append_entries(index_entries)
+    ann_index.update_index(index_entries)
+    counts = manifest.counts()
+    manifest.close()
+    if counts.get("failed"):
+        logging.warning(f"⚠️ {counts['failed']} images are in failed batches; re-run to retry them (up to {MAX_ATTEMPTS} attempts)")
+    logging.info(f"🏁 Ingestion Process Complete. Manifest: {counts}")
 
 if __name__ == "__main__":
-    ingest()
+    parser = argparse.ArgumentParser(description="Embed a local image directory into style_latent_space.")
+    parser.add_argument("--rescan", action="store_true",
+                        help="Re-list the image directory and re-check style_latent_space for already ingested images")
+    args = parser.parse_args()
+    initialize()
+    ingest(rescan=args.rescan)
@@ -0,0 +1,99 @@
+import os
+import time
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# --- CONFIGURATION ---
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "cache/ingest_manifest.db")
+# A file whose batch failed this many times (across runs) is left for manual inspection
+MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+
+class IngestManifest:
+    """
+    Per-file checkpoint of an ingest run: content hash, status and batch id.
+
+    Status is one of pending, done, failed (batch error, retried up to
+    MAX_ATTEMPTS) or unreadable (decode error, not retried). Every batch is
+    committed as it finishes, so a killed run resumes where it stopped.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                content_hash TEXT,
+                batch_id TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_status ON files(status);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self._conn.commit()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def add_files(self, paths: Iterable[str]) -> int:
+        """Registers newly seen files as pending; returns how many were new."""
+        with self._conn:
+            cursor = self._conn.executemany("INSERT OR IGNORE INTO files (path) VALUES (?)", [(p,) for p in paths])
+        return cursor.rowcount
+
+    def mark_ingested(self, paths: Iterable[str]) -> None:
+        """Marks files already present remotely (e.g. from before the manifest existed) as done."""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE files SET status = 'done', updated_at = ? WHERE path = ? AND status != 'done'",
+                [(now, p) for p in paths]
+            )
+
+    def pending(self, max_attempts: int = MAX_ATTEMPTS) -> List[str]:
+        rows = self._conn.execute(
+            "SELECT path FROM files WHERE status IN ('pending', 'failed') AND attempts < ? ORDER BY path",
+            (max_attempts,)
+        )
+        return [row[0] for row in rows]
+
+    def record_batch(self, batch_id: str, done: List[Tuple[str, str]],
+                     unreadable: List[Tuple[str, str]]) -> None:
+        """Checkpoints a finished batch: [(path, content_hash)] ingested, [(path, error)] undecodable."""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE files SET status = 'done', content_hash = ?, batch_id = ?, error = NULL, updated_at = ? WHERE path = ?",
+                [(content_hash, batch_id, now, path) for path, content_hash in done]
+            )
+            self._conn.executemany(
+                "UPDATE files SET status = 'unreadable', batch_id = ?, error = ?, updated_at = ? WHERE path = ?",
+                [(batch_id, error, now, path) for path, error in unreadable]
+            )
+
+    def record_failure(self, batch_id: str, paths: List[str], error: str) -> None:
+        """Marks a batch that could not be stored; its files are retried on a later run."""
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE files SET status = 'failed', batch_id = ?, attempts = attempts + 1, error = ?, updated_at = ? WHERE path = ?",
+                [(batch_id, error, time.time(), p) for p in paths]
+            )
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self._conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,136 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+from typing import Any, Dict, List, Optional
+
+# --- CONFIGURATION ---
+# Set PRUNE_CACHE_PATH="" to disable conditional requests and the recheck schedule
+CACHE_PATH = os.getenv("PRUNE_CACHE_PATH", "cache/listing_cache.db")
+# A listing whose price hasn't moved for T is next checked after T * RECHECK_FACTOR, capped
+RECHECK_FACTOR = float(os.getenv("PRUNE_RECHECK_FACTOR", "0.25"))
+MAX_RECHECK_SECONDS = float(os.getenv("PRUNE_MAX_RECHECK_HOURS", "6")) * 3600
+# Rows for listings that stopped being checked (sold, removed) are dropped after this
+RETENTION_SECONDS = 30 * 24 * 3600
+
+COLUMNS = ["url", "etag", "last_modified", "body_hash", "price", "last_checked", "last_changed", "next_check"]
+
+class ListingCache:
+    """
+    Per-URL validators, last parsed result and recheck schedule for listing pages.
+
+    All rows are loaded up front and written back in one transaction by
+    save(), so lookups from the event loop never touch the disk.
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                price REAL,
+                last_checked REAL NOT NULL,
+                last_changed REAL NOT NULL,
+                next_check REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        cursor = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM listings")
+        self.rows: Dict[str, Dict[str, Any]] = {row[0]: dict(zip(COLUMNS, row)) for row in cursor}
+        self._dirty: set = set()
+        self._forgotten: set = set()
+
+        self.skipped = 0
+        self.not_modified = 0
+        self.identical = 0
+        self.changed = 0
+
+    def is_due(self, url: str, now: Optional[float] = None) -> bool:
+        row = self.rows.get(url)
+        if row is None or (now or time.time()) >= row["next_check"]:
+            return True
+        self.skipped += 1
+        return False
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        row = self.rows.get(url)
+        headers = {}
+        if row and row["etag"]:
+            headers["If-None-Match"] = row["etag"]
+        if row and row["last_modified"]:
+            headers["If-Modified-Since"] = row["last_modified"]
+        return headers
+
+    def price(self, url: str) -> Optional[float]:
+        row = self.rows.get(url)
+        return row["price"] if row else None
+
+    def _schedule(self, row: Dict[str, Any], now: float) -> None:
+        stable_for = now - row["last_changed"]
+        interval = min(MAX_RECHECK_SECONDS, stable_for * RECHECK_FACTOR)
+        # Spread rechecks so listings seen together don't all come due on the same run
+        row["next_check"] = now + interval * random.uniform(0.8, 1.0)
+        row["last_checked"] = now
+        self._dirty.add(row["url"])
+
+    def record_not_modified(self, url: str) -> bool:
+        """
+        The server answered 304: the stored result still holds. False when there
+        is no stored result (forgotten meanwhile, or a 304 nobody asked for).
+        """
+        row = self.rows.get(url)
+        if row is None:
+            return False
+        self.not_modified += 1
+        self._schedule(row, time.time())
+        return True
+
+    def record(self, url: str, etag: Optional[str], last_modified: Optional[str],
+               body_hash: str, price: Optional[float]) -> None:
+        """Stores a freshly parsed page; a moved price resets the recheck interval."""
+        now = time.time()
+        row = self.rows.get(url)
+        if row is None:
+            row = {"url": url, "price": price, "body_hash": None, "last_changed": now}
+            self.rows[url] = row
+        elif row["body_hash"] == body_hash:
+            self.identical += 1
+        elif row["price"] != price:
+            self.changed += 1
+            row["last_changed"] = now
+        row.update(etag=etag, last_modified=last_modified, body_hash=body_hash, price=price)
+        self._forgotten.discard(url)
+        self._schedule(row, now)
+
+    def forget(self, url: str) -> None:
+        """Drops a listing that is gone, so a relisting starts from scratch."""
+        if self.rows.pop(url, None) is not None:
+            self._dirty.discard(url)
+            self._forgotten.add(url)
+
+    def save(self) -> None:
+        rows: List[tuple] = [tuple(self.rows[url][c] for c in COLUMNS) for url in self._dirty]
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO listings ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+            self._conn.executemany("DELETE FROM listings WHERE url = ?", [(u,) for u in self._forgotten])
+            self._conn.execute("DELETE FROM listings WHERE last_checked < ?", (time.time() - RETENTION_SECONDS,))
+        self._dirty.clear()
+        self._forgotten.clear()
+
+    def log_stats(self) -> None:
+        logging.info(
+            f"🗂️ Listing cache: {self.skipped} not due, {self.not_modified} not modified (304), "
+            f"{self.identical} identical bodies, {self.changed} price moves"
+        )
+
+    def close(self) -> None:
+        self._conn.close()
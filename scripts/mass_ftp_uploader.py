@@ -1,17 +1,34 @@
 import os
+import time
+import hashlib
+import queue
 import sqlite3
 import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from ftplib import FTP, error_perm
-from PIL import Image
 from tqdm import tqdm
 from pathlib import Path
 import io
 
+import cdn_variants
+
 # --- CONFIGURATION ---
 SOURCE_DIR = "/home/mbn/Downloads/archive/fashion-dataset/images"
 DB_PATH = "upload_registry.db"
-MAX_WIDTH = 800
-WEBP_QUALITY = 80
+# Sizes, qualities and CDN names of the uploaded variants live in cdn_variants
+AVIF = cdn_variants.UPLOAD_AVIF and cdn_variants.avif_supported()
+
+# Parallelism: WebP encodes in a process pool, uploads over several FTP sessions
+ENCODE_WORKERS = int(os.getenv("UPLOAD_ENCODE_WORKERS", str(os.cpu_count() or 2)))
+FTP_CONNECTIONS = int(os.getenv("UPLOAD_FTP_CONNECTIONS", "4"))
+UPLOAD_ATTEMPTS = 3
+RECONNECT_BACKOFF_SECONDS = 2
+# Registry writes are grouped into one transaction per this many files or seconds
+COMMIT_EVERY = 200
+COMMIT_INTERVAL_SECONDS = 5
 
 # FTP Credentials
 FTP_HOST = "pro02.azehosting.net"
@@ -23,38 +40,167 @@ FTP_DIR = "cdn.mbn-code.dk"
 # --- LOGGING & STATE ---
 logging.basicConfig(level=logging.INFO, filename="uploader.log", format="%(asctime)s - %(message)s")
 
+# Settings that change what ends up on the CDN; a mismatch means the file is re-encoded.
+# WebP effort only trades CPU for size, so it isn't part of this.
+WEBP_PARAMS = cdn_variants.variant_params(AVIF)
+REGISTRY_COLUMNS = ["filename", "source_size", "source_hash", "webp_params", "webp_size"]
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     conn.execute("CREATE TABLE IF NOT EXISTS uploads (filename TEXT PRIMARY KEY, uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    # Registries created before size/hash tracking get the new columns in place
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(uploads)")}
+    for column, kind in [("source_size", "INTEGER"), ("source_hash", "TEXT"), ("webp_params", "TEXT"), ("webp_size", "INTEGER")]:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE uploads ADD COLUMN {column} {kind}")
     conn.commit()
     return conn
 
-def is_uploaded(conn, filename):
-    cursor = conn.execute("SELECT 1 FROM uploads WHERE filename = ?", (filename,))
-    return cursor.fetchone() is not None
+def load_registry(conn):
+    """Loads every uploaded file's record into memory: filename → (source_size, source_hash, webp_params)."""
+    rows = conn.execute("SELECT filename, source_size, source_hash, webp_params FROM uploads")
+    return {row[0]: row[1:] for row in rows}
+
+def file_hash(file_path):
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-def mark_as_uploaded(conn, filename):
-    conn.execute("INSERT INTO uploads (filename) VALUES (?)", (filename,))
+def needs_upload(registry, file_path, verify=False, backfill=False):
+    """
+    New files, files whose size changed and files encoded with other settings
+    need (re-)uploading. Rows from before size tracking are trusted as-is
+    unless backfill is set. With verify, content hashes are compared too.
+    """
+    entry = registry.get(file_path.name)
+    if entry is None:
+        return True
+    source_size, source_hash, webp_params = entry
+    if webp_params is None:
+        return backfill
+    if webp_params != WEBP_PARAMS:
+        return True
+    if source_size is not None and source_size != file_path.stat().st_size:
+        return True
+    return verify and source_hash is not None and source_hash != file_hash(file_path)
+
+def mark_as_uploaded(conn, records):
+    conn.executemany(
+        f"INSERT OR REPLACE INTO uploads ({', '.join(REGISTRY_COLUMNS)}) VALUES ({', '.join('?' * len(REGISTRY_COLUMNS))})",
+        [tuple(r[c] for c in REGISTRY_COLUMNS) for r in records]
+    )
     conn.commit()
 
 # --- IMAGE PROCESSING ---
-def process_image(file_path):
-    """Resizes and converts image to WebP buffer."""
-    with Image.open(file_path) as img:
-        img = img.convert("RGB")
-        if img.width > MAX_WIDTH:
-            ratio = MAX_WIDTH / float(img.width)
-            new_height = int(float(img.height) * float(ratio))
-            img = img.resize((MAX_WIDTH, new_height), Image.Resampling.LANCZOS)
-        
-        buffer = io.BytesIO()
-        img.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=6)
-        buffer.seek(0)
-        return buffer
+def encode_file(file_path):
+    """Process-pool task: returns (registry record, [(remote filename, bytes)], error or None)."""
+    record = {"filename": file_path.name, "webp_params": WEBP_PARAMS}
+    try:
+        with open(file_path, "rb") as f:
+            source = f.read()
+        files = cdn_variants.render_variants(source, file_path.name, AVIF)
+        # webp_size tracks the display variant, the file the storefront serves
+        record.update(source_size=len(source), source_hash=hashlib.sha256(source).hexdigest(), webp_size=len(files[0][1]))
+        return record, files, None
+    except Exception as e:
+        return record, [], str(e)
+
+# --- FTP SESSIONS ---
+def open_ftp():
+    ftp = FTP()
+    ftp.connect(FTP_HOST, FTP_PORT, timeout=60)
+    ftp.login(FTP_USER, FTP_PASS)
+    try:
+        ftp.cwd(FTP_DIR)
+    except error_perm:
+        logging.warning(f"Could not CWD to {FTP_DIR}, staying in root.")
+    return ftp
+
+def close_ftp(ftp):
+    try:
+        ftp.quit()
+    except Exception:
+        ftp.close()
+
+def upload_worker(jobs, results):
+    """Owns one FTP session; reconnects and retries when a transfer fails."""
+    ftp = None
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        record, files = job
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                if ftp is None:
+                    ftp = open_ftp()
+                # A retry re-sends every variant; STOR overwrites, so partial sets are completed
+                for remote_name, data in files:
+                    ftp.storbinary(f"STOR {remote_name}", io.BytesIO(data))
+                results.put((record, None))
+                break
+            except Exception as e:
+                if ftp is not None:
+                    close_ftp(ftp)
+                    ftp = None
+                if attempt == UPLOAD_ATTEMPTS:
+                    results.put((record, f"upload failed: {e}"))
+                else:
+                    time.sleep(RECONNECT_BACKOFF_SECONDS * attempt)
+    if ftp is not None:
+        close_ftp(ftp)
 
 # --- CORE UPLOADER ---
-def run_upload(test_mode=False):
+class RegistryWriter:
+    """Collects finished uploads from the worker threads and commits them in batches."""
+
+    def __init__(self, conn, results, progress):
+        self.conn = conn
+        self.results = results
+        self.progress = progress
+        self.pending = []
+        self.last_commit = time.monotonic()
+        self.uploaded = 0
+        self.failed = 0
+
+    def record(self, record, error):
+        if error:
+            logging.error(f"Failed to process {record['filename']}: {error}")
+            self.failed += 1
+        else:
+            self.pending.append(record)
+            self.uploaded += 1
+        self.progress.update(1)
+
+    def drain(self, block=False):
+        while True:
+            try:
+                self.record(*self.results.get(block=block, timeout=1 if block else None))
+            except queue.Empty:
+                break
+            block = False
+        if len(self.pending) >= COMMIT_EVERY or time.monotonic() - self.last_commit >= COMMIT_INTERVAL_SECONDS:
+            self.commit()
+
+    def commit(self):
+        if self.pending:
+            mark_as_uploaded(self.conn, self.pending)
+            self.pending = []
+        self.last_commit = time.monotonic()
+
+def dispatch(encoded, jobs, writer):
+    """Hands an encoded image to the uploaders (blocking while they are busy)."""
+    record, files, error = encoded
+    if error:
+        writer.record(record, error)
+    else:
+        jobs.put((record, files))
+    writer.drain()
+
+def run_upload(test_mode=False, verify=False, backfill=False):
     conn = init_db()
+    registry = load_registry(conn)
     
     source_path = Path(SOURCE_DIR)
     if not source_path.exists():
@@ -62,48 +208,58 @@ def run_upload(test_mode=False):
         return
 
     files = list(source_path.glob("*.jpg")) + list(source_path.glob("*.jpeg")) + list(source_path.glob("*.png"))
-    print(f"🚀 Found {len(files)} local images. Initializing FTP...")
+    pending = [f for f in files if needs_upload(registry, f, verify, backfill)]
+    if test_mode:
+        pending = pending[:1]
+    print(f"🚀 Found {len(files)} local images, {len(pending)} to upload.")
+    if cdn_variants.UPLOAD_AVIF and not AVIF:
+        print("⚠️ UPLOAD_AVIF is set but this Pillow has no AVIF encoder; uploading WebP only.")
+    if not pending:
+        return
 
     try:
-        ftp = FTP()
-        ftp.connect(FTP_HOST, FTP_PORT)
-        ftp.login(FTP_USER, FTP_PASS)
-        
-        try:
-            ftp.cwd(FTP_DIR)
-        except error_perm:
-            print(f"⚠️ Warning: Could not CWD to {FTP_DIR}, staying in root.")
-
-        count = 0
-        for file_path in tqdm(files, desc="Neural Image Ingestion"):
-            filename = file_path.name
-            webp_filename = file_path.with_suffix(".webp").name
-
-            if is_uploaded(conn, filename):
-                continue
-
-            try:
-                image_buffer = process_image(file_path)
-                ftp.storbinary(f"STOR {webp_filename}", image_buffer)
-                mark_as_uploaded(conn, filename)
-                count += 1
+        # Fail fast on bad credentials before spinning up the pipeline
+        close_ftp(open_ftp())
+    except Exception as e:
+        print(f"🔥 FTP Connection Error: {e}")
+        return
 
-                if test_mode:
-                    print(f"\n✅ Test Upload Successful: {webp_filename}")
-                    print(f"🔗 Check it at: https://cdn.mbn-code.dk/{webp_filename}")
-                    break
+    connections = 1 if test_mode else max(1, FTP_CONNECTIONS)
+    print(f"⚙️ Encoding with {ENCODE_WORKERS} processes, uploading over {connections} FTP connections...")
+    # Bounded so encoded images never pile up faster than the uploads drain them
+    jobs = queue.Queue(maxsize=connections * 4)
+    results = queue.Queue()
+    workers = [threading.Thread(target=upload_worker, args=(jobs, results), daemon=True) for _ in range(connections)]
+    for worker in workers:
+        worker.start()
 
-            except Exception as e:
-                logging.error(f"Failed to process {filename}: {str(e)}")
-                continue
+    with tqdm(total=len(pending), desc="Neural Image Ingestion") as progress:
+        writer = RegistryWriter(conn, results, progress)
+        # Spawned, not forked: the upload threads are already running in this process
+        with ProcessPoolExecutor(max_workers=max(1, ENCODE_WORKERS), mp_context=multiprocessing.get_context("spawn")) as pool:
+            in_flight = deque()
+            for file_path in pending:
+                in_flight.append(pool.submit(encode_file, file_path))
+                if len(in_flight) >= ENCODE_WORKERS * 2:
+                    dispatch(in_flight.popleft().result(), jobs, writer)
+            while in_flight:
+                dispatch(in_flight.popleft().result(), jobs, writer)
 
-        ftp.quit()
-        print(f"🏁 Finished. Uploaded {count} new images.")
+        for _ in workers:
+            jobs.put(None)
+        while any(worker.is_alive() for worker in workers) or not results.empty():
+            writer.drain(block=True)
+        writer.commit()
 
-    except Exception as e:
-        print(f"🔥 FTP Connection Error: {e}")
+    if test_mode and writer.uploaded:
+        print(f"\n✅ Test Upload Successful: {pending[0].name}")
+        for variant in cdn_variants.VARIANTS:
+            print(f"🔗 Check it at: {cdn_variants.CDN_BASE_URL}{cdn_variants.variant_name(pending[0].name, variant)}")
+    print(f"🏁 Finished. Uploaded {writer.uploaded} new images ({writer.failed} failed, see uploader.log).")
 
 if __name__ == "__main__":
     import sys
     is_test = "--test" in sys.argv
-    run_upload(test_mode=is_test)
+    # --verify re-hashes already uploaded sources to catch edits that kept the same size;
+    # --backfill re-encodes files uploaded before the registry tracked variants
+    run_upload(test_mode=is_test, verify="--verify" in sys.argv, backfill="--backfill" in sys.argv)
@@ -1,22 +1,35 @@
 import os
 import sys
-import io
+import json
 import logging
+import threading
 from logging.handlers import RotatingFileHandler
-import requests
-import time
 import subprocess
-from PIL import Image
-from typing import List, Dict, Any, Optional, Set
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Iterator, Optional, Set, Tuple
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from tqdm import tqdm
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
-def check_ml_available():
+import ann_index
+import cdn_variants
+import clip_encoder
+import embedding_writer
+import http_client
+import stage_metrics
+import vector_store
+from embedding_cache import open_default_cache
+from image_pipeline import ImagePipeline
+
+# Import probed for each backend; the ONNX path never touches torch
+BACKEND_PROBES = {
+    "torch": "from sentence_transformers import SentenceTransformer",
+    "onnx": "import onnxruntime, tokenizers",
+}
+
+def check_ml_available(backend: str) -> bool:
     """
-    Safely checks if sentence_transformers can be imported without crashing.
+    Safely checks if the CLIP backend can be imported without crashing.
     On some ARM hardware (like Cortex-A72 Raspberry Pi 4), pre-compiled ML wheels
     may contain instructions (like ARMv8.2-A) that trigger an 'Illegal instruction'
     (SIGILL) and crash the entire Python process. By testing the import in a 
@@ -24,7 +37,7 @@ def check_ml_available():
     """
     try:
         result = subprocess.run(
-            [sys.executable, "-c", "from sentence_transformers import SentenceTransformer"],
+            [sys.executable, "-c", BACKEND_PROBES[backend]],
             capture_output=True,
             timeout=10
         )
@@ -32,15 +45,9 @@ def check_ml_available():
     except Exception:
         return False
 
-TORCH_AVAILABLE = check_ml_available()
+CLIP_BACKEND = clip_encoder.resolve_backend_name()
+ML_AVAILABLE = check_ml_available(CLIP_BACKEND)
 model = None
-SentenceTransformer = None
-
-if TORCH_AVAILABLE:
-    try:
-        from sentence_transformers import SentenceTransformer
-    except ImportError:
-        TORCH_AVAILABLE = False
 
 
 if os.path.exists(".env.local"):
@@ -49,9 +56,20 @@ else:
     load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
-BATCH_SIZE = 15
-MODEL_NAME = 'clip-ViT-B-32'
+# Service role only: the bulk embedding RPCs are not executable by anon/authenticated
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+BATCH_SIZE = 15  # Images per CLIP forward pass
+DOWNLOAD_WORKERS = int(os.getenv("NEURAL_SYNC_DOWNLOAD_WORKERS", "8"))
+MODEL_NAME = clip_encoder.MODEL_NAME
+PAGE_SIZE = 1000     # PostgREST max-rows default
+ID_CHUNK_SIZE = 200  # Keeps `in.(...)` filters well under URL length limits
+STATE_PATH = os.getenv("NEURAL_SYNC_STATE", "logs/neural_sync_state.json")
+WATERMARK_OVERLAP_SECONDS = 120
+# 404s in a row on the -clip CDN variant before a run stops asking for it (see ImageFetcher)
+CLIP_VARIANT_MAX_MISSES = 20
+INVENTORY_COLUMNS = "id, images, category, status, has_style_embedding, content_updated_at"
+# Statuses that are embedded; rows in any other status (e.g. archived) only update the ANN index
+LISTED_STATUSES = ["available", "sold"]
 
 logging.basicConfig(
     level=logging.INFO,
@@ -63,182 +81,330 @@ logging.basicConfig(
 )
 
 if not SUPABASE_URL or not SUPABASE_KEY:
-    logging.error("Missing Supabase credentials.")
+    logging.error("Missing Supabase credentials: neural sync needs SUPABASE_URL (or NEXT_PUBLIC_SUPABASE_URL) "
+                  "and SUPABASE_SERVICE_ROLE_KEY; the anon key cannot call the bulk embedding RPCs.")
     sys.exit(1)
 
 def generate_fallback_embedding() -> List[float]:
-    """Generate a placeholder embedding when torch is unavailable."""
+    """Generate a placeholder embedding when no CLIP backend is available."""
     import hashlib
     return [float((i * 7 + 13) % 100) / 100.0 for i in range(512)]
 
-# Configure Robust Requests Session
-session = requests.Session()
-retries = Retry(
-    total=3,
-    backoff_factor=1.5,
-    status_forcelist=[429, 500, 502, 503, 504],
-    allowed_methods=["GET"]
-)
-session.mount('http://', HTTPAdapter(max_retries=retries))
-session.mount('https://', HTTPAdapter(max_retries=retries))
-
 logging.info(f"🚀 Initializing Auvra Neural Sync ({MODEL_NAME})...")
-logging.info(f"🔧 PyTorch Available: {TORCH_AVAILABLE}")
+logging.info(f"🔧 CLIP Backend: {CLIP_BACKEND} (available: {ML_AVAILABLE})")
 
 supabase: Client
 try:
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    if TORCH_AVAILABLE:
+    stage_metrics.instrument_supabase(supabase)
+    if ML_AVAILABLE:
         try:
-            model = SentenceTransformer(MODEL_NAME)
+            model = clip_encoder.load_model(CLIP_BACKEND)
             logging.info("✅ CLIP Model Loaded Successfully")
         except Exception as e:
             logging.warning(f"⚠️ CLIP Model Load Failed: {e}")
             logging.warning("🔄 Falling back to placeholder embeddings")
-            TORCH_AVAILABLE = False
+            ML_AVAILABLE = False
     else:
-        logging.warning("⚠️ PyTorch not available - using fallback mode")
+        logging.warning(f"⚠️ CLIP backend '{CLIP_BACKEND}' not available - using fallback mode")
 except Exception as e:
     logging.error(f"Initialization Failed: {e}")
     sys.exit(1)
 
-def fetch_inventory_to_sync() -> List[Any]:
-    """Fetches all sold and available inventory items."""
+def load_state() -> Dict[str, Any]:
+    """Reads the incremental sync watermark from the local state file."""
     try:
-        response = supabase.table("pulse_inventory") \
-            .select("id, images, category, style_embedding") \
-            .or_("status.eq.available,status.eq.sold") \
-            .execute()
-        if response and response.data:
-            return response.data
-        return []
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_state(state: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(STATE_PATH) or ".", exist_ok=True)
+    tmp_path = f"{STATE_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, STATE_PATH)
+
+def next_state(state: Dict[str, Any], watermark: Optional[str], retry_ids: List[str], full_run: bool) -> Dict[str, Any]:
+    updated = {**state, "watermark": watermark, "retry_ids": retry_ids}
+    if full_run:
+        updated["last_full_sync"] = _format_ts(datetime.now(timezone.utc))
+    return updated
+
+def _to_utc(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+def _format_ts(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def fetch_inventory_to_sync(since: Optional[str] = None) -> List[Any]:
+    """
+    Fetches inventory of every status (archived rows included, so their index
+    entries can be refreshed), optionally only rows changed since a watermark.
+    """
+    rows: List[Any] = []
+    cursor: Optional[Dict[str, Any]] = None
+    try:
+        while True:
+            query = supabase.table("pulse_inventory").select(INVENTORY_COLUMNS)
+            if since:
+                query = query.gte("content_updated_at", since)
+            if cursor:
+                # Keyset pagination stays correct while rows are being updated underneath us
+                ts, last_id = cursor["content_updated_at"], cursor["id"]
+                query = query.or_(f"content_updated_at.gt.{ts},and(content_updated_at.eq.{ts},id.gt.{last_id})")
+            response = query.order("content_updated_at").order("id").limit(PAGE_SIZE).execute()
+
+            page = response.data if response and response.data else []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            cursor = page[-1]
     except Exception as e:
         logging.error(f"Failed to fetch inventory: {e}")
-        return []
+        return rows
 
-def get_synced_product_ids() -> Set[str]:
-    """Fetches already synced product IDs from latent space."""
+def fetch_inventory_by_ids(ids: List[str]) -> List[Any]:
+    """Re-fetches specific rows, e.g. items that failed in the previous run."""
+    rows: List[Any] = []
+    for i in range(0, len(ids), ID_CHUNK_SIZE):
+        try:
+            response = supabase.table("pulse_inventory") \
+                .select(INVENTORY_COLUMNS) \
+                .in_("status", LISTED_STATUSES) \
+                .in_("id", ids[i:i + ID_CHUNK_SIZE]) \
+                .execute()
+            rows.extend(response.data or [])
+        except Exception as e:
+            logging.warning(f"Could not re-fetch retry items: {e}")
+    return rows
+
+def get_synced_product_ids(product_ids: Optional[List[str]] = None) -> Set[str]:
+    """Fetches already synced product IDs from latent space, optionally limited to a candidate list."""
+    synced: Set[str] = set()
     try:
-        response = supabase.table("style_latent_space").select("product_id").execute()
-        if response and response.data:
-            return {str(item['product_id']) for item in response.data if isinstance(item, dict) and 'product_id' in item}
-        return set()
+        if product_ids is not None:
+            for i in range(0, len(product_ids), ID_CHUNK_SIZE):
+                response = supabase.table("style_latent_space") \
+                    .select("product_id") \
+                    .in_("product_id", product_ids[i:i + ID_CHUNK_SIZE]) \
+                    .execute()
+                synced.update(str(item['product_id']) for item in response.data or [] if item.get('product_id'))
+            return synced
+
+        offset = 0
+        while True:
+            response = supabase.table("style_latent_space") \
+                .select("product_id") \
+                .not_.is_("product_id", "null") \
+                .range(offset, offset + PAGE_SIZE - 1) \
+                .execute()
+            page = response.data or []
+            synced.update(str(item['product_id']) for item in page if isinstance(item, dict) and item.get('product_id'))
+            if len(page) < PAGE_SIZE:
+                return synced
+            offset += PAGE_SIZE
     except Exception as e:
         logging.warning(f"Could not fetch synced IDs: {e}")
-        return set()
+        return synced
 
-def process_item(item: Dict[str, Any]) -> Optional[tuple[List[float], str]]:
-    """Downloads image and generates embedding."""
+def first_image_url(item: Dict[str, Any]) -> Optional[str]:
     images = item.get("images", [])
     if not images or not isinstance(images, list) or len(images) == 0:
         return None
+    return str(images[0])
 
-    image_url = str(images[0])
-    
-    try:
-        response = session.get(image_url, timeout=15)
-        response.raise_for_status()
-    except Exception as e:
-        logging.warning(f"Failed to fetch image {image_url}: {e}")
-        if not TORCH_AVAILABLE:
-            return generate_fallback_embedding(), image_url
-        return None
-    
+class ImageFetcher:
+    """
+    Downloads item images for one run. CDN images have a 224px CLIP variant;
+    files uploaded before variants existed 404 on it and fall back to the
+    original. After CLIP_VARIANT_MAX_MISSES 404s in a row the variant is no
+    longer tried for the rest of the run, so a pass over old uploads doesn't
+    pay an extra request per image.
+    """
+
+    def __init__(self, max_misses: int = CLIP_VARIANT_MAX_MISSES):
+        self.max_misses = max_misses
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _use_variant(self) -> bool:
+        with self._lock:
+            return self.misses < self.max_misses
+
+    def _record(self, found: bool) -> None:
+        with self._lock:
+            if found:
+                self.misses = 0
+            else:
+                self.misses += 1
+                if self.misses == self.max_misses:
+                    logging.warning(f"🖼️ {self.misses} CDN images in a row have no -clip variant; fetching originals "
+                                    f"for the rest of this run (mass_ftp_uploader.py --backfill creates them)")
+
+    def __call__(self, image_url: str) -> bytes:
+        clip_url = cdn_variants.variant_url(image_url, "clip")
+        if clip_url != image_url and self._use_variant():
+            try:
+                data = http_client.get_bytes(clip_url, timeout=15, expected=(404,))
+                self._record(True)
+                return data
+            except http_client.HTTPStatusError as e:
+                if e.status != 404:
+                    raise
+                self._record(False)
+        return http_client.get_bytes(image_url, timeout=15)
+
+def embed_batches(pending: List[Dict[str, Any]]) -> Iterator[List[Tuple[Dict[str, Any], List[float], str, bool]]]:
+    """Yields (item, embedding, image_url, is_placeholder) tuples one inference batch at a time."""
+    jobs = [(item, url) for item in pending if (url := first_image_url(item))]
+
+    if not ML_AVAILABLE or model is None:
+        # Placeholders don't depend on the image, so skip the downloads entirely
+        for i in range(0, len(jobs), BATCH_SIZE):
+            yield [(item, generate_fallback_embedding(), url, True) for item, url in jobs[i:i + BATCH_SIZE]]
+        return
+
+    cache = open_default_cache()
+    pipeline = ImagePipeline(
+        fetch=ImageFetcher(),
+        batch_size=BATCH_SIZE,
+        download_workers=DOWNLOAD_WORKERS,
+        queue_size=BATCH_SIZE * 2,
+        cache=cache
+    )
     try:
-        img = Image.open(io.BytesIO(response.content)).convert("RGB")
-    except Exception as e:
-        logging.warning(f"Failed to process image: {e}")
-        if not TORCH_AVAILABLE:
-            return generate_fallback_embedding(), image_url
-        return None
-    
-    if TORCH_AVAILABLE and model is not None:
-        try:
-            embedding = model.encode(img, show_progress_bar=False) # type: ignore
-            if hasattr(embedding, "tolist"):
-                return embedding.tolist(), image_url # type: ignore
-            return list(embedding), image_url # type: ignore
-        except Exception as e:
-            logging.warning(f"Embedding generation failed: {e}")
-            return generate_fallback_embedding(), image_url
-    else:
-        return generate_fallback_embedding(), image_url
+        for results in pipeline.run(jobs):
+            batch = []
+            for item, image_url, embedding, error in results:
+                if embedding is not None:
+                    batch.append((item, vector_store.json_vector(embedding), image_url, False))
+                elif error and error.startswith("encode failed"):
+                    batch.append((item, generate_fallback_embedding(), image_url, True))
+                else:
+                    logging.warning(f"Failed to prepare image {image_url}: {error}")
+            yield batch
+    finally:
+        if cache is not None:
+            cache.log_stats()
+            cache.close()
+        http_client.log_stats()
 
-def sync(force: bool = False):
-    if not TORCH_AVAILABLE:
+def sync(force: bool = False, full: bool = False):
+    if not ML_AVAILABLE:
         logging.warning("⚠️ Neural sync running in FALLBACK mode - embeddings will be placeholders")
-    
-    inventory = fetch_inventory_to_sync()
-    synced_ids = get_synced_product_ids()
-    
+
+    state = load_state()
+    watermark = state.get("watermark")
+    incremental = bool(watermark) and not force and not full
+
+    if incremental:
+        # Re-read a small window before the watermark to catch rows committed out of order
+        since = _format_ts(_to_utc(watermark) - timedelta(seconds=WATERMARK_OVERLAP_SECONDS))
+        changed = fetch_inventory_to_sync(since)
+        seen = {str(item.get('id')) for item in changed}
+        retry_ids = [i for i in state.get("retry_ids", []) if i not in seen]
+        changed += fetch_inventory_by_ids(retry_ids)
+    else:
+        changed = fetch_inventory_to_sync()
+
+    # Only listed items are embedded; every changed row still refreshes its status below
+    inventory = [item for item in changed if item.get('status') in LISTED_STATUSES]
+    if incremental:
+        synced_ids = get_synced_product_ids([str(item.get('id')) for item in inventory if item.get('id')])
+        logging.info(f"⏩ Incremental sync since {watermark} ({len(retry_ids)} retries carried over)")
+    else:
+        synced_ids = get_synced_product_ids()
+        logging.info(f"🔁 Full reconciliation (force={force})")
+
     if force:
         pending = inventory
     else:
         pending = [item for item in inventory if str(item.get('id', '')) not in synced_ids]
+    pending = [item for item in pending if item.get('id')]
+
+    timestamps = [item['content_updated_at'] for item in changed if item.get('content_updated_at')]
+    if timestamps:
+        newest = max(timestamps, key=_to_utc)
+        if not watermark or _to_utc(newest) > _to_utc(watermark):
+            watermark = newest
     
     total = len(pending)
-    logging.info(f"🧬 Total Inventory: {len(inventory)} | Already Synced: {len(synced_ids)}")
+    logging.info(f"🧬 Inventory Scanned: {len(inventory)} | Already Synced: {len(synced_ids)}")
     logging.info(f"🔥 Starting sync for {total} items (force={force})...")
 
+    # Every changed row carries its current status, so sold and archived items drop out of search
+    statuses = {str(item['id']): item.get('status') for item in changed if item.get('id')}
+
     if total == 0:
+        save_state(next_state(state, watermark, [], full_run=not incremental))
+        ann_index.update_index([], statuses)
         logging.info("✅ Neural alignment complete. All items synced.")
         return
 
-    for i in range(0, total, BATCH_SIZE):
-        batch = pending[i:i + BATCH_SIZE]
-        latent_batch = []
-        
-        for item in tqdm(batch, desc=f"Syncing Batch {i//BATCH_SIZE + 1}"):
-            product_id = str(item.get('id', ''))
-            if not product_id:
-                continue
-                
-            try:
-                result = process_item(item)
-                if not result:
-                    continue
-                
-                embedding, image_url = result
-                
+    progress = tqdm(total=total, desc="Syncing Latent Space")
+    processed_ids: Set[str] = set()
+    index_entries: List[Dict[str, Any]] = []
+    inventory_writer = embedding_writer.inventory_embedding_writer(supabase)
+    latent_updates = embedding_writer.latent_update_writer(supabase)
+    latent_inserts = embedding_writer.latent_insert_writer(supabase)
+
+    with inventory_writer, latent_updates, latent_inserts:
+        for batch in embed_batches(pending):
+            for item, embedding, image_url, is_placeholder in batch:
+                product_id = str(item.get('id', ''))
+                archetype = item.get('category', 'general')
+                if not is_placeholder:
+                    index_entries.append({
+                        "product_id": product_id,
+                        "image_url": image_url,
+                        "embedding": embedding,
+                        "source": "Auvra_Internal_Archive",
+                        "category": archetype,
+                        "status": item.get('status')
+                    })
+
                 if force and product_id in synced_ids:
-                    supabase.table("style_latent_space").update({
+                    latent_updates.add({
+                        "product_id": product_id,
                         "embedding": embedding,
                         "image_url": image_url,
-                        "archetype": item.get('category', 'general')
-                    }).eq("product_id", product_id).execute()
+                        "archetype": archetype
+                    })
                 else:
-                    latent_batch.append({
+                    latent_inserts.add({
                         "product_id": product_id,
                         "image_url": image_url,
                         "embedding": embedding,
-                        "archetype": item.get('category', 'general'),
+                        "archetype": archetype,
                         "source": "Auvra_Internal_Archive"
                     })
-                
-                if force or not item.get('style_embedding'):
-                    supabase.table("pulse_inventory") \
-                        .update({"style_embedding": embedding}) \
-                        .eq("id", product_id) \
-                        .execute()
-
-            except Exception as e:
-                logging.error(f"❌ Failed Item {product_id}: {e}")
-                continue
-
-        if latent_batch:
-            try:
-                supabase.table("style_latent_space").insert(latent_batch).execute()
-            except Exception as e:
-                logging.error(f"🔥 Batch Insert Failed: {e}")
-                time.sleep(5)
-                try:
-                    supabase.table("style_latent_space").insert(latent_batch).execute()
-                    logging.info("✅ Batch Insert Recovered.")
-                except Exception as retry_e:
-                    logging.error(f"💥 Batch Insert Failed permanently: {retry_e}")
+
+                if force or not item.get('has_style_embedding'):
+                    inventory_writer.add({"id": product_id, "embedding": embedding})
+
+            processed_ids.update(str(item.get('id')) for item, _, _, _ in batch)
+            progress.update(len(batch))
+            stage_metrics.incr("items", len(batch))
+    progress.close()
+    vector_store.append_entries(index_entries)
+    ann_index.update_index(index_entries, statuses)
+
+    failed_writes = sum(w.rows_failed for w in (inventory_writer, latent_updates, latent_inserts))
+    if failed_writes:
+        # Keep the old watermark so the next run picks these rows up again
+        logging.warning(f"⚠️ {failed_writes} rows failed to write; watermark not advanced.")
+    else:
+        retry_ids = sorted(str(item['id']) for item in pending
+                           if first_image_url(item) and str(item['id']) not in processed_ids)
+        save_state(next_state(state, watermark, retry_ids, full_run=not incremental))
+        if retry_ids:
+            logging.info(f"🔂 {len(retry_ids)} items failed and will be retried next run.")
 
     logging.info("🏁 Recursive Neural Sync Complete.")
 
 if __name__ == "__main__":
     force_sync = '--force' in sys.argv
-    sync(force=force_sync)
\ No newline at end of file
+    full_sync = '--full' in sys.argv
+    sync(force=force_sync, full=full_sync)
\ No newline at end of file
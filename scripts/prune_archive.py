@@ -1,16 +1,21 @@
 import os
-import requests
+import asyncio
+import hashlib
+import argparse
+import aiohttp
 import logging
 from logging.handlers import RotatingFileHandler
 import re
 import random
 import time
+from typing import Any, Dict, List, Optional, Tuple
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+import stage_metrics
+from listing_cache import CACHE_PATH as LISTING_CACHE_PATH, ListingCache
+from rate_limiter import HostRateLimiter, parse_retry_after
 
 # --- CONFIGURATION ---
 if os.path.exists(".env.local"):
@@ -20,7 +25,19 @@ else:
 
 SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
-MAX_WORKERS = 5 # Reduced parallel checks to avoid IP bans
+# Anti-ban: each marketplace gets its own request budget of (requests/s, burst);
+# every other host falls back to DEFAULT_HOST_LIMIT. Budgets shrink on 429/403.
+HOST_LIMITS = {
+    "vinted": (float(os.getenv("PRUNE_VINTED_RPS", "3")), 5),
+    "grailed": (float(os.getenv("PRUNE_GRAILED_RPS", "3")), 5),
+}
+DEFAULT_HOST_LIMIT = (1.0, 2)
+MAX_CONNECTIONS = int(os.getenv("PRUNE_MAX_CONNECTIONS", "16"))
+MAX_CONNECTIONS_PER_HOST = 4
+REQUEST_TIMEOUT = 10
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 1.5
+THROTTLE_STATUSES = (429, 403)
 
 # Configure Logging with Rotation
 logging.basicConfig(
@@ -37,17 +54,7 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     exit(1)
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# Robust Session with Retries
-session = requests.Session()
-retries = Retry(
-    total=3,
-    backoff_factor=1.5,
-    status_forcelist=[429, 500, 502, 503, 504],
-    allowed_methods=["GET"]
-)
-session.mount('http://', HTTPAdapter(max_retries=retries))
-session.mount('https://', HTTPAdapter(max_retries=retries))
+stage_metrics.instrument_supabase(supabase)
 
 # Anti-ban: Rotating User Agents
 USER_AGENTS = [
@@ -58,62 +65,175 @@ USER_AGENTS = [
     'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Mobile/15E148 Safari/604.1'
 ]
 
-def extract_price(html_content):
-    # Try OpenGraph price amount (works for Grailed and often Vinted)
-    match = re.search(r'<meta\s+(?:property|name)="[^"]*price:amount"\s+content="([0-9\.]+)"', html_content)
-    if match:
-        return float(match.group(1))
-    
-    # Try Vinted specific JSON embedded data: "amount":"150.00" or similar
-    match = re.search(r'"price"\s*:\s*\{\s*"amount"\s*:\s*"([0-9\.]+)"', html_content)
-    if match:
-        return float(match.group(1))
+# Listing pages are scanned as raw bytes while they stream in. Price patterns
+# are listed in order of preference; the sold check is case-insensitive.
+SOLD_PATTERN = re.compile(rb'"sold":true|item is sold|status":"sold"', re.IGNORECASE)
+PRICE_PATTERNS = [
+    # OpenGraph price amount (works for Grailed and often Vinted)
+    re.compile(rb'<meta\s+(?:property|name)="[^"]*price:amount"\s+content="([0-9\.]+)"'),
+    # Vinted specific JSON embedded data: "amount":"150.00" or similar
+    re.compile(rb'"price"\s*:\s*\{\s*"amount"\s*:\s*"([0-9\.]+)"'),
+    # Common JSON-LD or script schemas
+    re.compile(rb'"price"\s*:\s*"([0-9\.]+)"'),
+]
+SCAN_CHUNK_BYTES = 16 * 1024
+# Carried over between chunks so a match split across a chunk boundary is still found
+SCAN_OVERLAP_BYTES = 512
+# Past this, the page is treated as not sold; stopping early can only keep an item, never prune it
+MAX_SCAN_BYTES = int(os.getenv("PRUNE_MAX_SCAN_BYTES", str(768 * 1024)))
 
-    # Try common JSON-LD or script schemas
-    match = re.search(r'"price"\s*:\s*"([0-9\.]+)"', html_content)
-    if match:
+def _parse_price(match) -> Optional[float]:
+    try:
         return float(match.group(1))
-        
+    except ValueError:
+        return None
+
+class ListingScanner:
+    """Incrementally scans a listing page for sold markers and the best available price."""
+
+    def __init__(self):
+        self.sold = False
+        self.scanned = 0
+        self._prices: List[Optional[float]] = [None] * len(PRICE_PATTERNS)
+        self._tail = b""
+        self._digest = hashlib.sha256()
+
+    @property
+    def body_hash(self) -> str:
+        """Hash of the bytes scanned so far."""
+        return self._digest.hexdigest()
+
+    @property
+    def price(self) -> Optional[float]:
+        return next((p for p in self._prices if p is not None), None)
+
+    def feed(self, chunk: bytes) -> bool:
+        """Scans the next chunk; returns True once reading more can't change the answer."""
+        window = self._tail + chunk
+        self.scanned += len(chunk)
+        self._digest.update(chunk)
+        if SOLD_PATTERN.search(window):
+            self.sold = True
+            return True
+        for i, pattern in enumerate(PRICE_PATTERNS):
+            if self._prices[i] is None:
+                match = pattern.search(window)
+                if match:
+                    self._prices[i] = _parse_price(match)
+        self._tail = window[-SCAN_OVERLAP_BYTES:]
+        return self.scanned >= MAX_SCAN_BYTES
+
+def extract_price(html_content):
+    data = html_content.encode("utf-8", "replace") if isinstance(html_content, str) else html_content
+    for pattern in PRICE_PATTERNS:
+        match = pattern.search(data)
+        if match:
+            return _parse_price(match)
     return None
 
-def check_item_availability(item):
+def build_headers() -> Dict[str, str]:
+    return {
+        'User-Agent': random.choice(USER_AGENTS),
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Upgrade-Insecure-Requests': '1'
+    }
+
+async def check_item_availability(http: aiohttp.ClientSession, limiter: HostRateLimiter,
+                                  item: Dict[str, Any], cache: Optional[ListingCache] = None
+                                  ) -> Tuple[Any, bool, Optional[float]]:
     """Checks if the source URL is still active and extracts latest price."""
     url = item.get('source_url')
     if not url:
         return item['id'], False, None
-        
-    # Anti-ban execution jitter per request thread
-    time.sleep(random.uniform(0.5, 2.5))
 
-    try:
-        headers = {
-            'User-Agent': random.choice(USER_AGENTS),
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Upgrade-Insecure-Requests': '1'
-        }
-        
-        response = session.get(url, headers=headers, timeout=10, allow_redirects=True)
-        
-        if response.status_code == 404:
-            return item['id'], False, None
-            
-        # Check for common "sold" indicators in the HTML
-        html_content = response.text.lower()
-        if '"sold":true' in html_content or 'item is sold' in html_content or 'status":"sold"' in html_content:
+    bucket = limiter.bucket_for(url)
+    conditional = cache is not None
+    for attempt in range(MAX_ATTEMPTS):
+        # Pacing (including jitter) is the bucket's job; nothing sleeps while holding a connection
+        await bucket.acquire()
+        headers = build_headers()
+        if conditional:
+            headers.update(cache.conditional_headers(url))
+        try:
+            stage_metrics.incr("http_requests")
+            async with http.get(url, headers=headers, allow_redirects=True) as response:
+                if response.status in THROTTLE_STATUSES or response.status >= 500:
+                    stage_metrics.record_error(f"HTTP {response.status}")
+                if response.status in THROTTLE_STATUSES:
+                    bucket.penalize(response.status, parse_retry_after(response.headers.get("Retry-After")))
+                    continue
+                if response.status >= 500:
+                    await asyncio.sleep(RETRY_BACKOFF ** attempt)
+                    continue
+                bucket.reward()
+
+                if response.status == 304 and cache is not None:
+                    if cache.record_not_modified(url):
+                        return item['id'], True, cache.price(url)
+                    # Nothing stored to fall back on (another item sharing this URL dropped it,
+                    # or the server ignored our lack of validators): fetch the page in full
+                    conditional = False
+                    continue
+                if response.status == 404:
+                    if cache is not None:
+                        cache.forget(url)
+                    return item['id'], False, None
+
+                # Leaving the block with unread body closes the connection, which is
+                # cheaper than downloading the rest of a page we no longer need
+                scanner = ListingScanner()
+                async for chunk in response.content.iter_chunked(SCAN_CHUNK_BYTES):
+                    stage_metrics.incr("bytes_downloaded", len(chunk))
+                    if scanner.feed(chunk):
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            stage_metrics.record_error(type(e).__name__)
+            await asyncio.sleep(RETRY_BACKOFF ** attempt)
+            continue
+
+        if scanner.sold:
+            if cache is not None:
+                cache.forget(url)
             return item['id'], False, None
+        if cache is not None:
+            cache.record(url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                         scanner.body_hash, scanner.price)
+        return item['id'], True, scanner.price
+
+    # Still blocked or failing: we don't prune, to avoid false positives
+    # on network glitches or IP bans
+    return item['id'], True, None
 
-        # Extract the current price
-        current_price = extract_price(response.text)
-            
-        return item['id'], True, current_price
+async def check_all(items: List[Dict[str, Any]],
+                    cache: Optional[ListingCache] = None) -> List[Tuple[Any, bool, Optional[float]]]:
+    """Checks every item concurrently over one pooled session, paced per host."""
+    limiter = HostRateLimiter(HOST_LIMITS, DEFAULT_HOST_LIMIT)
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    progress = tqdm(total=len(items), desc="Pruning & Pricing Mesh")
+
+    async def check(http: aiohttp.ClientSession, item: Dict[str, Any]):
+        result = await check_item_availability(http, limiter, item, cache)
+        progress.update(1)
+        return result
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+        results = await asyncio.gather(*(check(http, item) for item in items))
+    progress.close()
+    limiter.log_stats()
+    return results
+
+def open_listing_cache() -> Optional[ListingCache]:
+    if not LISTING_CACHE_PATH:
+        return None
+    try:
+        return ListingCache()
     except Exception as e:
-        # Avoid logging every timeout, but handle it gracefully
-        # If we get a timeout or other error, we don't prune immediately 
-        # to avoid false positives on network glitches or IP bans
-        return item['id'], True, None
+        logging.warning(f"⚠️ Listing cache unavailable ({e}); checking every item")
+        return None
 
-def run_pruning():
+def run_pruning(full: bool = False):
     logging.info("🧹 Initializing Archive Pruning & Pricing Protocol...")
     
     # Fetch all items currently marked as available
@@ -136,25 +256,40 @@ def run_pruning():
     to_prune = []
     to_update_price = []
     
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        results = list(tqdm(executor.map(check_item_availability, items), total=len(items), desc="Pruning & Pricing Mesh"))
-        
-        # We need to map results back to their original items to compare prices
-        item_map = {item.get('id'): item for item in items if isinstance(item, dict) and item.get('id')}
-        
-        for item_id, is_available, current_price in results:
-            if not is_available:
-                to_prune.append(item_id)
-            elif current_price is not None and item_id in item_map:
-                original_price_raw = item_map[item_id].get('listing_price')
-                # If price differs significantly (more than 1 unit to avoid rounding issues)
-                try:
-                    original_price = float(str(original_price_raw)) if original_price_raw is not None else None
-                    if original_price is not None and abs(original_price - current_price) > 1.0:
-                        to_update_price.append((item_id, current_price))
-                except (ValueError, TypeError):
-                    pass
+    cache = open_listing_cache()
+    due = items
+    if cache is not None and not full:
+        # Listings whose price has been stable for a while are checked less often
+        now = time.time()
+        due = [item for item in items if not item.get('source_url') or cache.is_due(item['source_url'], now)]
+
+    started = time.monotonic()
+    results = asyncio.run(check_all(due, cache))
+    stage_metrics.incr("items", len(due))
+    logging.info(f"⏱️ Checked {len(due)}/{len(items)} items in {time.monotonic() - started:.0f}s")
+    if cache is not None:
+        cache.log_stats()
+        cache.save()
+        cache.close()
+
+    # We need to map results back to their original items to compare prices
+    item_map = {item.get('id'): item for item in items if isinstance(item, dict) and item.get('id')}
+
+    for item_id, is_available, current_price in results:
+        if not is_available:
+            to_prune.append(item_id)
+        elif current_price is not None and item_id in item_map:
+            original_price_raw = item_map[item_id].get('listing_price')
+            # If price differs significantly (more than 1 unit to avoid rounding issues)
+            try:
+                original_price = float(str(original_price_raw)) if original_price_raw is not None else None
+                if original_price is not None and abs(original_price - current_price) > 1.0:
+                    to_update_price.append((item_id, current_price))
+            except (ValueError, TypeError):
+                pass
 
+    stage_metrics.incr("pruned", len(to_prune))
+    stage_metrics.incr("price_updates", len(to_update_price))
     if to_prune:
         logging.info(f"🔥 Pruning {len(to_prune)} dead nodes from the archive...")
         # Update status to 'sold' or 'unavailable' in batches
@@ -195,4 +330,7 @@ def run_pruning():
         logging.info("✅ Pruning and pricing complete.")
 
 if __name__ == "__main__":
-    run_pruning()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Prune sold listings and refresh prices.")
+    parser.add_argument("--full", action="store_true", help="Check every listing, ignoring the recheck schedule")
+    args = parser.parse_args()
+    run_pruning(full=args.full)
\ No newline at end of file
@@ -0,0 +1,108 @@
+import random
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+# Scheduled waits are stretched by up to this fraction so requests never land on a fixed cadence
+JITTER = 0.5
+# Rate is halved on every 429/403 and recovers by this fraction of the base rate per success
+RECOVERY_STEP = 0.05
+MIN_RATE_FRACTION = 0.1
+PENALTY_SECONDS = 5.0
+MAX_PENALTY_SECONDS = 120.0
+
+class TokenBucket:
+    """
+    Async token bucket with multiplicative slowdown and additive recovery.
+
+    Waiters queue on a lock, so requests to one host are granted in order
+    while requests to other hosts proceed independently.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.strikes = 0
+        self.cooldown_until = 0.0
+        self._updated: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+        self.granted = 0
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        if self._updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if now < self.cooldown_until:
+                    await asyncio.sleep(self.cooldown_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.granted += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait * random.uniform(1, 1 + JITTER))
+
+    def penalize(self, status: int, retry_after: Optional[float] = None) -> None:
+        """Backs off after the host signalled throttling or a block."""
+        self.throttled += 1
+        self.strikes += 1
+        self.rate = max(self.base_rate * MIN_RATE_FRACTION, self.rate / 2)
+        self.tokens = 0.0
+        pause = retry_after if retry_after is not None else PENALTY_SECONDS * 2 ** (self.strikes - 1)
+        pause = min(MAX_PENALTY_SECONDS, pause)
+        self.cooldown_until = max(self.cooldown_until, asyncio.get_running_loop().time() + pause)
+        logging.warning(f"🐢 {self.name}: HTTP {status}, pausing {pause:.0f}s and slowing to {self.rate:.2f} req/s")
+
+    def reward(self) -> None:
+        self.strikes = 0
+        self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVERY_STEP)
+
+class HostRateLimiter:
+    """
+    One TokenBucket per host group.
+
+    Hosts containing a key of `limits` (e.g. every vinted.* locale) share
+    that key's bucket; any other host gets its own bucket at `default`.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]], default: Tuple[float, int]):
+        self.limits = limits
+        self.default = default
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def bucket_for(self, url: str) -> TokenBucket:
+        host = (urlparse(url).hostname or "").lower()
+        key = next((name for name in self.limits if name in host), host)
+        if key not in self.buckets:
+            rate, burst = self.limits.get(key, self.default)
+            self.buckets[key] = TokenBucket(key, rate, burst)
+        return self.buckets[key]
+
+    def log_stats(self) -> None:
+        for bucket in self.buckets.values():
+            logging.info(
+                f"🚦 {bucket.name}: {bucket.granted} requests, {bucket.throttled} throttled, "
+                f"ending rate {bucket.rate:.2f}/{bucket.base_rate:.2f} req/s"
+            )
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Reads a delta-seconds Retry-After header; HTTP-date values fall back to the default backoff."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -2,17 +2,25 @@ import os
 import time
 import subprocess
 import logging
-import requests
 import threading
 import signal
 import sys
 import random
 import shlex
+import json
+import tempfile
 from datetime import datetime
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from logging.handlers import RotatingFileHandler
-from typing import Optional
+from typing import Any, Callable, Dict, Optional
+
+import http_client
+from command_feed import AdaptivePoller, CommandFeed, create_feed
+from command_executor import CommandExecutor, CommandSpec, RunningCommand
+from stage_scheduler import Stage, StageScheduler
+import warm_worker
+import sentinel_metrics
 
 # --- CONFIGURATION ---
 # Load env from the same directory as the script or project root
@@ -31,9 +39,47 @@ else:
 
 # Sentinel Settings
 BASE_LOOP_INTERVAL = 3600  # 1 Hour base interval
-COMMAND_POLL_INTERVAL = 60    # 1 Minute
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+# A timed-out or cancelled command gets SIGTERM, then SIGKILL after this grace period
+KILL_GRACE_SECONDS = 15
+WATCHDOG_INTERVAL = 1
+
+# "warm" runs the Python ML stages as jobs in one long-lived worker that keeps CLIP and its
+# clients loaded between cycles; "subprocess" starts a fresh interpreter per stage
+STAGE_MODE = os.getenv("SENTINEL_STAGE_MODE", "warm").lower()
+# Imported once when the warm worker starts. neural_sync goes first: it runs the SIGILL-safe
+# backend probe before CLIP is loaded in-process, and its log setup applies to the whole worker.
+WARM_PRELOAD = ["neural_sync", "aesthetic_filter"]
+
+# Cycle stages: independent stages run concurrently within their resource class's limit.
+# CLIP stages share the Pi's memory, so only one runs at a time.
+ML, NETWORK, NODE = "ml", "network", "node"
+STAGE_LIMITS = {ML: 1, NETWORK: 2, NODE: 1}
+CYCLE_STAGES = [
+    Stage("aesthetic", "Aesthetic Filter & Approval", "python3 scripts/aesthetic_filter.py", ML, timeout=30 * 60,
+          job="aesthetic_filter:process_unverified_assets"),
+    Stage("sync", "Neural Latent Space Sync", "python3 scripts/neural_sync.py", ML,
+          depends_on=["aesthetic"], timeout=45 * 60, job="neural_sync:sync"),
+    Stage("prune", "Mesh Integrity Pruning", "python3 scripts/prune_archive.py", NETWORK, timeout=45 * 60),
+    # Features available inventory, so it waits for new approvals and for sold items to be pruned
+    Stage("content", "Social Asset Generation", "npx tsx scripts/generate-daily-content.ts", NODE,
+          depends_on=["aesthetic", "prune"], timeout=20 * 60),
+]
+_stages = {stage.name: stage for stage in CYCLE_STAGES}
+
+# Manual commands from the Admin Dashboard. Each group runs one command at a time; different
+# groups overlap. A command tied to a cycle stage also takes that stage's slot, so a manual
+# sync never runs alongside the cycle's sync.
+COMMAND_GROUP_LIMITS = {"pulse": 1, "sync": 1, "prune": 1, "content": 1}
+COMMAND_SPECS = {spec.name: spec for spec in [
+    CommandSpec("pulse", "npx tsx scripts/pulse-run.ts", "pulse"),
+    CommandSpec("sync", "python3 scripts/neural_sync.py", "sync", _stages["sync"], job="neural_sync:sync"),
+    CommandSpec("sync-force", "python3 scripts/neural_sync.py --force", "sync", _stages["sync"],
+                job="neural_sync:sync", job_args={"force": True}),
+    CommandSpec("prune", "python3 scripts/prune_archive.py", "prune", _stages["prune"]),
+    CommandSpec("content", "npx tsx scripts/generate-daily-content.ts", "content", _stages["content"]),
+]}
 
 # Logging Setup (Optimized for Raspberry Pi SD Card with Rotation)
 logging.basicConfig(
@@ -51,17 +97,54 @@ def notify_telegram(message: str):
         return
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        requests.post(url, json={"chat_id": TELEGRAM_CHAT_ID, "text": f"🛡️ Auvra Sentinel: {message}"}, timeout=10)
+        http_client.post_json(url, {"chat_id": TELEGRAM_CHAT_ID, "text": f"🛡️ Auvra Sentinel: {message}"}, timeout=10)
     except Exception as e:
         logging.error(f"Telegram Notify Failed: {e}")
 
-def run_command(command: str, description: str, manual: bool = False):
-    """Executes a shell command and logs output."""
+# Child process groups still running, so shutdown can stop them
+active_processes = set()
+
+def terminate_process(process: subprocess.Popen) -> None:
+    """Stops a command and everything it spawned (shell, npx, python)."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+# Stage durations, throughput and resource use for /metrics and the history file
+metrics = sentinel_metrics.MetricsRegistry()
+
+def record_run(name: Optional[str], outcome: str, start_time: float, stats: Optional[Dict[str, Any]] = None) -> None:
+    if name:
+        metrics.record_run(name, outcome, round(time.time() - start_time, 3), stats)
+
+def read_stage_metrics(path: str) -> Optional[Dict[str, Any]]:
+    """The snapshot a Python stage wrote on exit (see stage_metrics.py); None for other commands."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def run_command(command: str, description: str, manual: bool = False, timeout: Optional[float] = None,
+                cancel: Optional[threading.Event] = None, on_line: Optional[Callable[[str], None]] = None,
+                name: Optional[str] = None):
+    """Executes a shell command and logs output; stops it on timeout or when `cancel` is set."""
     logging.info(f"▶️ Starting: {description}")
     if manual:
         notify_telegram(f"⚙️ Manual Override: Starting {description}...")
         
     start_time = time.time()
+    metrics_fd, metrics_path = tempfile.mkstemp(prefix="stage-metrics-", suffix=".json")
+    os.close(metrics_fd)
     
     try:
         # Run the command and stream output in real-time
@@ -72,8 +155,25 @@ def run_command(command: str, description: str, manual: bool = False):
             stderr=subprocess.STDOUT,
             text=True,
             bufsize=1,
-            universal_newlines=True
+            universal_newlines=True,
+            env={**os.environ, "STAGE_METRICS_FILE": metrics_path},
+            start_new_session=True  # Own process group, so a timeout can kill the whole tree
         )
+        active_processes.add(process)
+        expired = threading.Event()
+        if timeout or cancel is not None:
+            def watchdog():
+                deadline = start_time + timeout if timeout else None
+                while process.poll() is None:
+                    if cancel is not None and cancel.is_set():
+                        terminate_process(process)
+                        return
+                    if deadline is not None and time.time() >= deadline:
+                        expired.set()
+                        terminate_process(process)
+                        return
+                    time.sleep(WATCHDOG_INTERVAL)
+            threading.Thread(target=watchdog, name="watchdog", daemon=True).start()
         
         output_lines = []
         if process.stdout:
@@ -83,18 +183,36 @@ def run_command(command: str, description: str, manual: bool = False):
                 if clean_line:
                     logging.info(f"[{description}] {clean_line}")
                     output_lines.append(clean_line)
+                    if on_line:
+                        on_line(clean_line)
                 
         # Wait for the process to finish
         process.wait()
+        active_processes.discard(process)
         
         duration = round(time.time() - start_time, 2)
+        stats = read_stage_metrics(metrics_path)
         
-        if process.returncode == 0:
+        if cancel is not None and cancel.is_set():
+            record_run(name, sentinel_metrics.CANCELLED, start_time, stats)
+            logging.warning(f"🚫 CANCELLED: {description} after {duration}s")
+            if manual:
+                notify_telegram(f"🚫 Manual Override Cancelled: {description} after {duration}s.")
+            return False
+        elif expired.is_set():
+            record_run(name, sentinel_metrics.TIMED_OUT, start_time, stats)
+            error_msg = f"❌ TIMED OUT: {description} was stopped after {timeout:.0f}s"
+            logging.error(error_msg)
+            notify_telegram(error_msg)
+            return False
+        elif process.returncode == 0:
+            record_run(name, sentinel_metrics.SUCCEEDED, start_time, stats)
             logging.info(f"✅ Completed: {description} ({duration}s)")
             if manual:
                 notify_telegram(f"✅ Manual Override Complete: {description} finished in {duration}s.")
             return True
         else:
+            record_run(name, sentinel_metrics.FAILED, start_time, stats)
             error_output = "\n".join(output_lines[-10:]) if output_lines else "No output"
             error_msg = f"❌ FAILED: {description}\nExit Code: {process.returncode}\nLast Output: {error_output}"
             logging.error(error_msg)
@@ -102,96 +220,124 @@ def run_command(command: str, description: str, manual: bool = False):
             return False
             
     except Exception as e:
+        record_run(name, sentinel_metrics.FAILED, start_time, read_stage_metrics(metrics_path))
         error_msg = f"❌ FAILED TO EXECUTE: {description}\nError: {str(e)}"
         logging.error(error_msg)
         notify_telegram(error_msg)
         return False
 
-def check_system_commands():
-    """Polls the Supabase system_commands table for manual triggers from the Admin Dashboard."""
-    if not supabase:
-        return
+def log_worker_output(line: str) -> None:
+    logging.info(f"[Warm Worker] {line}")
+
+worker: Optional[warm_worker.WarmWorker] = None
+if STAGE_MODE == "warm":
+    worker = warm_worker.WarmWorker(WARM_PRELOAD, terminate_process, log_worker_output)
+
+def run_job(job: str, job_args: Dict[str, Any], description: str, manual: bool = False,
+            timeout: Optional[float] = None, cancel: Optional[threading.Event] = None,
+            on_line: Optional[Callable[[str], None]] = None, name: Optional[str] = None) -> bool:
+    """Runs a stage function in the warm worker; logs and notifies like run_command."""
+    assert worker is not None
+    logging.info(f"▶️ Starting: {description} (warm worker)")
+    if manual:
+        notify_telegram(f"⚙️ Manual Override: Starting {description}...")
+    start_time = time.time()
+
+    outcome, tail, stats = worker.run(job, job_args, timeout=timeout, cancel=cancel, on_line=on_line)
+    duration = round(time.time() - start_time, 2)
+    record_run(name, {
+        warm_worker.OK: sentinel_metrics.SUCCEEDED,
+        warm_worker.CANCELLED: sentinel_metrics.CANCELLED,
+        warm_worker.TIMED_OUT: sentinel_metrics.TIMED_OUT,
+    }.get(outcome, sentinel_metrics.FAILED), start_time, stats)
+
+    if outcome == warm_worker.OK:
+        logging.info(f"✅ Completed: {description} ({duration}s)")
+        if manual:
+            notify_telegram(f"✅ Manual Override Complete: {description} finished in {duration}s.")
+        return True
+    if outcome == warm_worker.CANCELLED:
+        logging.warning(f"🚫 CANCELLED: {description} after {duration}s")
+        if manual:
+            notify_telegram(f"🚫 Manual Override Cancelled: {description} after {duration}s.")
+        return False
+    if outcome == warm_worker.TIMED_OUT:
+        error_msg = f"❌ TIMED OUT: {description} was stopped after {timeout:.0f}s"
+    else:
+        error_output = "\n".join(tail) if tail else "No output"
+        error_msg = f"❌ FAILED: {description}\nWarm worker: {outcome}\nLast Output: {error_output}"
+    logging.error(error_msg)
+    notify_telegram(error_msg)
+    return False
+
+def run_stage(stage: Stage) -> bool:
+    if worker is not None and stage.job:
+        return run_job(stage.job, stage.job_args, stage.description, timeout=stage.timeout, name=stage.name)
+    return run_command(stage.command, stage.description, timeout=stage.timeout, name=stage.name)
+
+def run_system_command(running: RunningCommand) -> bool:
+    spec = running.spec
+    description = f"System Command: {spec.name}"
+    name = f"manual:{spec.name}"
+    if worker is not None and spec.job:
+        return run_job(spec.job, spec.job_args, description, manual=True,
+                       cancel=running.cancel, on_line=running.report, name=name)
+    return run_command(spec.command, description, manual=True,
+                       cancel=running.cancel, on_line=running.report, name=name)
+
+# Shared across cycles: a stage the last cycle still has running or queued is skipped, not duplicated
+scheduler = StageScheduler(STAGE_LIMITS, run_stage)
+
+executor: Optional[CommandExecutor] = None
+# Pushes new dashboard commands to the main loop; polling-only stand-in without Supabase
+feed: CommandFeed = create_feed(SUPABASE_URL, SUPABASE_KEY) if supabase else CommandFeed()
+if supabase:
+    executor = CommandExecutor(supabase, COMMAND_SPECS, COMMAND_GROUP_LIMITS, run_system_command, scheduler)
+
+def check_system_commands() -> int:
+    """Starts pending manual triggers from the Admin Dashboard; returns how many started."""
+    if not executor:
+        return 0
     try:
-        response = supabase.table("system_commands").select("*").eq("status", "pending").order("created_at").limit(1).execute()
-        if response.data and isinstance(response.data, list) and len(response.data) > 0:
-            command_record = response.data[0]
-            if isinstance(command_record, dict):
-                cmd_id = command_record.get("id")
-                cmd = command_record.get("command")
-                
-                if not cmd_id or not cmd:
-                    return
-            else:
-                return
-            
-            logging.info(f"🔄 Found pending system command: {cmd}")
-            supabase.table("system_commands").update({"status": "running"}).eq("id", cmd_id).execute()
-            
-            shell_command = ""
-            if cmd == "pulse":
-                shell_command = "npx tsx scripts/pulse-run.ts"
-            elif cmd == "sync":
-                shell_command = "python3 scripts/neural_sync.py"
-            elif cmd == "sync-force":
-                shell_command = "python3 scripts/neural_sync.py --force"
-            elif cmd == "prune":
-                shell_command = "python3 scripts/prune_archive.py"
-            elif cmd == "content":
-                shell_command = "npx tsx scripts/generate-daily-content.ts"
-            else:
-                logging.error(f"Unknown command: {cmd}")
-                supabase.table("system_commands").update({"status": "failed"}).eq("id", cmd_id).execute()
-                return
-                
-            success = run_command(shell_command, f"System Command: {cmd}", manual=True)
-            
-            final_status = "completed" if success else "failed"
-            supabase.table("system_commands").update({"status": final_status}).eq("id", cmd_id).execute()
-            
+        return executor.poll()
     except Exception as e:
         logging.error(f"Error checking system commands: {e}")
+        return 0
 
 def sentinel_cycle():
     """One full execution loop of the Auvra automated pipeline."""
     logging.info("--- STARTING NEW SENTINEL CYCLE ---")
-    
-    # 1. Process Unverified Assets (Aesthetic Filter)
-    run_command("python3 scripts/aesthetic_filter.py", "Aesthetic Filter & Approval")
-    
-    # 2. Neural DNA Sync
-    run_command("python3 scripts/neural_sync.py", "Neural Latent Space Sync")
-    
-    # 3. Prune Dead Links
-    run_command("python3 scripts/prune_archive.py", "Mesh Integrity Pruning")
-    
-    # 4. Content Generation
-    run_command("npx tsx scripts/generate-daily-content.ts", "Social Asset Generation")
-    
-    logging.info("--- CYCLE COMPLETE. SLEEPING... ---")
-    notify_telegram("Cycle Complete. Archive is healthy and synced.")
+    start_time = time.time()
 
-# Prevent overlapping automated cycles
-cycle_lock = threading.Lock()
+    results = scheduler.run(CYCLE_STAGES)
+
+    duration = round(time.time() - start_time)
+    metrics.record_cycle(duration, results)
+    summary = ", ".join(f"{name}: {outcome}" for name, outcome in results.items())
+    logging.info(f"--- CYCLE COMPLETE in {duration}s ({summary}). SLEEPING... ---")
+    if all(outcome == "succeeded" for outcome in results.values()):
+        notify_telegram("Cycle Complete. Archive is healthy and synced.")
+    else:
+        notify_telegram(f"Cycle finished with issues in {duration}s: {summary}")
 
 def background_sentinel_cycle():
-    if not cycle_lock.acquire(blocking=False):
-        logging.warning("⏳ Previous cycle still running. Skipping this scheduled trigger.")
-        return
     try:
         sentinel_cycle()
-    finally:
-        cycle_lock.release()
+    except Exception as e:
+        logging.error(f"Cycle failed: {e}")
 
 def graceful_shutdown(signum, frame):
     """Handles SIGINT/SIGTERM to cleanly exit and reset database states."""
     logging.warning("🛑 Received shutdown signal. Cleaning up Auvra Mesh...")
-    if supabase:
-        try:
-            # Revert any stuck running commands to failed so they don't block the UI forever
-            supabase.table("system_commands").update({"status": "failed"}).eq("status", "running").execute()
-            logging.info("Cleaned up Supabase system command statuses.")
-        except Exception as e:
-            logging.error(f"Failed to reset system commands on shutdown: {e}")
+    feed.stop()
+    if executor:
+        # Revert any running commands to failed so they don't block the UI forever
+        executor.shutdown()
+        logging.info("Cleaned up Supabase system command statuses.")
+    if worker is not None:
+        worker.stop()
+    for process in list(active_processes):
+        terminate_process(process)
     sys.exit(0)
 
 if __name__ == "__main__":
@@ -200,16 +346,22 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, graceful_shutdown)
 
     notify_telegram("System Online. Monitoring Auvra Mesh.")
+    if executor:
+        executor.start()
+        feed.start()
+    sentinel_metrics.serve(metrics)
     
     last_cycle_time = 0
     current_interval = 0  # Force immediate run on startup
+    poller = AdaptivePoller()
+    woken = False
     
     while True:
         current_time = time.time()
         try:
             # 1. Run the hourly cycle if it's time
             if current_time - last_cycle_time >= current_interval:
-                # Use threading so the 1-hour cycle doesn't block the 1-minute UI command polling
+                # Use threading so the 1-hour cycle doesn't block UI command dispatch
                 threading.Thread(target=background_sentinel_cycle, daemon=True).start()
                 last_cycle_time = time.time()
                 
@@ -218,11 +370,14 @@ if __name__ == "__main__":
                 logging.info(f"Next cycle scheduled in {current_interval} seconds.")
             
             # 2. Check for manual commands triggered from the UI
-            check_system_commands()
+            started = check_system_commands()
             
         except Exception as e:
             logging.critical(f"SENTINEL CRASHED: {e}")
             notify_telegram(f"CRITICAL SYSTEM FAILURE: {e}")
+            started = 0
         
-        # Sleep for a short interval before polling again
-        time.sleep(COMMAND_POLL_INTERVAL)
\ No newline at end of file
+        # Sleep until a command is pushed, the next poll is due, or the next cycle starts
+        interval = poller.next_interval(woken or started > 0, feed.connected)
+        until_cycle = last_cycle_time + current_interval - time.time()
+        woken = feed.wait(max(1, min(interval, until_cycle)))
\ No newline at end of file
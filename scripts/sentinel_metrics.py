@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# --- CONFIGURATION ---
+METRICS_HOST = os.getenv("SENTINEL_METRICS_HOST", "127.0.0.1")
+# 0 disables the /metrics endpoint
+METRICS_PORT = int(os.getenv("SENTINEL_METRICS_PORT", "9464"))
+# One JSON line per stage run and per cycle; the oldest half is dropped once the file passes the cap
+HISTORY_PATH = os.getenv("SENTINEL_METRICS_HISTORY", "logs/stage_metrics.jsonl")
+HISTORY_MAX_BYTES = int(float(os.getenv("SENTINEL_METRICS_HISTORY_MB", "2")) * 1024 * 1024)
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+CANCELLED = "cancelled"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+class MetricsRegistry:
+    """
+    Aggregates stage runs for the Prometheus endpoint and the history file.
+
+    Counters (runs, items, errors, round trips) accumulate over the sentinel's
+    lifetime; `last_*` gauges describe each stage's most recent run, which is
+    what throughput regressions between cycles show up in.
+    """
+
+    def __init__(self, history_path: Optional[str] = HISTORY_PATH, history_max_bytes: int = HISTORY_MAX_BYTES):
+        self.history_path = history_path
+        self.history_max_bytes = history_max_bytes
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._runs: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._duration: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self._last: Dict[str, Dict[str, float]] = {}
+        self._events: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._errors: Dict[Tuple[str, str], int] = defaultdict(int)
+        # (stage, op) → [count, total seconds]; last run's max kept separately
+        self._ops: Dict[Tuple[str, str], List[float]] = defaultdict(lambda: [0, 0.0])
+        self._op_max: Dict[Tuple[str, str], float] = {}
+        self._cycles = 0
+        self._last_cycle: Optional[float] = None
+
+    def record_run(self, stage: str, outcome: str, duration: float, stats: Optional[Dict[str, Any]] = None) -> None:
+        """Records one finished stage; `stats` is a stage_metrics snapshot when the stage reported one."""
+        stats = stats or {}
+        counters = stats.get("counters", {})
+        errors = stats.get("errors", {})
+        timings = stats.get("timings", {})
+        items = counters.get("items")
+        items_per_second = round(items / duration, 3) if items is not None and duration > 0 else None
+
+        with self._lock:
+            self._runs[(stage, outcome)] += 1
+            self._duration[stage][0] += 1
+            self._duration[stage][1] += duration
+            last = {"duration_seconds": duration, "timestamp_seconds": time.time()}
+            if items_per_second is not None:
+                last["items_per_second"] = items_per_second
+            if "cpu_seconds" in stats:
+                last["cpu_seconds"] = stats["cpu_seconds"]
+            if "peak_rss_bytes" in stats:
+                last["peak_rss_bytes"] = stats["peak_rss_bytes"]
+            self._last[stage] = last
+            for name, value in counters.items():
+                self._events[(stage, name)] += value
+            for kind, count in errors.items():
+                self._errors[(stage, kind)] += count
+            for op, (count, total, peak) in timings.items():
+                self._ops[(stage, op)][0] += count
+                self._ops[(stage, op)][1] += total
+                self._op_max[(stage, op)] = peak
+
+        entry: Dict[str, Any] = {"t": int(time.time()), "stage": stage, "o": outcome, "s": round(duration, 2)}
+        if items_per_second is not None:
+            entry["ips"] = items_per_second
+        if stats:
+            entry["cpu"] = stats.get("cpu_seconds")
+            entry["rss_mb"] = round(stats.get("peak_rss_bytes", 0) / 1024 / 1024, 1)
+            entry["c"] = {name: round(value, 3) for name, value in counters.items()}
+            if errors:
+                entry["e"] = errors
+            if timings:
+                entry["op"] = timings
+        self.append_history(entry)
+
+    def record_cycle(self, duration: float, results: Dict[str, str]) -> None:
+        with self._lock:
+            self._cycles += 1
+            self._last_cycle = duration
+        self.append_history({"t": int(time.time()), "cycle": round(duration, 2), "r": results})
+
+    def append_history(self, entry: Dict[str, Any]) -> None:
+        if not self.history_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.history_path) or ".", exist_ok=True)
+            with self._lock:
+                with open(self.history_path, "a") as f:
+                    f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                if os.path.getsize(self.history_path) > self.history_max_bytes:
+                    self._trim_history()
+        except OSError as e:
+            logging.error(f"Failed to write metrics history: {e}")
+
+    def _trim_history(self) -> None:
+        """Keeps the newest half of the file (SD-card friendly: one rewrite per cap reached)."""
+        with open(self.history_path) as f:
+            lines = f.readlines()
+        tmp_path = f"{self.history_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(lines[len(lines) // 2:])
+        os.replace(tmp_path, self.history_path)
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        out: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]) -> None:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(f"{name}{labels} {value}" for labels, value in samples)
+
+        with self._lock:
+            metric("sentinel_start_time_seconds", "gauge", "When the sentinel started.", [("", self.started)])
+            metric("sentinel_cycles_total", "counter", "Completed automated cycles.", [("", self._cycles)])
+            if self._last_cycle is not None:
+                metric("sentinel_cycle_last_duration_seconds", "gauge", "Duration of the last cycle.",
+                       [("", self._last_cycle)])
+            metric("sentinel_stage_runs_total", "counter", "Stage runs by outcome.",
+                   [(_labels(stage=s, outcome=o), n) for (s, o), n in sorted(self._runs.items())])
+            out.append("# HELP sentinel_stage_duration_seconds Stage run time.")
+            out.append("# TYPE sentinel_stage_duration_seconds summary")
+            for stage, (count, total) in sorted(self._duration.items()):
+                out.append(f"sentinel_stage_duration_seconds_sum{_labels(stage=stage)} {total}")
+                out.append(f"sentinel_stage_duration_seconds_count{_labels(stage=stage)} {count}")
+            for field, help_text in (
+                ("duration_seconds", "Duration of the stage's last run."),
+                ("items_per_second", "Items processed per second in the stage's last run."),
+                ("cpu_seconds", "CPU time (user + system) of the stage's last run."),
+                ("peak_rss_bytes", "Peak resident memory of the process that ran the stage's last run."),
+                ("timestamp_seconds", "When the stage's last run finished."),
+            ):
+                metric(f"sentinel_stage_last_{field}", "gauge", help_text,
+                       [(_labels(stage=s), last[field]) for s, last in sorted(self._last.items()) if field in last])
+            metric("sentinel_stage_events_total", "counter",
+                   "Work done by stages: items, embeddings, http_requests, bytes_downloaded, ...",
+                   [(_labels(stage=s, name=n), v) for (s, n), v in sorted(self._events.items())])
+            metric("sentinel_stage_errors_total", "counter", "Stage errors by type.",
+                   [(_labels(stage=s, type=k), n) for (s, k), n in sorted(self._errors.items())])
+            out.append("# HELP sentinel_stage_op_seconds Timed operations inside stages (e.g. Supabase round trips).")
+            out.append("# TYPE sentinel_stage_op_seconds summary")
+            for (stage, op), (count, total) in sorted(self._ops.items()):
+                out.append(f"sentinel_stage_op_seconds_sum{_labels(stage=stage, op=op)} {total}")
+                out.append(f"sentinel_stage_op_seconds_count{_labels(stage=stage, op=op)} {count}")
+            metric("sentinel_stage_last_op_max_seconds", "gauge", "Slowest operation in the stage's last run.",
+                   [(_labels(stage=s, op=o), v) for (s, o), v in sorted(self._op_max.items())])
+        return "\n".join(out) + "\n"
+
+def serve(registry: MetricsRegistry, host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Serves GET /metrics on a daemon thread; returns None when disabled or the port is taken."""
+    if not port:
+        return None
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            logging.debug(f"metrics {format % args}")
+
+        def do_GET(self) -> None:
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logging.error(f"Metrics endpoint unavailable on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List
+
+# --- CONFIGURATION ---
+# Set by the sentinel for subprocess stages; the process writes its snapshot here on exit
+METRICS_FILE = os.getenv("STAGE_METRICS_FILE")
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_errors: Dict[str, int] = defaultdict(int)
+# name → [count, total seconds, max seconds]
+_timings: Dict[str, List[float]] = {}
+_started = time.monotonic()
+_cpu_started = 0.0
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def incr(name: str, value: float = 1) -> None:
+    """Adds to a counter such as items, embeddings or bytes_downloaded."""
+    with _lock:
+        _counters[name] += value
+
+def record_error(kind: str) -> None:
+    """Counts an error by type (exception class name, 'HTTP 429', ...)."""
+    with _lock:
+        _errors[kind] += 1
+
+def observe(name: str, seconds: float) -> None:
+    """Records one timed operation, e.g. a Supabase round trip."""
+    with _lock:
+        timing = _timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+def begin() -> None:
+    """Starts a fresh measurement, for processes that run several stages (the warm worker)."""
+    global _started, _cpu_started
+    with _lock:
+        _counters.clear()
+        _errors.clear()
+        _timings.clear()
+        _started = time.monotonic()
+        _cpu_started = _cpu_seconds()
+
+def snapshot() -> Dict[str, Any]:
+    """Everything recorded since begin() (or process start), plus CPU time and peak RSS."""
+    # ru_maxrss is KiB on Linux, bytes on macOS; it is the peak of the whole process so far
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_bytes = peak_rss if sys.platform == "darwin" else peak_rss * 1024
+    with _lock:
+        return {
+            "seconds": round(time.monotonic() - _started, 3),
+            "cpu_seconds": round(_cpu_seconds() - _cpu_started, 3),
+            "peak_rss_bytes": peak_rss_bytes,
+            "counters": dict(_counters),
+            "errors": dict(_errors),
+            "timings": {name: [int(t[0]), round(t[1], 4), round(t[2], 4)] for name, t in _timings.items()},
+        }
+
+def instrument_supabase(client: Any) -> None:
+    """Counts and times every PostgREST round trip the client makes, and its HTTP errors."""
+    try:
+        session = client.postgrest.session
+        hooks = session.event_hooks
+    except Exception:
+        return
+
+    def on_request(request):
+        request.extensions["stage_metrics_started"] = time.monotonic()
+
+    def on_response(response):
+        started = response.request.extensions.get("stage_metrics_started")
+        if started is not None:
+            observe("supabase", time.monotonic() - started)
+        if response.status_code >= 400:
+            record_error(f"Supabase HTTP {response.status_code}")
+
+    hooks["request"].append(on_request)
+    hooks["response"].append(on_response)
+    session.event_hooks = hooks
+
+def _write_on_exit() -> None:
+    try:
+        with open(METRICS_FILE, "w") as f:
+            json.dump(snapshot(), f)
+    except OSError:
+        pass
+
+if METRICS_FILE:
+    atexit.register(_write_on_exit)
@@ -0,0 +1,154 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+class Stage:
+    """
+    One unit of a sentinel cycle: a command plus where and when it may run.
+    `job` ('module:function', called with `job_args`) is the same work as an
+    in-process call, for runners that keep a warm Python worker.
+    """
+
+    def __init__(self, name: str, description: str, command: str, resource: str,
+                 depends_on: Sequence[str] = (), timeout: Optional[float] = None,
+                 job: Optional[str] = None, job_args: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.description = description
+        self.command = command
+        self.resource = resource
+        self.depends_on = list(depends_on)
+        self.timeout = timeout
+        self.job = job
+        self.job_args = job_args or {}
+
+def validate(stages: Sequence[Stage]) -> None:
+    """Raises ValueError on duplicate names, unknown dependencies or cycles."""
+    by_name = {s.name: s for s in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("Duplicate stage names")
+    for stage in stages:
+        for dep in stage.depends_on:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    visiting, done = set(), set()
+
+    def visit(name: str, path: List[str]) -> None:
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for stage in stages:
+        visit(stage.name, [])
+
+class StageScheduler:
+    """
+    Runs a DAG of stages, each in its own thread, as soon as its
+    dependencies have succeeded and a slot of its resource class is free.
+
+    A stage whose dependency failed or was skipped is skipped. A stage that
+    an earlier cycle still has running or queued (or that a manual command
+    reserved) is skipped instead of the whole cycle being blocked, so one
+    slow stage never holds up the rest and never runs twice back to back.
+    """
+
+    def __init__(self, limits: Dict[str, int], runner: Callable[[Stage], bool]):
+        self.limits = limits
+        self.runner = runner
+        self._cond = threading.Condition()
+        self._busy: Dict[str, int] = {resource: 0 for resource in limits}
+        self._running: set = set()
+        # Stage names owned by an unfinished run(), from when it is queued until its outcome is known
+        self._claimed: set = set()
+
+    def _start(self, stage: Stage, results: Dict[str, str]) -> None:
+        def target():
+            started = time.time()
+            try:
+                ok = self.runner(stage)
+            except Exception as e:
+                logging.error(f"❌ Stage {stage.name} crashed: {e}")
+                ok = False
+            with self._cond:
+                results[stage.name] = SUCCEEDED if ok else FAILED
+                self._busy[stage.resource] -= 1
+                self._running.discard(stage.name)
+                self._claimed.discard(stage.name)
+                self._cond.notify_all()
+            logging.info(f"🧩 Stage {stage.name} {results[stage.name]} after {time.time() - started:.1f}s")
+
+        self._busy[stage.resource] += 1
+        self._running.add(stage.name)
+        threading.Thread(target=target, name=f"stage-{stage.name}", daemon=True).start()
+
+    def try_reserve(self, stage: Stage) -> bool:
+        """
+        Claims a stage's name and resource slot for work started outside a cycle
+        (a manual command); False if it is already running or its class is full.
+        """
+        with self._cond:
+            if stage.name in self._running or self._busy[stage.resource] >= self.limits[stage.resource]:
+                return False
+            self._busy[stage.resource] += 1
+            self._running.add(stage.name)
+            return True
+
+    def release(self, stage: Stage) -> None:
+        with self._cond:
+            self._busy[stage.resource] -= 1
+            self._running.discard(stage.name)
+            self._cond.notify_all()
+
+    def run(self, stages: Sequence[Stage]) -> Dict[str, str]:
+        """Blocks until every stage has finished or been skipped; returns name → outcome."""
+        validate(stages)
+        for stage in stages:
+            if stage.resource not in self.limits:
+                raise ValueError(f"Stage '{stage.name}' uses unknown resource class '{stage.resource}'")
+
+        results: Dict[str, str] = {}
+        waiting = []
+        started = set()
+        with self._cond:
+            for stage in stages:
+                if stage.name in self._claimed:
+                    logging.warning(f"⏳ Skipping {stage.name}: still queued or running in a previous cycle")
+                    results[stage.name] = SKIPPED
+                else:
+                    self._claimed.add(stage.name)
+                    waiting.append(stage)
+
+            while len(results) < len(stages):
+                changed = False
+                for stage in list(waiting):
+                    deps = [results.get(dep) for dep in stage.depends_on]
+                    if any(d in (FAILED, SKIPPED) for d in deps):
+                        logging.warning(f"⏭️ Skipping {stage.name}: an upstream stage did not succeed")
+                        results[stage.name] = SKIPPED
+                        self._claimed.discard(stage.name)
+                    elif stage.name in self._running and stage.name not in started:
+                        logging.warning(f"⏳ Skipping {stage.name}: still running (manual command)")
+                        results[stage.name] = SKIPPED
+                        self._claimed.discard(stage.name)
+                    elif all(d == SUCCEEDED for d in deps) and self._busy[stage.resource] < self.limits[stage.resource]:
+                        self._start(stage, results)
+                        started.add(stage.name)
+                    else:
+                        continue
+                    waiting.remove(stage)
+                    changed = True
+                # A skip can unblock (or skip) dependents right away; otherwise wait for a stage to finish
+                if not changed and len(results) < len(stages):
+                    self._cond.wait(timeout=5)
+        return results
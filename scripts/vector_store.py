@@ -0,0 +1,305 @@
+import os
+import csv
+import sys
+import json
+import fcntl
+import sqlite3
+import logging
+import argparse
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+# --- CONFIGURATION ---
+STORE_DIR = os.getenv(
+    "VECTOR_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "vector_store")
+)
+EMBEDDING_DIM = 512
+# float16 halves the footprint (1 KB per vector) at ~1e-3 relative error, well below CLIP's noise floor
+STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float16")
+# Embeddings sent to Supabase as JSON are rounded to this many decimals (~half the payload of float32.tolist())
+JSON_DECIMALS = 5
+METADATA_FIELDS = ("product_id", "image_url", "source", "category")
+PULL_PAGE_SIZE = 1000
+
+def vector_key(product_id: Optional[str], image_url: str) -> str:
+    """Inventory rows are keyed by product id, dataset rows by their image URL."""
+    return f"product:{product_id}" if product_id else f"url:{image_url}"
+
+def json_vector(vector: Any) -> List[float]:
+    """A JSON-ready embedding with short float reprs."""
+    return np.round(np.asarray(vector, dtype=np.float64), JSON_DECIMALS).tolist()
+
+def parse_vector(value: Any) -> np.ndarray:
+    # PostgREST and psql return pgvector columns in their text form "[0.1,0.2,...]"
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+class VectorStore:
+    """
+    Columnar on-disk embedding store.
+
+    Vectors live in one contiguous (N, dim) row-major file that readers map
+    with np.memmap, so scanning the whole latent space never copies it into
+    Python objects. A SQLite table maps each key to its row and metadata.
+    Rows are appended; re-adding a key overwrites its row in place.
+    """
+
+    def __init__(self, path: str = STORE_DIR, dim: int = EMBEDDING_DIM, dtype: str = STORE_DTYPE):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        info_path = os.path.join(path, "store.json")
+        if os.path.exists(info_path):
+            # The file layout is fixed at creation; a changed env setting doesn't reinterpret it
+            with open(info_path) as f:
+                info = json.load(f)
+            dim, dtype = info["dim"], info["dtype"]
+        else:
+            with open(info_path, "w") as f:
+                json.dump({"dim": dim, "dtype": dtype}, f)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = self.dim * self.dtype.itemsize
+        self.vectors_path = os.path.join(path, "vectors.bin")
+
+        self._db = sqlite3.connect(os.path.join(path, "index.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                key TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE,
+                product_id TEXT,
+                image_url TEXT,
+                source TEXT,
+                category TEXT
+            )
+        """)
+        self._db.commit()
+        self._mmap: Optional[np.memmap] = None
+        self.size = 0
+        self.refresh()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def refresh(self) -> None:
+        """Picks up rows appended by other processes."""
+        size = self._db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+        if size != self.size:
+            self.size = size
+            self._mmap = None
+
+    def vectors(self) -> np.ndarray:
+        """Read-only (N, dim) view of every stored vector, in row order."""
+        self.refresh()
+        if self.size == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        if self._mmap is None:
+            self._mmap = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(self.size, self.dim))
+        return self._mmap
+
+    def rows(self, keys: Sequence[str]) -> np.ndarray:
+        """Row number of each key, -1 where unknown."""
+        found: Dict[str, int] = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            cursor = self._db.execute(
+                f"SELECT key, row FROM rows WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            found.update(cursor.fetchall())
+        return np.asarray([found.get(k, -1) for k in keys], dtype=np.int64)
+
+    def get(self, keys: Sequence[str]) -> np.ndarray:
+        """float32 copies of the vectors for `keys`; unknown keys raise KeyError."""
+        rows = self.rows(keys)
+        if (rows < 0).any():
+            raise KeyError(keys[int(np.argmax(rows < 0))])
+        return np.asarray(self.vectors()[rows], dtype=np.float32)
+
+    def metadata(self) -> Iterator[Dict[str, Any]]:
+        """Yields {"key", "row", *METADATA_FIELDS} in row order."""
+        cursor = self._db.execute(f"SELECT key, row, {', '.join(METADATA_FIELDS)} FROM rows ORDER BY row")
+        for row in cursor:
+            yield dict(zip(("key", "row") + METADATA_FIELDS, row))
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.refresh()
+            # Drop a tail left behind by a writer that died before committing its index rows
+            expected = self.size * self.row_bytes
+            if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > expected:
+                with open(self.vectors_path, "r+b") as f:
+                    f.truncate(expected)
+            yield
+
+    def upsert(self, keys: Sequence[str], vectors: np.ndarray,
+               metadata: Optional[Sequence[Dict[str, Any]]] = None) -> int:
+        """Appends new keys and overwrites existing ones; returns how many rows were appended."""
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(len(keys), self.dim)
+        # Last write wins when a key repeats within one call
+        latest = {str(k): i for i, k in enumerate(keys)}
+        keys = list(latest)
+        vectors = vectors[list(latest.values())]
+        metadata = [metadata[i] for i in latest.values()] if metadata else [{}] * len(keys)
+
+        with self._write_lock():
+            rows = self.rows(keys)
+            new = np.flatnonzero(rows < 0)
+            rows[new] = np.arange(self.size, self.size + len(new))
+
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors[new]).tobytes())
+            existing = np.flatnonzero(rows < self.size)
+            if len(existing):
+                with open(self.vectors_path, "r+b") as f:
+                    for i in existing:
+                        f.seek(int(rows[i]) * self.row_bytes)
+                        f.write(vectors[i].tobytes())
+
+            with self._db:
+                self._db.executemany(
+                    f"INSERT OR REPLACE INTO rows (key, row, {', '.join(METADATA_FIELDS)}) "
+                    f"VALUES (?, ?, {', '.join('?' * len(METADATA_FIELDS))})",
+                    [(k, int(r), *(None if m.get(f) is None else str(m.get(f)) for f in METADATA_FIELDS))
+                     for k, r, m in zip(keys, rows, metadata)]
+                )
+            self.size += len(new)
+            self._mmap = None
+        return len(new)
+
+    def close(self) -> None:
+        self._mmap = None
+        self._db.close()
+
+def append_entries(entries: List[Dict[str, Any]], path: str = STORE_DIR) -> None:
+    """
+    Stores {"product_id", "image_url", "embedding", "source", "category"}
+    entries produced by a sync job. Never raises: the store is a local mirror
+    and `pull` repairs it.
+    """
+    if not entries:
+        return
+    try:
+        store = VectorStore(path)
+        try:
+            appended = store.upsert(
+                [vector_key(e.get("product_id"), e["image_url"]) for e in entries],
+                np.asarray([e["embedding"] for e in entries], dtype=np.float32),
+                entries
+            )
+        finally:
+            store.close()
+        logging.info(f"🗄️ Vector store: {appended} appended, {len(entries) - appended} updated")
+    except Exception as e:
+        logging.warning(f"⚠️ Vector store update failed ({e}); run `python3 scripts/vector_store.py pull` to resync")
+
+# --- Supabase import / export ---
+
+def pull(supabase, store: VectorStore, page_size: int = PULL_PAGE_SIZE) -> int:
+    """Mirrors style_latent_space into the store, paging by id so rows added mid-pull aren't skipped."""
+    pulled, last_id = 0, None
+    while True:
+        query = supabase.table("style_latent_space") \
+            .select("id, product_id, image_url, source, archetype, embedding") \
+            .not_.is_("embedding", "null")
+        if last_id:
+            query = query.gt("id", last_id)
+        page = query.order("id").limit(page_size).execute().data or []
+        if page:
+            store.upsert(
+                [vector_key(r.get("product_id"), r["image_url"]) for r in page],
+                np.stack([parse_vector(r["embedding"]) for r in page]),
+                [{**r, "category": r.get("archetype")} for r in page]
+            )
+            pulled += len(page)
+            last_id = page[-1]["id"]
+            if pulled % 10000 < page_size:
+                logging.info(f"   Pulled {pulled} vectors...")
+        if len(page) < page_size:
+            return pulled
+
+def import_csv(store: VectorStore, csv_path: str, chunk: int = 5000) -> int:
+    """
+    Loads a psql export, the fast path for large tables:
+    \\copy (SELECT product_id, image_url, source, archetype, embedding FROM style_latent_space) TO 'latent.csv' CSV HEADER
+    """
+    imported = 0
+    with open(csv_path, newline="") as f:
+        batch: List[Dict[str, Any]] = []
+        for row in csv.DictReader(f):
+            if row.get("embedding"):
+                batch.append(row)
+            if len(batch) >= chunk:
+                imported += _store_csv_rows(store, batch)
+                batch = []
+        imported += _store_csv_rows(store, batch)
+    return imported
+
+def _store_csv_rows(store: VectorStore, rows: List[Dict[str, Any]]) -> int:
+    if not rows:
+        return 0
+    store.upsert(
+        [vector_key(r.get("product_id") or None, r["image_url"]) for r in rows],
+        np.stack([parse_vector(r["embedding"]) for r in rows]),
+        [{**r, "product_id": r.get("product_id") or None, "category": r.get("archetype")} for r in rows]
+    )
+    return len(rows)
+
+def export_csv(store: VectorStore, csv_path: str) -> int:
+    """
+    Writes the store as CSV for bulk loading into an empty or staging table:
+    \\copy style_latent_space (product_id, image_url, source, archetype, embedding) FROM 'latent.csv' CSV HEADER
+    """
+    vectors = store.vectors()
+    exported = 0
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["product_id", "image_url", "source", "archetype", "embedding"])
+        for meta in store.metadata():
+            vector = vectors[meta["row"]].astype(np.float32)
+            writer.writerow([
+                meta["product_id"] or "", meta["image_url"], meta["source"] or "", meta["category"] or "",
+                "[" + ",".join(f"{v:.6g}" for v in vector) + "]"
+            ])
+            exported += 1
+    return exported
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Local memory-mapped mirror of style_latent_space.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("pull", help="Mirror style_latent_space from Supabase")
+    sub.add_parser("stats", help="Show store size")
+    imp = sub.add_parser("import-csv", help="Load a psql \\copy export")
+    imp.add_argument("path")
+    exp = sub.add_parser("export-csv", help="Write a CSV for psql \\copy")
+    exp.add_argument("path")
+    args = parser.parse_args()
+
+    store = VectorStore()
+    if args.command == "pull":
+        from dotenv import load_dotenv
+        from supabase import create_client
+        load_dotenv(".env.local") if os.path.exists(".env.local") else load_dotenv()
+        supabase = create_client(
+            os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL"),
+            os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        )
+        logging.info(f"✅ Pulled {pull(supabase, store)} vectors ({len(store)} stored)")
+    elif args.command == "import-csv":
+        logging.info(f"✅ Imported {import_csv(store, args.path)} vectors ({len(store)} stored)")
+    elif args.command == "export-csv":
+        logging.info(f"✅ Exported {export_csv(store, args.path)} vectors to {args.path}")
+    elif args.command == "stats":
+        size_mb = len(store) * store.row_bytes / 1e6
+        print(json.dumps({"vectors": len(store), "dim": store.dim, "dtype": str(store.dtype), "size_mb": round(size_mb, 1)}))
+    store.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
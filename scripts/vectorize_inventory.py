@@ -1,14 +1,17 @@
 import os
-import io
 import logging
-import requests
-from PIL import Image
-from typing import List, Dict, Any
-from sentence_transformers import SentenceTransformer
+from typing import List, Dict, Any, Optional
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+import clip_encoder
+import embedding_writer
+import http_client
+import vector_store
+from embedding_cache import open_default_cache
+from image_pipeline import ImagePipeline
+
 # --- CONFIGURATION ---
 # Load environment variables
 if os.path.exists(".env.local"):
@@ -19,7 +22,8 @@ else:
 SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 BATCH_SIZE = 20
-MODEL_NAME = 'clip-ViT-B-32'
+DOWNLOAD_WORKERS = 8
+MODEL_NAME = clip_encoder.MODEL_NAME
 
 # Setup Logging
 logging.basicConfig(
@@ -38,7 +42,7 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 # Initialize Supabase and CLIP
 logging.info(f"🚀 Initializing {MODEL_NAME} and Supabase Client...")
 try:
-    model = SentenceTransformer(MODEL_NAME)
+    clip_encoder.load_model()
     supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 except Exception as e:
     logging.error(f"Initialization failed: {e}")
@@ -57,24 +61,14 @@ def fetch_unvectorized_items() -> List[Dict[str, Any]]:
         logging.error(f"Failed to fetch items: {e}")
         return []
 
-def process_item(item: Dict[str, Any]) -> List[float]:
-    """Downloads first image and generates embedding."""
+def first_image_url(item: Dict[str, Any]) -> Optional[str]:
     images = item.get("images", [])
     if not images or not isinstance(images, list):
-        raise ValueError("No valid images found for item.")
+        return None
+    return images[0]
 
-    image_url = images[0]
-    
-    # Fetch image into memory
-    response = requests.get(image_url, timeout=10)
-    response.raise_for_status()
-    
-    # Open and convert
-    img = Image.open(io.BytesIO(response.content)).convert("RGB")
-    
-    # Generate 512-dim vector
-    embedding = model.encode(img, show_progress_bar=False)
-    return embedding.tolist()
+def fetch_image_bytes(image_url: str) -> bytes:
+    return http_client.get_bytes(image_url, timeout=10)
 
 def run_vectorization():
     items = fetch_unvectorized_items()
@@ -85,30 +79,41 @@ def run_vectorization():
         return
 
     logging.info(f"🧬 Found {total} items needing vectorization. Processing in batches of {BATCH_SIZE}...")
-    
-    # Process in batches
-    for i in range(0, total, BATCH_SIZE):
-        batch = items[i:i + BATCH_SIZE]
-        logging.info(f"Processing batch {i//BATCH_SIZE + 1}...")
-        
-        for item in tqdm(batch, desc="Vectorizing Batch"):
-            item_id = item["id"]
-            try:
-                # 1. Generate DNA
-                embedding = process_item(item)
-                
-                # 2. Update Supabase
-                supabase.table("pulse_inventory") \
-                    .update({"style_embedding": embedding}) \
-                    .eq("id", item_id) \
-                    .execute()
-                
-            except requests.exceptions.RequestException as re:
-                logging.warning(f"⚠️ Network error for Item {item_id}: {re}")
-            except Exception as e:
-                logging.error(f"❌ Failed to process Item {item_id}: {e}")
+
+    jobs = []
+    for item in items:
+        image_url = first_image_url(item)
+        if image_url:
+            jobs.append((item["id"], image_url))
+        else:
+            logging.error(f"❌ Failed to process Item {item['id']}: No valid images found for item.")
+
+    cache = open_default_cache()
+    writer = embedding_writer.inventory_embedding_writer(supabase)
+    pipeline = ImagePipeline(
+        fetch=fetch_image_bytes,
+        batch_size=BATCH_SIZE,
+        download_workers=DOWNLOAD_WORKERS,
+        queue_size=BATCH_SIZE * 2,
+        cache=cache
+    )
+
+    # Downloads, decodes and cache lookups overlap with batched inference
+    progress = tqdm(total=len(jobs), desc="Vectorizing")
+    for results in pipeline.run(jobs):
+        for item_id, image_url, embedding, error in results:
+            if embedding is None:
+                logging.warning(f"⚠️ Item {item_id}: {error}")
                 continue
+            writer.add({"id": item_id, "embedding": vector_store.json_vector(embedding)})
+        progress.update(len(results))
+    progress.close()
 
+    writer.close()
+    if cache is not None:
+        cache.log_stats()
+        cache.close()
+    http_client.log_stats()
     logging.info("🏁 Inventory vectorization complete.")
 
 if __name__ == "__main__":
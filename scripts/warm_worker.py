@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import importlib
+import threading
+import traceback
+import subprocess
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import stage_metrics
+
+# --- CONFIGURATION ---
+# The worker is restarted after this many jobs, so slow leaks in the stages can't accumulate
+MAX_JOBS = int(os.getenv("WARM_WORKER_MAX_JOBS", "24"))
+WATCHDOG_INTERVAL = 1
+RESULT_TAG = "@@warm-worker-result "
+OUTPUT_TAIL = 10
+
+OK = "ok"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+CANCELLED = "cancelled"
+CRASHED = "crashed"
+
+def parse_job(job: str) -> Tuple[str, str]:
+    """'module:function' → (module, function)."""
+    module, _, function = job.partition(":")
+    if not module or not function:
+        raise ValueError(f"Job must be 'module:function', got '{job}'")
+    return module, function
+
+class WarmWorker:
+    """
+    A long-lived Python process that runs stage functions as jobs.
+
+    The worker imports `preload` once at startup (loading CLIP, Supabase and
+    HTTP clients as module-level setup does), then calls 'module:function'
+    jobs one at a time, so each cycle reuses the loaded model instead of
+    starting fresh interpreters. Stage output is streamed to `on_output`.
+    A job that times out or is cancelled takes the worker down with it
+    (via `terminate`); the next job starts a new one.
+    """
+
+    def __init__(self, preload: Sequence[str], terminate: Callable[[subprocess.Popen], None],
+                 on_output: Callable[[str], None], max_jobs: int = MAX_JOBS):
+        self.preload = list(preload)
+        self.terminate = terminate
+        self.on_output = on_output
+        self.max_jobs = max_jobs
+        self.process: Optional[subprocess.Popen] = None
+        self.jobs_run = 0
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._results: Dict[int, Dict[str, Any]] = {}
+        self._done = threading.Condition()
+        # (process, handler) of the job in progress; lines are only routed to the process it was sent to
+        self._line_handler: Optional[Tuple[subprocess.Popen, Callable[[str], None]]] = None
+
+    def _alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def _spawn(self) -> None:
+        script = os.path.abspath(__file__)
+        self.process = subprocess.Popen(
+            [sys.executable, script, *self.preload],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            # Stage output should reach the sentinel log as it happens, not when a buffer fills
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+            start_new_session=True  # Own process group, so a timeout can kill the whole tree
+        )
+        self.jobs_run = 0
+        threading.Thread(target=self._read, args=(self.process,), name="warm-worker-reader", daemon=True).start()
+
+    def _read(self, process: subprocess.Popen) -> None:
+        assert process.stdout is not None
+        for line in process.stdout:
+            clean_line = line.strip()
+            if clean_line.startswith(RESULT_TAG):
+                result = json.loads(clean_line[len(RESULT_TAG):])
+                with self._done:
+                    self._results[result["id"]] = result
+                    self._done.notify_all()
+            elif clean_line:
+                if process is not self.process:
+                    # Output of a killed worker that was already replaced; it belongs to no current job
+                    continue
+                owner = self._line_handler
+                if owner is not None and owner[0] is process:
+                    owner[1](clean_line)
+                else:
+                    self.on_output(clean_line)
+        process.wait()
+        with self._done:
+            self._done.notify_all()
+
+    def stop(self) -> None:
+        if self._alive():
+            assert self.process is not None
+            self.terminate(self.process)
+
+    def run(self, job: str, kwargs: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None,
+            cancel: Optional[threading.Event] = None,
+            on_line: Optional[Callable[[str], None]] = None) -> Tuple[str, List[str], Optional[Dict[str, Any]]]:
+        """
+        Runs one job; returns (OK/FAILED/TIMED_OUT/CANCELLED/CRASHED, last output
+        lines, the job's stage_metrics snapshot or None if it didn't finish).
+        """
+        parse_job(job)
+        with self._lock:
+            if self._alive() and self.jobs_run >= self.max_jobs:
+                self.stop()
+            if not self._alive():
+                self._spawn()
+            process = self.process
+            assert process is not None and process.stdin is not None
+
+            self._next_id += 1
+            job_id = self._next_id
+            tail: List[str] = []
+
+            def handle(line: str) -> None:
+                self.on_output(line)
+                tail.append(line)
+                del tail[:-OUTPUT_TAIL]
+                if on_line:
+                    on_line(line)
+
+            self._line_handler = (process, handle)
+            try:
+                process.stdin.write(json.dumps({"id": job_id, "job": job, "kwargs": kwargs or {}}) + "\n")
+                process.stdin.flush()
+                self.jobs_run += 1
+
+                deadline = time.time() + timeout if timeout else None
+                with self._done:
+                    while job_id not in self._results:
+                        if process.poll() is not None:
+                            return CRASHED, tail, None
+                        if cancel is not None and cancel.is_set():
+                            self.terminate(process)
+                            return CANCELLED, tail, None
+                        if deadline is not None and time.time() >= deadline:
+                            self.terminate(process)
+                            return TIMED_OUT, tail, None
+                        self._done.wait(WATCHDOG_INTERVAL)
+                    result = self._results.pop(job_id)
+            except (BrokenPipeError, OSError):
+                return CRASHED, tail, None
+            finally:
+                self._line_handler = None
+            # A traceback already ends with the error line
+            if result.get("error") and result["error"] not in tail[-1:]:
+                tail.append(result["error"])
+            return (OK if result.get("ok") else FAILED), tail, result.get("metrics")
+
+def serve(preload: Sequence[str]) -> None:
+    """Worker side: preload modules, then run one JSON job per stdin line."""
+    for module in preload:
+        importlib.import_module(module)
+    print(f"🔥 Warm worker ready (pid {os.getpid()}, preloaded: {', '.join(preload) or 'nothing'})", flush=True)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        ok, error = False, None
+        stage_metrics.begin()
+        try:
+            module, function = parse_job(request["job"])
+            result = getattr(importlib.import_module(module), function)(**request.get("kwargs", {}))
+            ok = result is not False
+        except SystemExit as e:
+            ok = e.code in (None, 0)
+            error = None if ok else f"exited with {e.code}"
+        except Exception as e:
+            traceback.print_exc()
+            stage_metrics.record_error(type(e).__name__)
+            error = f"{type(e).__name__}: {e}"
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Leading newline in case the job left a partial line behind
+        result = {"id": request["id"], "ok": ok, "error": error, "metrics": stage_metrics.snapshot()}
+        sys.stdout.write(f"\n{RESULT_TAG}{json.dumps(result)}\n")
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    serve(sys.argv[1:])
@@ -1,11 +1,59 @@
 "use client";
 
-import { useState } from "react";
-import { Play, Zap, Trash2, RefreshCw, Smartphone, Terminal, Code } from "lucide-react";
+import { useCallback, useEffect, useState } from "react";
+import { Play, Zap, Trash2, RefreshCw, Smartphone, Terminal, Code, X } from "lucide-react";
+
+type SystemCommand = {
+  id: string;
+  command: string;
+  status: "pending" | "running" | "completed" | "failed" | "cancelled";
+  progress: string | null;
+  error: string | null;
+  cancel_requested: boolean;
+  created_at: string;
+  heartbeat_at: string | null;
+};
+
+const ACTIVE_STATUSES = ["pending", "running"];
 
 export default function AdminSystemControls() {
   const [status, setStatus] = useState<string | null>(null);
   const [loading, setLoading] = useState<string | null>(null);
+  const [history, setHistory] = useState<SystemCommand[]>([]);
+
+  const loadHistory = useCallback(async () => {
+    try {
+      const res = await fetch("/api/admin/system/commands");
+      if (res.ok) setHistory(await res.json());
+    } catch {
+      // Keep the last known list; the next poll retries
+    }
+  }, []);
+
+  const hasActive = history.some((c) => ACTIVE_STATUSES.includes(c.status));
+
+  useEffect(() => {
+    loadHistory();
+    // Poll quickly while something is queued or running, slowly otherwise
+    const interval = setInterval(loadHistory, hasActive ? 5000 : 30000);
+    return () => clearInterval(interval);
+  }, [loadHistory, hasActive]);
+
+  async function cancelCommand(id: string) {
+    try {
+      const res = await fetch("/api/admin/system/cancel", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ id })
+      });
+      const data = await res.json();
+      setStatus(res.ok ? `Success: ${data.message}` : `Error: ${data.error}`);
+    } catch (err) {
+      setStatus("Failed to communicate with system API.");
+    } finally {
+      loadHistory();
+    }
+  }
 
   async function triggerCommand(command: string) {
     setLoading(command);
@@ -26,6 +74,7 @@ export default function AdminSystemControls() {
       setStatus("Failed to communicate with system API.");
     } finally {
       setLoading(null);
+      loadHistory();
     }
   }
 
@@ -66,6 +115,34 @@ export default function AdminSystemControls() {
         </div>
       )}
 
+      {history.length > 0 && (
+        <div className="bg-zinc-950 border border-zinc-800 rounded-2xl divide-y divide-zinc-900">
+          {history.map((cmd) => (
+            <div key={cmd.id} className="p-4 flex items-center gap-4 font-mono text-[10px]">
+              <span className="w-20 font-black uppercase tracking-widest text-white">{cmd.command}</span>
+              <span className={`w-20 uppercase tracking-widest ${
+                cmd.status === "completed" ? "text-green-500" :
+                cmd.status === "failed" ? "text-red-500" :
+                cmd.status === "running" ? "text-yellow-500" : "text-zinc-500"
+              }`}>
+                {cmd.cancel_requested && cmd.status === "running" ? "stopping" : cmd.status}
+              </span>
+              <span className="flex-1 truncate text-zinc-500">
+                {cmd.error || cmd.progress || new Date(cmd.created_at).toLocaleString()}
+              </span>
+              {ACTIVE_STATUSES.includes(cmd.status) && !cmd.cancel_requested && (
+                <button
+                  onClick={() => cancelCommand(cmd.id)}
+                  className="flex items-center gap-1 text-zinc-500 hover:text-red-500 transition-colors uppercase tracking-widest"
+                >
+                  <X size={12} /> Cancel
+                </button>
+              )}
+            </div>
+          ))}
+        </div>
+      )}
+
       <div className="bg-zinc-950/50 border border-dashed border-zinc-800 p-8 rounded-[2.5rem]">
         <h4 className="text-[10px] font-black uppercase tracking-[0.4em] text-zinc-500 mb-6 flex items-center gap-2">
           <Code size={12} /> Terminal Reference (Local/Pi)
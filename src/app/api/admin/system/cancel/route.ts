@@ -0,0 +1,53 @@
+import { NextRequest, NextResponse } from "next/server";
+import { supabaseAdmin } from "@/lib/supabase-admin";
+import { verifyAdmin } from "@/lib/admin";
+
+/**
+ * Cancels a system command.
+ * A pending command is cancelled immediately; the update only matches while it is
+ * still pending, so it cannot race the Sentinel claiming it. A running command is
+ * flagged and the Sentinel stops its process on the next heartbeat.
+ */
+export async function POST(req: NextRequest) {
+  const isAdmin = await verifyAdmin();
+  if (!isAdmin) {
+    return NextResponse.json({ error: "Unauthorized" }, { status: 401 });
+  }
+
+  try {
+    const { id } = await req.json().catch(() => ({}));
+    if (!id || typeof id !== "string") {
+      return NextResponse.json({ error: "Missing or invalid id" }, { status: 400 });
+    }
+
+    const now = new Date().toISOString();
+    const { data: cancelled, error: pendingError } = await supabaseAdmin
+      .from("system_commands")
+      .update({ status: "cancelled", cancel_requested: true, finished_at: now, updated_at: now })
+      .eq("id", id)
+      .eq("status", "pending")
+      .select("id");
+    if (pendingError) throw pendingError;
+
+    if (cancelled && cancelled.length > 0) {
+      return NextResponse.json({ success: true, message: "Command cancelled before it started." });
+    }
+
+    const { data: flagged, error: runningError } = await supabaseAdmin
+      .from("system_commands")
+      .update({ cancel_requested: true, updated_at: now })
+      .eq("id", id)
+      .eq("status", "running")
+      .select("id");
+    if (runningError) throw runningError;
+
+    if (!flagged || flagged.length === 0) {
+      return NextResponse.json({ error: "Command is not pending or running" }, { status: 409 });
+    }
+
+    return NextResponse.json({ success: true, message: "Cancellation requested. The Sentinel will stop the command shortly." });
+  } catch (error: any) {
+    console.error("[System Cancel Error]:", error);
+    return NextResponse.json({ error: error.message }, { status: 500 });
+  }
+}
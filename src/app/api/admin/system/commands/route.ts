@@ -0,0 +1,24 @@
+import { NextResponse } from "next/server";
+import { supabaseAdmin } from "@/lib/supabase-admin";
+import { verifyAdmin } from "@/lib/admin";
+
+// Recent system commands with the progress the Sentinel reports back while they run.
+export async function GET() {
+  const isAdmin = await verifyAdmin();
+  if (!isAdmin) {
+    return NextResponse.json({ error: "Unauthorized" }, { status: 401 });
+  }
+
+  const { data, error } = await supabaseAdmin
+    .from("system_commands")
+    .select("id, command, status, progress, error, cancel_requested, created_at, started_at, heartbeat_at, finished_at")
+    .order("created_at", { ascending: false })
+    .limit(10);
+
+  if (error) {
+    console.error("[System Commands Fetch Error]:", error);
+    return NextResponse.json({ error: error.message }, { status: 500 });
+  }
+
+  return NextResponse.json(data ?? []);
+}
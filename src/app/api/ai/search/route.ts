@@ -1,25 +1,130 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { supabaseAdmin } from '@/lib/supabase-admin';
+import { createClient } from '@/lib/supabase-server';
 
 /**
  * AUVRA NEURAL SEARCH API
- * Vector similarity search via pgvector + Sentinel CLIP embeddings.
+ * Text or image similarity search over the archive.
  *
- * STATUS: Not implemented — getImageEmbedding is a stub that returns a
- * deterministic fake vector, so all similarity results are meaningless.
- * This endpoint is disabled until the Sentinel CLIP API is integrated and
- * real embeddings are stored in pulse_inventory.embedding.
- *
- * TODO: Re-enable once Sentinel /embed endpoint is live and embeddings are
- * populated. Remove this guard and restore the match_inventory_vibes RPC call.
+ * Queries are answered by the Sentinel's local ANN index
+ * (scripts/embedding_server.py, POST /search): the query is CLIP-encoded
+ * there and matched against style_latent_space, then the hits are hydrated
+ * from pulse_inventory here. Disabled (501) until NEURAL_SEARCH_URL points
+ * at a reachable Sentinel and NEURAL_SEARCH_TOKEN is set on both sides.
+ * Requires a signed-in session: every query costs CLIP inference on the Pi.
  */
 
-// eslint-disable-next-line @typescript-eslint/no-unused-vars
-export async function POST(_req: NextRequest) {
-  return NextResponse.json(
-    {
-      error: 'Neural search is not yet available. Sentinel CLIP integration pending.',
-      code: 'NEURAL_SEARCH_UNAVAILABLE',
-    },
-    { status: 501 }
-  );
+const MAX_RESULTS = 48;
+const SEARCH_TIMEOUT_MS = 10000;
+// The Sentinel downloads image queries itself, so only our CDN and the marketplace
+// image hosts are accepted — never arbitrary URLs that could reach the Pi's LAN.
+const IMAGE_QUERY_HOSTS = new Set([
+  'cdn.mbn-code.dk',
+  'res.cloudinary.com',
+  'images1.vinted.net',
+  'media-assets.grailed.com',
+]);
+
+function isAllowedImageUrl(value: string): boolean {
+  try {
+    const url = new URL(value);
+    return url.protocol === 'https:' && IMAGE_QUERY_HOSTS.has(url.hostname);
+  } catch {
+    return false;
+  }
+}
+
+interface SearchHit {
+  product_id: string | null;
+  similarity: number;
+}
+
+export async function POST(req: NextRequest) {
+  const searchUrl = process.env.NEURAL_SEARCH_URL;
+  const searchToken = process.env.NEURAL_SEARCH_TOKEN;
+  if (!searchUrl || !searchToken) {
+    return NextResponse.json(
+      {
+        error: 'Neural search is not yet available. Sentinel CLIP integration pending.',
+        code: 'NEURAL_SEARCH_UNAVAILABLE',
+      },
+      { status: 501 }
+    );
+  }
+
+  // Auth guard: queries run CLIP inference on the Sentinel, so anonymous callers are refused.
+  const serverClient = await createClient();
+  const { data: { session } } = await serverClient.auth.getSession();
+  if (!session) {
+    return NextResponse.json({ error: 'Authentication required' }, { status: 401 });
+  }
+
+  let body: { query?: unknown; image_url?: unknown; category?: unknown; count?: unknown };
+  try {
+    body = await req.json();
+  } catch {
+    return NextResponse.json({ error: 'Invalid JSON body' }, { status: 400 });
+  }
+
+  const query = typeof body.query === 'string' ? body.query.trim() : '';
+  const imageUrl = typeof body.image_url === 'string' ? body.image_url.trim() : '';
+  if (!query && !imageUrl) {
+    return NextResponse.json({ error: 'query or image_url required' }, { status: 400 });
+  }
+  if (!query && !isAllowedImageUrl(imageUrl)) {
+    return NextResponse.json({ error: 'image_url must be an https URL on the archive image CDN' }, { status: 400 });
+  }
+  const count = Math.min(Math.max(parseInt(String(body.count ?? 12)) || 12, 1), MAX_RESULTS);
+  const category = typeof body.category === 'string' && body.category ? body.category : undefined;
+
+  try {
+    const response = await fetch(searchUrl, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${searchToken}`,
+      },
+      body: JSON.stringify({
+        ...(query ? { text: query } : { image_url: imageUrl }),
+        k: count,
+        filters: { status: 'available', ...(category ? { category } : {}) },
+      }),
+      signal: AbortSignal.timeout(SEARCH_TIMEOUT_MS),
+    });
+
+    if (!response.ok) {
+      throw new Error(`Search worker returned ${response.status}`);
+    }
+
+    const { results } = (await response.json()) as { results: SearchHit[] };
+    const ids = results.map((hit) => hit.product_id).filter((id): id is string => Boolean(id));
+    if (ids.length === 0) {
+      return NextResponse.json({ results: [] });
+    }
+
+    const { data: items, error } = await supabaseAdmin
+      .from('pulse_inventory')
+      .select('id, title, brand, listing_price, images, category')
+      .in('id', ids)
+      .eq('status', 'available');
+
+    if (error) {
+      throw error;
+    }
+
+    // Keep the index's ranking; drop anything that sold since the index last synced
+    const byId = new Map((items || []).map((item) => [String(item.id), item]));
+    const ranked = results.flatMap((hit) => {
+      const item = hit.product_id ? byId.get(hit.product_id) : undefined;
+      return item ? [{ ...item, similarity: hit.similarity }] : [];
+    });
+
+    return NextResponse.json({ results: ranked });
+  } catch (err: unknown) {
+    console.error('[Neural Search] Error:', err);
+    return NextResponse.json(
+      { error: err instanceof Error ? err.message : 'Neural search failed' },
+      { status: 502 }
+    );
+  }
 }
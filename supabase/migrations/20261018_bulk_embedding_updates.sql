@@ -0,0 +1,43 @@
+-- Bulk embedding writes for the Python sync jobs.
+-- neural_sync.py and vectorize_inventory.py used to issue one UPDATE round trip per item;
+-- these RPCs take a JSON array of rows and apply them in a single statement.
+
+-- updates: [{"id": "<pulse_inventory.id>", "embedding": [512 floats]}, ...]
+CREATE OR REPLACE FUNCTION bulk_update_style_embeddings(updates jsonb)
+RETURNS integer AS $$
+DECLARE
+    updated_count integer;
+BEGIN
+    UPDATE pulse_inventory pi
+    SET style_embedding = (u.embedding::text)::vector(512)
+    FROM jsonb_to_recordset(updates) AS u(id uuid, embedding jsonb)
+    WHERE pi.id = u.id;
+
+    GET DIAGNOSTICS updated_count = ROW_COUNT;
+    RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = public, extensions;
+
+-- updates: [{"product_id": "<uuid>", "embedding": [512 floats], "image_url": "...", "archetype": "..."}, ...]
+CREATE OR REPLACE FUNCTION bulk_update_latent_embeddings(updates jsonb)
+RETURNS integer AS $$
+DECLARE
+    updated_count integer;
+BEGIN
+    UPDATE style_latent_space sls
+    SET embedding = (u.embedding::text)::vector(512),
+        image_url = COALESCE(u.image_url, sls.image_url),
+        archetype = COALESCE(u.archetype, sls.archetype)
+    FROM jsonb_to_recordset(updates) AS u(product_id uuid, embedding jsonb, image_url text, archetype text)
+    WHERE sls.product_id = u.product_id;
+
+    GET DIAGNOSTICS updated_count = ROW_COUNT;
+    RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = public, extensions;
+
+-- Service role only: these bypass the per-row admin checks of the API routes
+REVOKE EXECUTE ON FUNCTION bulk_update_style_embeddings(jsonb) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION bulk_update_latent_embeddings(jsonb) FROM PUBLIC, anon, authenticated;
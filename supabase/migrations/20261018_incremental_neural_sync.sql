@@ -0,0 +1,34 @@
+-- Incremental neural sync support.
+-- neural_sync.py used to pull every available/sold row (including the 512-float
+-- style_embedding) each cycle just to diff it against style_latent_space in Python.
+
+-- 1. Change watermark: bumped on insert and whenever a column that affects syncing changes.
+--    Embedding writes by the sync job itself deliberately do NOT bump it.
+ALTER TABLE pulse_inventory ADD COLUMN IF NOT EXISTS content_updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+UPDATE pulse_inventory SET content_updated_at = COALESCE(created_at, NOW());
+
+CREATE INDEX IF NOT EXISTS idx_pulse_inventory_content_updated
+ON pulse_inventory(content_updated_at, id);
+
+CREATE OR REPLACE FUNCTION touch_content_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT'
+        OR NEW.status IS DISTINCT FROM OLD.status
+        OR NEW.images IS DISTINCT FROM OLD.images
+        OR NEW.category IS DISTINCT FROM OLD.category THEN
+        NEW.content_updated_at := NOW();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+SET search_path = public;
+
+DROP TRIGGER IF EXISTS trg_pulse_inventory_content_updated ON pulse_inventory;
+CREATE TRIGGER trg_pulse_inventory_content_updated
+BEFORE INSERT OR UPDATE ON pulse_inventory
+FOR EACH ROW EXECUTE FUNCTION touch_content_updated_at();
+
+-- 2. Cheap null test so callers don't have to select the vector itself.
+ALTER TABLE pulse_inventory
+ADD COLUMN IF NOT EXISTS has_style_embedding BOOLEAN GENERATED ALWAYS AS (style_embedding IS NOT NULL) STORED;
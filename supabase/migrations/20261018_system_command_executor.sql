@@ -0,0 +1,22 @@
+-- Concurrent system command execution.
+-- The sentinel now runs dashboard commands on a worker pool instead of one at a time on its
+-- main loop, so each row records when it was claimed, a heartbeat and the latest output line,
+-- and can be cancelled from the dashboard.
+
+ALTER TABLE system_commands ADD COLUMN IF NOT EXISTS started_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE system_commands ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE system_commands ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE system_commands ADD COLUMN IF NOT EXISTS progress TEXT;
+ALTER TABLE system_commands ADD COLUMN IF NOT EXISTS error TEXT;
+-- Set by the dashboard; the sentinel stops the command on its next heartbeat
+ALTER TABLE system_commands ADD COLUMN IF NOT EXISTS cancel_requested BOOLEAN NOT NULL DEFAULT FALSE;
+
+ALTER TABLE system_commands DROP CONSTRAINT IF EXISTS system_commands_status_check;
+ALTER TABLE system_commands ADD CONSTRAINT system_commands_status_check
+CHECK (status IN ('pending', 'running', 'completed', 'failed', 'cancelled'));
+
+-- Pending queue scan (oldest first) and the dashboard's recent-commands list
+CREATE INDEX IF NOT EXISTS idx_system_commands_status_created
+ON system_commands(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_system_commands_created
+ON system_commands(created_at DESC);
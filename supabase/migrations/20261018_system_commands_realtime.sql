@@ -0,0 +1,14 @@
+-- Push delivery of system commands.
+-- The sentinel subscribes to system_commands inserts over Supabase Realtime instead of
+-- polling every minute, so the table has to be part of the realtime publication.
+-- The sentinel connects with the service role key, which bypasses the admin-only RLS policy.
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_publication_tables
+        WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = 'system_commands'
+    ) THEN
+        ALTER PUBLICATION supabase_realtime ADD TABLE system_commands;
+    END IF;
+END $$;